@@ -0,0 +1,72 @@
+"""Encode and decode benchmark of the json codecs on a fleet payload.
+
+"stdlib text" is the path used before codecs: json.dumps to str for
+request bodies and requests' .json(), which decodes the bytes to text
+before json.loads, for responses.
+
+Run from the repository root:
+$ python -m benchmarks.bench_codec
+"""
+
+import json
+import timeit
+from ebapi.codec import codecs
+
+n_tstats = 25
+number = 50
+
+
+def make_payload(n):
+    """A thermostatList like the response of a program and runtime get."""
+    climates = [{"name": name, "climateRef": name.lower(), "coolTemp": 750,
+                 "heatTemp": 680, "isOccupied": True, "coolFan": "auto",
+                 "heatFan": "auto", "sensors": [{"id": "ei:0", "name": "Main"}]}
+                for name in ["Home", "Away", "Sleep"]]
+    runtime = {"connected": True, "actualTemperature": 712,
+               "actualHumidity": 41, "desiredHeat": 680, "desiredCool": 750,
+               "lastStatusModified": "2020-01-01 00:00:00"}
+    tstats = [{"identifier": "{:012d}".format(i),
+               "name": "Thermostat {}".format(i),
+               "program": {"schedule": [["home"] * 16 + ["away"] * 20 +
+                                        ["home"] * 8 + ["sleep"] * 4] * 7,
+                           "climates": climates},
+               "runtime": runtime,
+               "remoteSensors": [{"id": "ei:0", "type": "thermostat",
+                                  "capability": [{"type": "temperature",
+                                                  "value": "712"}]}]}
+              for i in range(n)]
+    return {"thermostatList": tstats, "status": {"code": 0, "message": ""}}
+
+
+def stdlib_text_encode(obj):
+    return json.dumps(obj).encode()
+
+
+def stdlib_text_decode(data):
+    return json.loads(data.decode("utf-8"))
+
+
+def report(name, encode, decode, payload, content):
+    enc = timeit.timeit(lambda: encode(payload), number=number) / number
+    dec = timeit.timeit(lambda: decode(content), number=number) / number
+    print("{:<12} {:>10.1f} {:>10.1f}".format(name, enc * 1e6, dec * 1e6))
+
+
+def main():
+    payload = make_payload(n_tstats)
+    content = json.dumps(payload).encode()
+    print("{} thermostats, {:.0f} kB".format(n_tstats, len(content) / 1024))
+    print("{:<12} {:>10} {:>10}".format("codec", "encode us", "decode us"))
+    report("stdlib text", stdlib_text_encode, stdlib_text_decode,
+           payload, content)
+    for name, codec_class in codecs.items():
+        try:
+            codec = codec_class()
+        except ImportError:
+            print("{:<12} not installed".format(name))
+            continue
+        report(name, codec.encode, codec.loads, payload, content)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Import time benchmark for ebapi.api_interface.
+
+Each run imports the SDK in a fresh interpreter without any ebapi
+environment variables. Exits non zero when the median import time is
+over the budget or a heavy dependency is imported eagerly.
+
+Run from the repository root:
+$ python -m benchmarks.bench_import
+"""
+
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+budget = 0.15
+runs = 7
+lazy_modules = ["pandas", "numpy", "requests", "aiohttp"]
+
+probe = """
+import json, sys, time
+start = time.perf_counter()
+import ebapi.api_interface
+elapsed = time.perf_counter() - start
+eager = [m for m in {modules} if m in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "eager": eager}}))
+"""
+
+
+def clean_env():
+    env = {k: v for k, v in os.environ.items()
+           if not k.startswith("EBAPI_") and k != "ECOBEE_APPLICATION_KEY"}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def time_import():
+    code = probe.format(modules=lazy_modules)
+    out = subprocess.run([sys.executable, "-c", code], env=clean_env(),
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def main():
+    results = [time_import() for _ in range(runs)]
+    median = statistics.median(r["elapsed"] for r in results)
+    eager = sorted(set(m for r in results for m in r["eager"]))
+    print("import ebapi.api_interface: {:.1f} ms median of {} runs (budget {:.0f} ms)".format(
+        median * 1000, runs, budget * 1000))
+    if eager:
+        print("eagerly imported: {}".format(", ".join(eager)))
+    if median > budget or eager:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Replay recorded traffic at full speed and break down where the SDK
+spends its time, to compare parsing and object construction across
+SDK versions on identical payloads.
+
+Without a cassette one is recorded from the local stub server first.
+Cassettes are only replayable with the --thermostats they were
+recorded with, as the token store is seeded with the same fleet.
+
+Run from the repository root:
+$ python -m benchmarks.bench_replay
+$ python -m benchmarks.bench_replay --cassette traffic.json.gz
+"""
+
+import os
+import shutil
+import argparse
+import tempfile
+
+os.environ.setdefault("ECOBEE_APPLICATION_KEY", "bench_app_key")
+
+from ebapi.api_interface import ApiInterface
+from ebapi.cassette import CassetteTransport
+from ebapi.stub_server import StubServer, StubApi
+from ebapi.tokens import FileTokens
+from ebapi.tracing import RecordingTracer
+from ebapi.transport import RequestsTransport
+
+rounds = 20
+
+
+def run_calls(interface, identifiers):
+    interface.get_program_many(identifiers)
+    interface.get_vacations_many(identifiers)
+    interface.get_temp_many(identifiers)
+
+
+def record(path, api):
+    server = StubServer(api).start()
+    interface = ApiInterface(transport=CassetteTransport(path, RequestsTransport()),
+                             url_base=server.url_base)
+    try:
+        run_calls(interface, api.get_identifiers())
+    finally:
+        interface.conn.close()
+        server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ebapi replay benchmark")
+    parser.add_argument("--cassette")
+    parser.add_argument("--thermostats", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp()
+    os.environ[FileTokens.user_ev] = os.path.join(tmp_dir, "user.csv")
+    os.environ[FileTokens.tstat_ev] = os.path.join(tmp_dir, "tstat.csv")
+    try:
+        path = args.cassette or os.path.join(tmp_dir, "traffic.json.gz")
+        api = StubApi(n_thermostats=args.thermostats, n_users=2)
+        api.register(FileTokens())
+        if not os.path.exists(path):
+            record(path, api)
+        print("cassette {}, {:.0f} kB".format(path, os.path.getsize(path) / 1024))
+        tracer = RecordingTracer()
+        transport = CassetteTransport(path)
+        interface = ApiInterface(transport=transport, tracer=tracer,
+                                 url_base="http://replay/")
+        identifiers = api.get_identifiers()
+        for _ in range(rounds):
+            transport.cassette.rewind()
+            run_calls(interface, identifiers)
+        print("{} rounds of program, vacation and temp reads for {} thermostats".format(
+            rounds, len(identifiers)))
+        print("{:<12} {:>8} {:>10} {:>12}".format("phase", "count", "total ms", "per call us"))
+        for name, phase in tracer.breakdown().items():
+            print("{:<12} {:>8} {:>10.1f} {:>12.1f}".format(
+                name, phase["count"], phase["seconds"] * 1e3,
+                phase["seconds"] / phase["count"] * 1e6))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Benchmark of schedule transforms over many programs.
+
+Parses schedules, replaces a weekday range, collapses every day and
+serializes back to json, as a fleet program transform does.
+
+Run from the repository root:
+$ python -m benchmarks.bench_schedule
+"""
+
+import timeit
+import datetime as dt
+from ebapi.schedule import Schedule
+
+n_schedules = 2000
+week = [["sleep"] * 12 + ["home"] * 4 + ["away"] * 20 + ["home"] * 10 +
+        ["sleep"] * 2] * 5 + [["sleep"] * 16 + ["home"] * 32] * 2
+
+
+def transform(weeks):
+    for week_schedule in weeks:
+        schedule = Schedule(week_schedule)
+        schedule.replace_weekdays(dt.time(9), dt.time(17), "smart1")
+        for day_num in range(7):
+            schedule.collapse(day_num)
+        schedule.to_json()
+
+
+def main():
+    weeks = [[list(day) for day in week] for _ in range(n_schedules)]
+    seconds = min(timeit.repeat(lambda: transform(weeks), number=1, repeat=3))
+    print("{} schedules: {:.3f} s, {:.1f} us per schedule".format(
+        n_schedules, seconds, seconds / n_schedules * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Throughput benchmarks of ApiInterface against the local stub server.
+
+Measures reads and writes per second, send_functions batching and
+token refreshes while requests are in flight. Latency is the simulated
+round trip of the stub server.
+
+Run from the repository root:
+$ python -m benchmarks.bench_stub
+$ python -m benchmarks.bench_stub --thermostats 500 --latency 0.05
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+os.environ.setdefault("ECOBEE_APPLICATION_KEY", "bench_app_key")
+
+from ebapi.api_interface import ApiInterface
+from ebapi.fleet import FleetRunner
+from ebapi.stub_server import StubServer
+from ebapi.tokens import FileTokens
+
+
+def report(name, count, seconds, unit):
+    print("{:<36} {:>8} {:>9.2f} s {:>10.1f} {}/s".format(
+        name, count, seconds, count / seconds, unit))
+
+
+def run_fleet(interface, workers, method, identifiers, *args):
+    """Return the seconds a FleetRunner takes, exiting on failures."""
+    run = FleetRunner(interface, workers).run(method, identifiers, *args)
+    run.collect()
+    if run.summary.failed():
+        raise SystemExit("{} of {} calls failed\n{}".format(
+            run.summary.failed(), run.summary.total(), run.summary))
+    return run.summary.wall_time
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_reads(interface, identifiers, workers):
+    seconds = run_fleet(interface, workers, "get_settings", identifiers)
+    report("get_settings, one per thermostat", len(identifiers), seconds, "reads")
+    _, seconds = timed(interface.get_settings_many, identifiers)
+    report("get_settings_many", len(identifiers), seconds, "reads")
+
+
+def bench_writes(interface, identifiers, workers):
+    seconds = run_fleet(interface, workers, "update_settings", identifiers,
+                        {"disablePreCooling": True})
+    report("update_settings, one per thermostat", len(identifiers), seconds,
+           "writes")
+    results, seconds = timed(interface.update_settings_many,
+                             {"disablePreCooling": False}, identifiers)
+    if not all(result.succeeded() for result in results.values()):
+        raise SystemExit("update_settings_many failed")
+    report("update_settings_many", len(identifiers), seconds, "writes")
+
+
+def bench_functions(interface, server, identifier, n_functions):
+    functions = [{"type": "resumeProgram", "params": {"resumeAll": False}}] * n_functions
+    before = server.api.requests.get("thermostat", 0)
+    _, seconds = timed(interface.conn.send_functions, functions, identifier)
+    requests = server.api.requests["thermostat"] - before
+    report("send_functions, {} requests".format(requests), n_functions,
+           seconds, "functions")
+
+
+def bench_functions_many(interface, server, identifiers):
+    functions = [{"type": "resumeProgram", "params": {"resumeAll": False}}]
+    before = server.api.requests.get("thermostat", 0)
+    _, seconds = timed(interface.conn.send_functions_many, functions, identifiers)
+    requests = server.api.requests["thermostat"] - before
+    report("send_functions_many, {} requests".format(requests), len(identifiers),
+           seconds, "thermostats")
+
+
+def bench_refresh(interface, server, identifiers, workers):
+    server.api.expire_tokens()
+    before = server.api.requests.get("token", 0)
+    seconds = run_fleet(interface, workers, "get_settings", identifiers)
+    refreshes = server.api.requests["token"] - before
+    report("reads after expiry, {} refreshes".format(refreshes),
+           len(identifiers), seconds, "reads")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ebapi stub server benchmarks")
+    parser.add_argument("--thermostats", type=int, default=200)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--functions", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp()
+    os.environ[FileTokens.user_ev] = os.path.join(tmp_dir, "user.csv")
+    os.environ[FileTokens.tstat_ev] = os.path.join(tmp_dir, "tstat.csv")
+    server = StubServer(n_thermostats=args.thermostats, n_users=args.users,
+                        latency=args.latency).start()
+    interface = ApiInterface(url_base=server.url_base)
+    try:
+        server.api.register(interface.conn.tokens)
+        identifiers = server.api.get_identifiers()
+        print("{} thermostats, {} users, {:.0f} ms latency, {} workers".format(
+            args.thermostats, args.users, args.latency * 1000, args.workers))
+        bench_reads(interface, identifiers, args.workers)
+        bench_writes(interface, identifiers, args.workers)
+        bench_functions(interface, server, identifiers[0], args.functions)
+        bench_functions_many(interface, server, identifiers)
+        bench_refresh(interface, server, identifiers, args.workers)
+    finally:
+        interface.conn.close()
+        server.stop()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Micro benchmarks of FileTokens access token lookups and inserts.
+
+Run from the repository root:
+$ python -m benchmarks.bench_tokens
+"""
+
+import os
+import shutil
+import tempfile
+import timeit
+import pandas as pd
+from ebapi.tokens import FileTokens
+
+fleet_sizes = [1000, 100000]
+n_lookups = 200
+n_inserts = 5
+
+
+def legacy_lookup(tokens, tstat_id):
+    """The DataFrame scan get_access_token used before the dict index."""
+    user_id = tokens.tstat.loc[tstat_id, "user_id"]
+    row_counts = tokens.user.index.value_counts()
+    if row_counts[user_id] > 1:
+        raise ValueError("Corrupted State Multiple rows found for User {}".format(user_id))
+    return tokens.user.loc[user_id, "access_token"]
+
+
+def write_fleet(tmp_dir, n):
+    user_ids = [str(i) for i in range(n)]
+    tstat_ids = ["{:012d}".format(i) for i in range(n)]
+    user = pd.DataFrame({"user_id": user_ids,
+                         "access_token": ["acc" + u for u in user_ids],
+                         "refresh_token": ["ref" + u for u in user_ids]})
+    tstat = pd.DataFrame({"tstat_id": tstat_ids, "user_id": user_ids})
+    os.environ[FileTokens.user_ev] = os.path.join(tmp_dir, "user.csv")
+    os.environ[FileTokens.tstat_ev] = os.path.join(tmp_dir, "tstat.csv")
+    user.to_csv(os.environ[FileTokens.user_ev], index=False)
+    tstat.to_csv(os.environ[FileTokens.tstat_ev], index=False)
+    return tstat_ids
+
+
+def report(name, seconds, n, unit):
+    print("{:<20} {:>12.2f} us/{}".format(name, seconds / n * 1e6, unit))
+
+
+def insert_users(tokens, n_users, n):
+    for i in range(n):
+        user_id = str(n_users + i)
+        tokens.insert_user(user_id, "acc" + user_id, "ref" + user_id)
+        tokens.insert_tstat(user_id, "{:012d}".format(n_users + i))
+
+
+def bench_fleet(n_users):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tstat_ids = write_fleet(tmp_dir, n_users)
+        tokens = FileTokens()
+        sample = tstat_ids[::n_users // n_lookups][:n_lookups]
+        print("FileTokens, {} users".format(n_users))
+        legacy = timeit.timeit(lambda: [legacy_lookup(tokens, t) for t in sample],
+                               number=1)
+        report("DataFrame scan", legacy, len(sample), "lookup")
+        indexed = timeit.timeit(lambda: [tokens.get_access_token(t) for t in sample],
+                                number=1)
+        report("dict index", indexed, len(sample), "lookup")
+        print("lookup speedup {:.0f}x".format(legacy / indexed))
+        inserts = timeit.timeit(lambda: insert_users(tokens, n_users, n_inserts),
+                                number=1)
+        report("insert and save", inserts, n_inserts, "user")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    for n_users in fleet_sizes:
+        bench_fleet(n_users)
+
+
+if __name__ == "__main__":
+    main()
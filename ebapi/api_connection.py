@@ -1,46 +1,180 @@
 """A connection to the ecobee API."""
 
-import os
-import requests
 import json
 import copy
-from .tokens import FileTokens as Tokens
-import sys
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .config import get_app_key
+from .cache import make_key
+from .codec import get_codec
+from .fleet import FleetResult
+from .metrics import NullMetrics
+from .tracing import NullTracer
+from .tokens import get_backend, parse_tokens
 import logging
 
+# Serialization error, invalid request format, validation error and
+# invalid function.
+rejected_codes = (4, 5, 7, 8)
 url_base = 'https://api.ecobee.com/'
 version = '1/'
-app_key = os.environ["ECOBEE_APPLICATION_KEY"]
 
 logger = logging.getLogger(__name__)
 
-if app_key == "":
-    raise ValueError("Appliection KEY has not been initilized. Please set a ECOBEE_APPLICATION_KEY enviornment variable")
-
 class ApiConnection:
     """A connection to send requests to the Ecobee API.
 
     This module presumes that you are only ever
     sending and reciving from one thermostat"""
 
-    url = url_base + version + 'thermostat'
     basic_selection = {"selectionType": "thermostats"}
-
-    def __init__(self, verbose=False):
-        self.tokens = Tokens()
+    max_selection_size = 25
+    max_functions_size = 10
+    functions_concurrency = 1
+    writes_concurrency = 4
+    refresh_margin = 60
+
+    def __init__(self, verbose=False, transport=None, url_base=url_base,
+                 tokens=None, cache=None, codec=None, metrics=None,
+                 tracer=None, retry=None, singleflight=None):
+        """Create a connection.
+
+        transport defaults to a pooled RequestsTransport, pass another
+        Transport or a url_base to talk to a stub server. tokens defaults
+        to the store named by the EBAPI_TOKENS_BACKEND environment
+        variable. Both defaults are only built when first used. Pass a
+        ResponseCache as cache to reuse get responses. codec defaults to
+        the fastest installed json Codec. Pass a MetricsSink such as a
+        MetricsRegistry as metrics to record request metrics and a
+        RecordingTracer as tracer to time the phases of each request.
+        Pass a RetryPolicy as retry to rate limit requests and retry
+        throttled and failed ones, otherwise every failure raises. Pass a
+        SingleFlight as singleflight to share one request between
+        concurrent identical gets."""
+        self._tokens = tokens
+        self._transport = transport
+        self._codec = codec
+        self.metrics = NullMetrics() if metrics is None else metrics
+        self.tracer = NullTracer() if tracer is None else tracer
+        self.cache = cache
+        self.retry = retry
+        self.singleflight = singleflight
+        self.url_base = url_base
+        self.url = url_base + version + 'thermostat'
+        self.summary_url = url_base + version + 'thermostatSummary'
+        self.report_url = url_base + version + 'runtimeReport'
+        self.refresh_locks = {}
+        self.refresh_locks_guard = threading.Lock()
+        # Guards building the lazy defaults, so threads share one of each.
+        self.init_lock = threading.RLock()
+        self.write_generations = {}
+        self.write_generations_lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            with self.init_lock:
+                if self._tokens is None:
+                    self._tokens = get_backend()()
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self._tokens = tokens
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            with self.init_lock:
+                if self._transport is None:
+                    self._transport = self.default_transport()
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    @property
+    def codec(self):
+        if self._codec is None:
+            with self.init_lock:
+                if self._codec is None:
+                    self._codec = get_codec()
+        return self._codec
+
+    @codec.setter
+    def codec(self, codec):
+        self._codec = codec
+
+    def default_transport(self):
+        from .transport import RequestsTransport
+        return RequestsTransport()
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def refresh_tokens(self):
-        self.tokens.refresh()
+        """Refresh every user's tokens, return the users that failed."""
+        return self.tokens.refresh(self.refresh_user_tokens)
+
+    def refresh_user_tokens(self, ref_token):
+        """Exchange ref_token for new
+        (access_token, refresh_token, expires_at) tokens."""
+        url = self.url_base + "token"
+        try:
+            resp = self.transport.post(url, **format_refresh_tokens(ref_token))
+            new_tokens = parse_tokens(resp.json())
+        except Exception:
+            self.metrics.inc("ebapi_token_refreshes_total", outcome="failed")
+            raise
+        self.metrics.inc("ebapi_token_refreshes_total", outcome="ok")
+        return new_tokens
+
+    def refresh_user(self, user_id, stale_token):
+        """Refresh the tokens of user_id unless stale_token was already
+        replaced, and return the current access token.
+
+        Concurrent callers for one user wait on a single refresh and
+        then find the new token instead of refreshing again."""
+        with self.get_refresh_lock(user_id):
+            current = self.tokens.lookup_access_token(user_id)
+            if current != stale_token:
+                return current
+            logger.info("Refreshing tokens for User {}".format(user_id))
+            new_tokens = self.tokens.refresh_user(user_id, self.refresh_user_tokens)
+            return new_tokens[0]
+
+    def get_refresh_lock(self, user_id):
+        with self.refresh_locks_guard:
+            return self.refresh_locks.setdefault(user_id, threading.Lock())
+
+    def get_fresh_access_token(self, identifier):
+        """Return the access token of identifier, refreshing it first if
+        it expires within refresh_margin seconds."""
+        user_id, access_token, expires_at = self.tokens.get_token_info(identifier)
+        if expires_soon(expires_at, self.refresh_margin):
+            try:
+                access_token = self.refresh_user(user_id, access_token)
+            except Exception as err:
+                logger.warning("Early token refresh failed for User {}: {}".format(user_id, err))
+        return access_token
 
     def gen_headers(self, identifier):
-        access_token = self.tokens.get_access_token(identifier)
-        headers = {"Content-Type": "application/json;charset=UTF-8",
-                   "Authorization": "Bearer " + str(access_token)}
-        return headers
+        access_token = self.get_fresh_access_token(identifier)
+        return format_headers(access_token)
 
     def format_selection(self, identifier):
         selection = copy.deepcopy(self.basic_selection)
-        selection["selectionMatch"] = identifier
+        selection["selectionMatch"] = format_identifiers(identifier)
         return selection
 
     def add_selection(self, body, identifier):
@@ -55,62 +189,338 @@ class ApiConnection:
         return body
 
     def send_get(self, body, identifier):
-        headers = self.gen_headers(identifier)
-        body = self.add_selection(body, identifier)
-        params = {'format': 'json', 'body': json.dumps(body)}
-        kwargs = {"headers": headers,
-                  "params": params}
-        resp = self.attempt(requests.get, identifier, **kwargs)
-        return resp["thermostatList"][0]
+        if self.cache is not None:
+            resp = self.cache.get(identifier, body)
+            if resp is not None:
+                return resp
+            generation = self.cache.get_generation(identifier)
+        resp = self.send_get_list(copy.deepcopy(body), identifier)[0]
+        if self.cache is not None:
+            self.cache.put(identifier, body, resp, generation)
+        return resp
 
-    def send_post(self, body, identifier):
-        headers = self.gen_headers(identifier)
-        body = self.add_selection(body, identifier)
+    def send_get_many(self, body, identifiers):
+        """Send the get body for many thermostats in as few requests as possible.
+
+        Identifiers are grouped by owning user, as every identifier in
+        one request shares an access token, then split into chunks of
+        max_selection_size. Returns a dict of thermostat json keyed by
+        identifier."""
+        results = {}
+        if self.cache is not None:
+            identifiers = self.get_cached(body, identifiers, results)
+            generations = {identifier: self.cache.get_generation(identifier)
+                           for identifier in identifiers}
+        for chunk in self.get_selection_chunks(identifiers):
+            tstats = self.send_get_list(copy.deepcopy(body), chunk)
+            for tstat in tstats:
+                results[tstat["identifier"]] = tstat
+                if self.cache is not None:
+                    self.cache.put(tstat["identifier"], body, tstat,
+                                   generations.get(tstat["identifier"]))
+        return results
+
+    def get_cached(self, body, identifiers, results):
+        """Put cached responses in results and return the identifiers
+        that still need a request."""
+        missing = []
+        for identifier in identifiers:
+            resp = self.cache.get(identifier, body)
+            if resp is None:
+                missing.append(identifier)
+            else:
+                results[identifier] = resp
+        return missing
+
+    def send_get_list(self, body, identifier):
+        """Return the thermostatList for one identifier or a list of
+        identifiers belonging to the same user."""
+        if self.singleflight is None:
+            return self.get_list(body, identifier)
+        key = self.get_singleflight_key(body, identifier)
+        return self.singleflight.do(key, lambda: self.get_list(body, identifier))
+
+    def get_singleflight_key(self, body, identifier):
+        """Return the key of a get, which includes the write generations
+        of its thermostats so a get never joins one sent before a write."""
+        return make_key(format_identifiers(identifier), body) + (
+            self.get_write_generations(identifier),)
+
+    def get_write_generations(self, identifier):
+        with self.write_generations_lock:
+            return tuple(self.write_generations.get(tstat_id, 0)
+                         for tstat_id in split_identifiers(identifier))
+
+    def record_write(self, identifier):
+        """Bump the write generations of identifier, a thermostat or
+        list of them, and drop their cached responses."""
+        with self.write_generations_lock:
+            for tstat_id in split_identifiers(identifier):
+                self.write_generations[tstat_id] = self.write_generations.get(tstat_id, 0) + 1
+        if self.cache is not None:
+            self.cache.invalidate(identifier)
+
+    def get_list(self, body, identifier):
+        token_id = get_token_identifier(identifier)
+        with self.tracer.span("send_get",
+                              identifier=format_identifiers(identifier)):
+            kwargs = self.format_get(body, identifier)
+            self.record_batch("selection", identifier)
+            resp = self.attempt(self.transport.get, token_id, **kwargs)
+        return resp["thermostatList"]
+
+    def send_summary(self, identifier):
+        """Return the thermostatSummary revisionList for one identifier
+        or a list of identifiers belonging to the same user."""
+        token_id = get_token_identifier(identifier)
+        with self.tracer.span("send_summary",
+                              identifier=format_identifiers(identifier)):
+            kwargs = self.format_get({}, identifier)
+            resp = self.attempt(self.transport.get, token_id,
+                                url=self.summary_url, **kwargs)
+        return resp["revisionList"]
+
+    def send_summary_many(self, identifiers):
+        """Return a dict of revision strings keyed by identifier, using
+        one summary request per user and chunk of identifiers."""
+        revisions = {}
+        for chunk in self.get_selection_chunks(identifiers):
+            for revision in self.send_summary(chunk):
+                revisions[revision.split(":", 1)[0]] = revision
+        return revisions
+
+    def send_report(self, body, identifier):
+        """Return the runtimeReport reportList for one identifier or a
+        list of identifiers belonging to the same user."""
+        token_id = get_token_identifier(identifier)
+        with self.tracer.span("send_report",
+                              identifier=format_identifiers(identifier)):
+            kwargs = self.format_get(body, identifier)
+            resp = self.attempt(self.transport.get, token_id,
+                                url=self.report_url, **kwargs)
+        return resp["reportList"]
+
+    def format_get(self, body, identifier):
+        """Return the request kwargs for a get to identifier."""
+        with self.tracer.span("headers"):
+            headers = self.gen_headers(get_token_identifier(identifier))
+        with self.tracer.span("selection"):
+            body = self.add_selection(body, identifier)
+        with self.tracer.span("encode"):
+            params = {'format': 'json', 'body': self.codec.dumps(body)}
+        return {"headers": headers,
+                "params": params}
+
+    def format_post(self, body, identifier):
+        """Return the request kwargs for a post to identifier."""
+        with self.tracer.span("headers"):
+            headers = self.gen_headers(get_token_identifier(identifier))
+        with self.tracer.span("selection"):
+            body = self.add_selection(body, identifier)
+        with self.tracer.span("encode"):
+            data = self.codec.encode(body)
         params = {'format': 'json'}
-        kwargs = {"headers": headers,
-                  "params": params,
-                  "data": json.dumps(body)}
-        return self.attempt(requests.post, identifier,  **kwargs)
+        return {"headers": headers,
+                "params": params,
+                "data": data}
+
+    def get_selection_chunks(self, identifiers):
+        """Yield lists of identifiers that can share one selection."""
+        for user_tstats in self.group_by_user(identifiers).values():
+            for chunk in get_chunks(user_tstats, self.max_selection_size):
+                yield chunk
+
+    def group_by_user(self, identifiers):
+        """Return a dict of user_id to the identifiers that user owns."""
+        groups = {}
+        for identifier in dict.fromkeys(identifiers):
+            user_id = self.tokens.get_user_id(identifier)
+            groups.setdefault(user_id, []).append(identifier)
+        return groups
+
+    def send_post(self, body, identifier):
+        try:
+            with self.tracer.span("send_post",
+                                  identifier=format_identifiers(identifier)):
+                kwargs = self.format_post(body, identifier)
+                return self.attempt(self.transport.post,
+                                    get_token_identifier(identifier), **kwargs)
+        finally:
+            self.record_write(identifier)
+
+    def send_post_many(self, body, identifiers, max_concurrency=None):
+        """Post body to many thermostats in as few requests as possible.
+
+        Identifiers are grouped by owning user and split into chunks of
+        max_selection_size, as in send_get_many, and up to
+        max_concurrency chunks are posted at once. A chunk the API
+        rejects is split in halves and posted again until the failing
+        thermostats are found. Returns a dict of FleetResults keyed by
+        identifier."""
+        results = {}
+        jobs = [(body, chunk) for chunk in self.get_selection_chunks(identifiers)]
+        self.run_jobs(self.post_chunk, jobs, max_concurrency, results)
+        return results
+
+    def post_chunk(self, body, identifiers, results):
+        start = time.perf_counter()
+        try:
+            resp = self.send_post(copy.deepcopy(body), identifiers)
+        except Exception as err:
+            if is_rejected(err) and len(identifiers) > 1:
+                middle = len(identifiers) // 2
+                self.post_chunk(body, identifiers[:middle], results)
+                self.post_chunk(body, identifiers[middle:], results)
+                return
+            add_results(results, identifiers, start, error=err)
+        else:
+            add_results(results, identifiers, start, result=resp)
 
     def attempt(self, func, identifier,  **kwargs):
-        self.log_attempt(func, identifier, **kwargs)
+        self.log_attempt(func, identifier, kwargs)
         try:
-            resp = self.send_request(func, **kwargs)
+            resp = self.send_request(func, identifier=identifier, **kwargs)
         except ExpiredTokenError:
-            self.refresh_tokens()
+            self.metrics.inc("ebapi_retries_total", reason="expired_token")
+            user_id = self.tokens.get_user_id(identifier)
+            self.refresh_user(user_id, get_bearer_token(kwargs["headers"]))
             kwargs["headers"] = self.gen_headers(identifier)
-            resp = self.send_request(func, **kwargs)
+            resp = self.send_request(func, identifier=identifier, **kwargs)
         return resp
 
-    def log_attempt(self, func, identifier, **kwargs):
-        log = "Running {} request\n".format(func.__name__)
-        log += "On Thermostat {}\n".format(identifier)
-        log += "Args:\n"
-        log += format_dict(kwargs)
-        logger.debug(log)
-    
-    def send_request(self, func, **kwargs):
-        # API response codes
-        EXPIRED_TOKEN = 14
-        SUCCESS = 0
-        resp = func(self.url, **kwargs).json()
-        code = resp["status"]["code"]
-        if code == SUCCESS:
-            return resp
-        elif code == EXPIRED_TOKEN:
-            raise ExpiredTokenError("Access token is expired")
+    def log_attempt(self, func, identifier, kwargs):
+        """Log a request with the access token redacted.
+
+        Nothing is built when debug logging is off. The message is only
+        rendered by a handler, the request is also attached as the
+        method, thermostat and request fields of the record."""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        request = redact(kwargs)
+        logger.debug("Running %s request\nOn Thermostat %s\nArgs:\n%s",
+                     func.__name__, identifier, LazyFormat(request),
+                     extra={"method": func.__name__,
+                            "thermostat": identifier,
+                            "request": request})
+
+    def send_request(self, func, url=None, identifier=None, **kwargs):
+        url = url or self.url
+        if self.retry is None:
+            return self.send_once(func, url, kwargs)
+        user_id = None
+        if identifier is not None and self.retry.limiter is not None:
+            user_id = self.tokens.get_user_id(identifier)
+        return self.retry.call(lambda: self.send_once(func, url, kwargs),
+                               func.__name__, user_id, self.record_retry)
+
+    def send_once(self, func, url, kwargs):
+        with self.tracer.span("network", method=func.__name__, url=url):
+            start = time.perf_counter()
+            resp = func(url, **kwargs)
+            elapsed = time.perf_counter() - start
+        return self.read_response(func, url, kwargs, resp, elapsed)
+
+    def read_response(self, func, url, kwargs, resp, elapsed):
+        """Decode resp, record its metrics and check its status."""
+        with self.tracer.span("decode"):
+            jsn = decode_response(self.codec, resp)
+        if self.metrics.enabled:
+            self.record_request(func.__name__, url, kwargs, resp, jsn, elapsed)
+        if jsn is None:
+            raise get_http_error(resp)
+        return check_response(jsn)
+
+    def record_request(self, method, url, kwargs, resp, jsn, elapsed):
+        endpoint = url.rsplit("/", 1)[-1]
+        if jsn is None:
+            code = "http_{}".format(resp.status_code)
         else:
-            msg = resp["status"]["message"]
-            raise ApiError("Api Request Failed With Code: {}\n{}".format(code, msg))
-
-    def send_functions(self, functions, identifier):
-        batches = get_chunks(functions, 10)
-        results = []
-        for batch in batches:
-            body = {"functions": batch}
-            result = self.send_post(body, identifier)
-            results.append(result)
-        return results
+            code = jsn["status"]["code"]
+        self.metrics.observe("ebapi_request_seconds", elapsed,
+                             endpoint=endpoint, method=method)
+        self.metrics.inc("ebapi_responses_total", endpoint=endpoint, code=code)
+        self.metrics.inc("ebapi_request_bytes_total", get_request_size(kwargs),
+                         endpoint=endpoint)
+        self.metrics.inc("ebapi_response_bytes_total", len(resp.content),
+                         endpoint=endpoint)
+
+    def record_retry(self, reason):
+        self.metrics.inc("ebapi_retries_total", reason=reason)
+
+    def record_batch(self, kind, batch):
+        if self.metrics.enabled:
+            size = 1 if isinstance(batch, str) else len(batch)
+            self.metrics.observe("ebapi_batch_size", size, kind=kind)
+
+    def send_functions(self, functions, identifier, max_concurrency=None):
+        """Send functions to identifier in batches of max_functions_size.
+
+        Batches are sent in order unless max_concurrency, which defaults
+        to functions_concurrency, is above 1. Then that many are sent at
+        once and may be applied in any order. Returns the response of
+        every batch.
+
+        A batch the API rejects as invalid is split in halves and sent
+        again until the invalid functions are found, see is_rejected.
+        FunctionBatchError is raised with the error of each failed
+        function."""
+        batches = list(get_function_batches(functions, self.max_functions_size))
+        limit = max_concurrency or self.functions_concurrency
+        if limit <= 1:
+            jobs = [(batches, identifier)]
+        else:
+            jobs = [([batch], identifier) for batch in batches]
+        return self.run_function_jobs(jobs, limit)
+
+    def send_functions_many(self, functions, identifiers, max_concurrency=None):
+        """Send functions to every thermostat in identifiers.
+
+        Thermostats of one user share a request, as in send_get_many.
+        Up to max_concurrency chunks, writes_concurrency by default, are
+        sent at once, the batches of each chunk in order. A rejected
+        request is split by thermostat before function. See
+        send_functions."""
+        batches = list(get_function_batches(functions, self.max_functions_size))
+        jobs = [(batches, chunk) for chunk in self.get_selection_chunks(identifiers)]
+        return self.run_function_jobs(jobs, max_concurrency)
+
+    def run_function_jobs(self, jobs, max_concurrency):
+        """Post the batches of every (batches, identifier) job and return
+        the responses, raising FunctionBatchError if any function failed."""
+        failures = FunctionFailures()
+        results = self.run_jobs(self.post_function_batches, jobs,
+                                max_concurrency, failures)
+        failures.check()
+        return [resp for job_results in results for resp in job_results]
+
+    def post_function_batches(self, batches, identifier, failures):
+        return [self.post_functions(batch, identifier, failures)
+                for batch in batches]
+
+    def run_jobs(self, func, jobs, max_concurrency, *args):
+        """Return [func(*job, *args) for job in jobs], calling up to
+        max_concurrency, writes_concurrency by default, at once."""
+        limit = max_concurrency or self.writes_concurrency
+        if limit <= 1 or len(jobs) <= 1:
+            return [func(*job, *args) for job in jobs]
+        with ThreadPoolExecutor(max_workers=min(limit, len(jobs))) as pool:
+            futures = [pool.submit(contextvars.copy_context().run,
+                                   func, *job, *args) for job in jobs]
+            return [future.result() for future in futures]
+
+    def post_functions(self, batch, identifier, failures):
+        """Post a batch of (index, function) pairs, returning the response
+        or None once its failures are added to failures."""
+        self.record_batch("functions", batch)
+        try:
+            return self.send_post(format_functions(batch), identifier)
+        except Exception as err:
+            halves = split_function_job(batch, identifier, err)
+            if halves is None:
+                failures.add(batch, identifier, err)
+            for half_batch, half_identifier in halves or ():
+                self.post_functions(half_batch, half_identifier, failures)
+        return None
 
     def add_user(self):
         """Get tokens and add them to database.
@@ -124,9 +534,9 @@ class ApiConnection:
         print("Enter the PIN '{}' into the Add Application window and click Add Application".format(pin))
         input("waiting press enter to continue...")
 
-        access_token, refresh_token = self.get_tokens(code)
+        access_token, refresh_token, expires_at = self.get_tokens(code)
         user_id = self.tokens.get_next_user_id()
-        self.tokens.insert_user(user_id, access_token, refresh_token)
+        self.tokens.insert_user(user_id, access_token, refresh_token, expires_at)
         tstat_ids = self.get_tstat_ids(access_token)
         for tstat_id in tstat_ids:
             logger.info("Adding Thermostat ID: {}".format(tstat_id))
@@ -134,23 +544,15 @@ class ApiConnection:
 
 
     def get_tstat_ids(self, acc):
-        headers = {"Content-Type": "application/json;charset=UTF-8",
-                   "Authorization": "Bearer " + acc}
-        url = url_base + version + 'thermostat'
-        selection = {"selectionType": "registered", "selectionMatch": ""} 
-        params = {'format': 'json',
-                  'body': json.dumps({"selection": selection})}
-        resp = requests.get(url, headers=headers, params=params).json()
+        kwargs = format_tstat_ids(acc)
+        resp = self.transport.get(self.url, **kwargs).json()
         tstat_ids = [tstat['identifier'] for tstat in resp['thermostatList']]
         return tstat_ids
 
     def get_auth_pin(self):
         """Get an authorization pin for the ecobee binary schedule app."""
-        url = url_base + "authorize"
-        params = {"response_type": "ecobeePin",
-                  "client_id": app_key,
-                  "scope": "smartWrite"}
-        resp = requests.get(url, params=params)
+        url = self.url_base + "authorize"
+        resp = self.transport.get(url, **format_auth_pin())
         try:
             resp_json = resp.json()
         except:
@@ -159,10 +561,118 @@ class ApiConnection:
 
     def get_tokens(self, code):
         """Get the tokens for a user once they have entered the auth pin."""
-        url = url_base + "token"
-        params = {"grant_type": "ecobeePin", "code": code, "client_id": app_key}
-        temp = requests.post(url, params=params).json()
-        return (temp["access_token"], temp["refresh_token"])
+        url = self.url_base + "token"
+        temp = self.transport.post(url, **format_get_tokens(code)).json()
+        return parse_tokens(temp)
+
+
+def check_response(resp):
+    """Return resp if the API reported success, otherwise raise."""
+    # API response codes
+    EXPIRED_TOKEN = 14
+    SUCCESS = 0
+    code = resp["status"]["code"]
+    if code == SUCCESS:
+        return resp
+    elif code == EXPIRED_TOKEN:
+        raise ExpiredTokenError("Access token is expired", code=code)
+    else:
+        msg = resp["status"]["message"]
+        raise ApiError("Api Request Failed With Code: {}\n{}".format(code, msg),
+                       code=code)
+
+
+def decode_response(codec, resp):
+    """Return the json of resp, or None when it has no API status, as
+    for errors from a proxy or load balancer."""
+    try:
+        jsn = codec.loads(resp.content)
+    except ValueError:
+        return None
+    if not isinstance(jsn, dict) or "status" not in jsn:
+        return None
+    return jsn
+
+
+def get_http_error(resp):
+    return ApiError("Api Request Failed With HTTP Status: {}".format(resp.status_code),
+                    http_status=resp.status_code,
+                    retry_after=get_retry_after(resp.headers))
+
+
+def get_retry_after(headers):
+    """Return the seconds of a Retry-After header, or None."""
+    for key, val in (headers or {}).items():
+        if key.lower() == "retry-after":
+            try:
+                return max(float(val), 0)
+            except ValueError:
+                return None
+    return None
+
+
+def format_headers(access_token):
+    return {"Content-Type": "application/json;charset=UTF-8",
+            "Authorization": "Bearer " + str(access_token)}
+
+
+def get_bearer_token(headers):
+    """Return the access token sent in headers."""
+    return headers["Authorization"][len("Bearer "):]
+
+
+def expires_soon(expires_at, margin):
+    """Whether a token expiring at expires_at has under margin seconds left."""
+    return expires_at is not None and expires_at - time.time() < margin
+
+
+def format_tstat_ids(acc):
+    headers = format_headers(acc)
+    selection = {"selectionType": "registered", "selectionMatch": ""}
+    params = {'format': 'json',
+              'body': json.dumps({"selection": selection})}
+    return {"headers": headers, "params": params}
+
+
+def format_auth_pin():
+    params = {"response_type": "ecobeePin",
+              "client_id": get_app_key(),
+              "scope": "smartWrite"}
+    return {"params": params}
+
+
+def format_get_tokens(code):
+    params = {"grant_type": "ecobeePin", "code": code, "client_id": get_app_key()}
+    return {"params": params}
+
+
+def format_refresh_tokens(ref_token):
+    params = {"grant_type": "refresh_token",
+              "code": ref_token,
+              "client_id": get_app_key()}
+    return {"params": params}
+
+
+def format_identifiers(identifier):
+    """Join a list of identifiers into a comma separated selectionMatch."""
+    if isinstance(identifier, str):
+        return identifier
+    return ",".join(identifier)
+
+
+def split_identifiers(identifier):
+    """Return a thermostat identifier or list of them as a list."""
+    if isinstance(identifier, str):
+        return [identifier]
+    return list(identifier)
+
+
+def get_token_identifier(identifier):
+    """Return the identifier used to look up tokens for a selection."""
+    if isinstance(identifier, str):
+        return identifier
+    return identifier[0]
+
 
 def get_chunks(vals, size):
     """Break vals in to batches of length size."""
@@ -171,29 +681,140 @@ def get_chunks(vals, size):
 
 
 
+def get_function_batches(functions, size):
+    """Yield batches of (index, function) pairs."""
+    return get_chunks(list(enumerate(functions)), size)
+
+
+def format_functions(batch):
+    return {"functions": [function for _, function in batch]}
+
+
+def is_rejected(err):
+    """Return whether the API rejected a request as invalid, before
+    applying any of it.
+
+    Only these requests are split and sent again. After other failures,
+    like processing errors, part of a request may have been applied and
+    sending it again could repeat functions such as createVacation."""
+    return getattr(err, "code", None) in rejected_codes
+
+
+def add_results(results, identifiers, start, result=None, error=None):
+    """Add a FleetResult per identifier of a request started at start."""
+    elapsed = time.perf_counter() - start
+    for identifier in identifiers:
+        results[identifier] = FleetResult(identifier, result=result,
+                                          error=error, elapsed=elapsed)
+
+
+def split_function_job(batch, identifier, err):
+    """Return the two halves of a rejected (batch, identifier) job, or
+    None when it cannot be narrowed down further.
+
+    Only rejected requests are split, see is_rejected."""
+    if not is_rejected(err):
+        return None
+    if isinstance(identifier, list) and len(identifier) > 1:
+        middle = len(identifier) // 2
+        return [(batch, identifier[:middle]), (batch, identifier[middle:])]
+    if len(batch) > 1:
+        middle = len(batch) // 2
+        return [(batch[:middle], identifier), (batch[middle:], identifier)]
+    return None
+
+
+class FunctionFailures:
+    """Collects the errors of failed functions by thermostat and index."""
+
+    def __init__(self):
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add(self, batch, identifier, err):
+        identifiers = [identifier] if isinstance(identifier, str) else identifier
+        with self.lock:
+            for tstat_id in identifiers:
+                for index, _ in batch:
+                    self.errors.setdefault(tstat_id, {})[index] = err
+
+    def check(self):
+        if self.errors:
+            raise FunctionBatchError(self.errors)
+
+
+def get_request_size(kwargs):
+    """Return the bytes of the body and json params of a request."""
+    size = len(kwargs.get("data") or "")
+    params = kwargs.get("params") or {}
+    return size + len(params.get("body", ""))
+
+
+def redact(kwargs):
+    """Return request kwargs with the bearer token hidden."""
+    headers = kwargs.get("headers")
+    if not headers or "Authorization" not in headers:
+        return kwargs
+    kwargs = dict(kwargs)
+    kwargs["headers"] = dict(headers, Authorization="Bearer <redacted>")
+    return kwargs
+
+
+class LazyFormat:
+    """Formats a dict with format_dict when the log message is rendered."""
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+
+    def __str__(self):
+        return format_dict(self.dictionary)
+
+
 def format_dict(dictionary, depth=0):
     """Returns dictionaries to a formated string"""
+    parts = []
+    add_dict_parts(parts, dictionary, depth)
+    return "".join(parts)
+
+
+def add_dict_parts(parts, dictionary, depth):
     tab = " " * 4
-    string = "{\n"
+    parts.append("{\n")
     for key, val in dictionary.items():
-        string += depth * tab 
-        string += "{}: ".format(key)
+        parts.append(depth * tab)
+        parts.append("{}: ".format(key))
         if type(val) is dict:
-            string += format_dict(val, depth + 1)
-                
+            add_dict_parts(parts, val, depth + 1)
+        elif type(val) is str:
+            parts.append("'{}'\n".format(val))
         else:
-            if type(val) is str:
-                fmt = "'{}'\n"
-            else:
-                fmt = "{}\n"
-            string += fmt.format(val)
-    string += (depth) * tab + '}\n'
-    return string
+            parts.append("{}\n".format(val))
+    parts.append(depth * tab + "}\n")
+
+
 class ApiError(Exception):
+    """A failed request. code is the API status code, or http_status
+    the HTTP status when the response had no API status."""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, code=None, http_status=None, retry_after=None):
+
+        Exception.__init__(self, *args)
+        self.code = code
+        self.http_status = http_status
+        self.retry_after = retry_after
+
+
+class FunctionBatchError(ApiError):
+    """Some functions of send_functions failed. errors maps each
+    thermostat to a dict of the index of every failed function to its
+    error."""
+
+    def __init__(self, errors):
 
-        Exception.__init__(self, *args, **kwargs)
+        count = sum(len(failed) for failed in errors.values())
+        ApiError.__init__(self, "{} functions failed on {} thermostats".format(
+            count, len(errors)))
+        self.errors = errors
 
 
 class ExpiredTokenError(ApiError):
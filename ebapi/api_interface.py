@@ -10,8 +10,20 @@ from .vacation import from_json
 class ApiInterface:
     """This class abstracts formatting specific requests to the Ecobee API."""
 
-    def __init__(self, verbose=False):
-        self.conn = ApiConnection(verbose)
+    def __init__(self, verbose=False, **conn_kwargs):
+        self.conn = ApiConnection(verbose, **conn_kwargs)
+
+    def query(self, identifier):
+        """Return a SelectionQuery reading several parts of identifier,
+        or of a list of identifiers, in one request."""
+        from .query import SelectionQuery
+        return SelectionQuery(self.conn, identifier)
+
+    def buffer_writes(self, window=2.0):
+        """Return a WriteBuffer merging the settings and program updates
+        made to a thermostat within window seconds."""
+        from .write_buffer import WriteBuffer
+        return WriteBuffer(self.conn, window)
 
     def delete_vacations(self, names, identifier):
         """Delete vacations for thermostat identifer with name in names"""
@@ -42,78 +54,141 @@ class ApiInterface:
         body = {"thermostat": {"settings": settings}}
         return self.conn.send_post(body, identifier)
 
+    def update_settings_many(self, settings, identifiers):
+        """Set settings on every thermostat in identifiers, one request per
+        chunk of a user's thermostats. Returns a dict of FleetResults
+        keyed by identifier."""
+        body = {"thermostat": {"settings": settings}}
+        return self.conn.send_post_many(body, identifiers)
+
+    def update_disable_precool_setting_many(self, identifiers, cool_flag):
+        """Set the disablePreCooling setting of identifiers to cool_flag."""
+        body = {"disablePreCooling": cool_flag}
+        return self.update_settings_many(body, identifiers)
+
+    def update_program_many(self, program, identifiers):
+        """Send program to every thermostat in identifiers."""
+        body = {"thermostat": {"program": program.to_json()}}
+        return self.conn.send_post_many(body, identifiers)
+
     def get_times(self, identifier):
         body = {}
         resp = self.conn.send_get(body, identifier)
-        resp_json = {"utc": resp["utcTime"],
-                     "local": resp["thermostatTime"]}
-        return resp_json
+        return parse_times(resp)
+
+    def get_times_many(self, identifiers):
+        resps = self.conn.send_get_many({}, identifiers)
+        return map_values(parse_times, resps)
 
     def get_lat_lon(self, identifier):
         body = {"selection": {"includeLocation": True}}
         resp = self.conn.send_get(body, identifier)
-        return {"lat_long": resp["location"]["mapCoordinates"]}
+        return parse_lat_lon(resp)
+
+    def get_lat_lon_many(self, identifiers):
+        body = {"selection": {"includeLocation": True}}
+        resps = self.conn.send_get_many(body, identifiers)
+        return map_values(parse_lat_lon, resps)
 
     def get_program(self, identifier):
         p_json = self.get_program_json(identifier)
-        sched = Schedule(p_json["program"]["schedule"])
-        climates = [Climate(c) for c in p_json["program"]["climates"]]
-        prog = Program(sched, climates)
-        return prog
+        with self.conn.tracer.span("construct", identifier=identifier):
+            return parse_program(p_json)
+
+    def get_program_many(self, identifiers):
+        p_jsons = self.get_program_json_many(identifiers)
+        with self.conn.tracer.span("construct", count=len(p_jsons)):
+            return map_values(parse_program, p_jsons)
 
     def get_program_json(self, identifier):
         body = {"selection": {"includeProgram": True}}
         return self.conn.send_get(body, identifier)
 
+    def get_program_json_many(self, identifiers):
+        body = {"selection": {"includeProgram": True}}
+        return self.conn.send_get_many(body, identifiers)
+
     def get_settings(self, identifier):
         body = {"selection": {"includeSettings": True}}
         resp = self.conn.send_get(body, identifier)
         return resp['settings']
 
+    def get_settings_many(self, identifiers):
+        body = {"selection": {"includeSettings": True}}
+        resps = self.conn.send_get_many(body, identifiers)
+        return map_values(lambda resp: resp["settings"], resps)
+
     def get_sensors(self, identifier):
         body = {"selection": {"includeSensors": True}}
         resp = self.conn.send_get(body, identifier)
         sensors = resp["remoteSensors"]
         return sensors
 
+    def get_sensors_many(self, identifiers):
+        body = {"selection": {"includeSensors": True}}
+        resps = self.conn.send_get_many(body, identifiers)
+        return map_values(lambda resp: resp["remoteSensors"], resps)
+
     def get_vacations(self, identifier):
         events = self.get_events(identifier)
-        rt_events = []
-        for event in events:
-            if event["type"] == "vacation":
-                vac = from_json(event)
-                rt_events.append(vac)
-        return rt_events
+        with self.conn.tracer.span("construct", identifier=identifier):
+            return parse_vacations(events)
+
+    def get_vacations_many(self, identifiers):
+        events = self.get_events_many(identifiers)
+        with self.conn.tracer.span("construct", count=len(events)):
+            return map_values(parse_vacations, events)
 
     def get_events(self, identifier):
         body = {"selection": {"includeEvents": True}}
         resp = self.conn.send_get(body, identifier)
         return resp["events"]
 
+    def get_events_many(self, identifiers):
+        body = {"selection": {"includeEvents": True}}
+        resps = self.conn.send_get_many(body, identifiers)
+        return map_values(lambda resp: resp["events"], resps)
+
     def get_extended_runtime(self, identifier):
         body = {"selection": {"includeExtendedRuntime": True}}
         resp = self.conn.send_get(body, identifier)
         return resp["extendedRuntime"]
 
+    def get_extended_runtime_many(self, identifiers):
+        body = {"selection": {"includeExtendedRuntime": True}}
+        resps = self.conn.send_get_many(body, identifiers)
+        return map_values(lambda resp: resp["extendedRuntime"], resps)
+
     def get_runtime_and_sensors(self, identifier):
         body = {"selection": {"includeRuntime": True,
                               "includeSensors": True}}
         resp = self.conn.send_get(body, identifier)
-        resp_json = {"runtime": resp["runtime"],
-                     "sensors": resp["remoteSensors"]}
-        return resp_json
+        return parse_runtime_and_sensors(resp)
+
+    def get_runtime_and_sensors_many(self, identifiers):
+        body = {"selection": {"includeRuntime": True,
+                              "includeSensors": True}}
+        resps = self.conn.send_get_many(body, identifiers)
+        return map_values(parse_runtime_and_sensors, resps)
 
     def get_temp(self, identifier):
         rt_and_snsrs = self.get_runtime_and_sensors(identifier)
-        time = rt_and_snsrs["runtime"]["lastStatusModified"]
-        sensors = rt_and_snsrs["sensors"]
-        for sensor in sensors:
-            if sensor["type"] == "thermostat":
-                for cape in sensor["capability"]:
-                    if cape["type"] == "temperature":
-                        return {"time": time,
-                                "temp": cape["value"]}
-        raise ApiError("No thermostat temperature found")
+        return parse_temp(rt_and_snsrs)
+
+    def get_temp_many(self, identifiers):
+        rt_and_snsrs = self.get_runtime_and_sensors_many(identifiers)
+        return map_values(parse_temp, rt_and_snsrs)
+
+    def get_runtime_report(self, identifiers, start, end, columns=None,
+                           chunk_days=None):
+        """Yield (identifier, frame) blocks of the runtimeReport history
+        of identifiers between the start and end dates.
+
+        See runtime_report.iter_runtime_report."""
+        from .runtime_report import iter_runtime_report, default_chunk_days
+        chunk_days = default_chunk_days if chunk_days is None else chunk_days
+        return iter_runtime_report(self.conn, identifiers, start, end,
+                                   columns, chunk_days)
 
     def add_user(self):
         self.conn.add_user()
@@ -123,9 +198,56 @@ class ApiInterface:
 
     def show_users(self):
         print("Thermostat Identifier | User Identifier")
-        for tstat_id, user_id in self.conn.tokens.tstat.itertuples():
+        for tstat_id, user_id in self.conn.tokens.get_tstats():
             print("     {:s}     |     {:11}".format(tstat_id, user_id))
-            
+
+
+def parse_times(resp):
+    return {"utc": resp["utcTime"],
+            "local": resp["thermostatTime"]}
+
+
+def parse_lat_lon(resp):
+    return {"lat_long": resp["location"]["mapCoordinates"]}
+
+
+def parse_program(p_json):
+    sched = Schedule(p_json["program"]["schedule"])
+    climates = [Climate(c) for c in p_json["program"]["climates"]]
+    return Program(sched, climates)
+
+
+def parse_vacations(events):
+    rt_events = []
+    for event in events:
+        if event["type"] == "vacation":
+            vac = from_json(event)
+            rt_events.append(vac)
+    return rt_events
+
+
+def parse_runtime_and_sensors(resp):
+    return {"runtime": resp["runtime"],
+            "sensors": resp["remoteSensors"]}
+
+
+def parse_temp(rt_and_snsrs):
+    time = rt_and_snsrs["runtime"]["lastStatusModified"]
+    sensors = rt_and_snsrs["sensors"]
+    for sensor in sensors:
+        if sensor["type"] == "thermostat":
+            for cape in sensor["capability"]:
+                if cape["type"] == "temperature":
+                    return {"time": time,
+                            "temp": cape["value"]}
+    raise ApiError("No thermostat temperature found")
+
+
+def map_values(func, resps):
+    """Apply func to each value of a dict keyed by identifier."""
+    return {identifier: func(resp) for identifier, resp in resps.items()}
+
+
 def wrap_create_vacation(vacation):
     create_function = {"type": "createVacation",
                        "params": vacation}
@@ -0,0 +1,351 @@
+"""An asyncio connection to the ecobee API."""
+
+import time
+import asyncio
+import copy
+import logging
+from .api_connection import (ApiConnection, ExpiredTokenError, url_base,
+                             get_token_identifier, format_identifiers,
+                             format_tstat_ids, format_auth_pin,
+                             format_get_tokens, format_refresh_tokens,
+                             get_bearer_token, expires_soon,
+                             get_function_batches, format_functions,
+                             split_function_job, FunctionFailures,
+                             is_rejected, add_results)
+from .tokens import parse_tokens, log_failures
+
+logger = logging.getLogger(__name__)
+
+default_max_concurrency = 100
+
+
+class AsyncApiConnection(ApiConnection):
+    """An ApiConnection whose requests are coroutines.
+
+    At most max_concurrency requests are in flight at once. Tokens are
+    refreshed per user, shortly before they expire or when a request
+    fails with an expired token, and coroutines of the same user share
+    a single refresh. A RetryPolicy passed as retry needs an
+    AsyncAdaptiveConcurrency, if any, as its concurrency, and
+    singleflight must be an AsyncSingleFlight."""
+
+    def __init__(self, verbose=False, transport=None, url_base=url_base,
+                 tokens=None, cache=None, codec=None, metrics=None,
+                 max_concurrency=default_max_concurrency, retry=None,
+                 singleflight=None, tracer=None):
+        ApiConnection.__init__(self, verbose, transport, url_base, tokens,
+                               cache, codec, metrics, tracer=tracer,
+                               retry=retry, singleflight=singleflight)
+        self.limit = asyncio.Semaphore(max_concurrency)
+
+    def default_transport(self):
+        from .transport import AiohttpTransport
+        return AiohttpTransport()
+
+    async def close(self):
+        if self._transport is not None:
+            await self._transport.close()
+
+    def __enter__(self):
+        raise TypeError("Use async with for an AsyncApiConnection")
+
+    def __exit__(self, *exc_info):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def refresh_tokens(self):
+        """Refresh every user's tokens concurrently and store them with
+        one write, return the users that failed."""
+        ref_tokens = self.tokens.get_refresh_tokens()
+        user_ids = list(ref_tokens)
+        refreshes = [self.refresh_user_tokens(ref_tokens[u]) for u in user_ids]
+        results = await asyncio.gather(*refreshes, return_exceptions=True)
+        new_tokens = {}
+        failures = {}
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                failures[user_id] = result
+            else:
+                new_tokens[user_id] = result
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.tokens.update_tokens, new_tokens)
+        log_failures(failures)
+        return failures
+
+    async def refresh_user_tokens(self, ref_token):
+        url = self.url_base + "token"
+        try:
+            resp = await self.transport.post(url, **format_refresh_tokens(ref_token))
+            new_tokens = parse_tokens(resp.json())
+        except Exception:
+            self.metrics.inc("ebapi_token_refreshes_total", outcome="failed")
+            raise
+        self.metrics.inc("ebapi_token_refreshes_total", outcome="ok")
+        return new_tokens
+
+    async def refresh_user(self, user_id, stale_token):
+        """Refresh the tokens of user_id unless stale_token was already
+        replaced, and return the current access token.
+
+        See ApiConnection.refresh_user."""
+        async with self.get_refresh_lock(user_id):
+            current = self.tokens.lookup_access_token(user_id)
+            if current != stale_token:
+                return current
+            logger.info("Refreshing tokens for User {}".format(user_id))
+            ref_token = self.tokens.lookup_refresh_token(user_id)
+            new_tokens = await self.refresh_user_tokens(ref_token)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.tokens.update_tokens,
+                                       {user_id: new_tokens})
+            return new_tokens[0]
+
+    def get_refresh_lock(self, user_id):
+        return self.refresh_locks.setdefault(user_id, asyncio.Lock())
+
+    async def refresh_if_expiring(self, identifier):
+        """Refresh the user of identifier if its token expires within
+        refresh_margin seconds."""
+        user_id, access_token, expires_at = self.tokens.get_token_info(identifier)
+        if expires_soon(expires_at, self.refresh_margin):
+            try:
+                await self.refresh_user(user_id, access_token)
+            except Exception as err:
+                logger.warning("Early token refresh failed for User {}: {}".format(user_id, err))
+
+    def get_fresh_access_token(self, identifier):
+        # Early refreshes happen in refresh_if_expiring before a request
+        # is formatted, as they need the event loop.
+        return self.tokens.get_access_token(identifier)
+
+    async def send_get(self, body, identifier):
+        if self.cache is not None:
+            resp = self.cache.get(identifier, body)
+            if resp is not None:
+                return resp
+            generation = self.cache.get_generation(identifier)
+        tstats = await self.send_get_list(copy.deepcopy(body), identifier)
+        if self.cache is not None:
+            self.cache.put(identifier, body, tstats[0], generation)
+        return tstats[0]
+
+    async def send_get_many(self, body, identifiers):
+        """Send the get body for many thermostats concurrently.
+
+        See ApiConnection.send_get_many."""
+        results = {}
+        if self.cache is not None:
+            identifiers = self.get_cached(body, identifiers, results)
+            generations = {identifier: self.cache.get_generation(identifier)
+                           for identifier in identifiers}
+        chunks = list(self.get_selection_chunks(identifiers))
+        pending = [self.send_get_list(copy.deepcopy(body), chunk)
+                   for chunk in chunks]
+        for tstats in await asyncio.gather(*pending):
+            for tstat in tstats:
+                results[tstat["identifier"]] = tstat
+                if self.cache is not None:
+                    self.cache.put(tstat["identifier"], body, tstat,
+                                   generations.get(tstat["identifier"]))
+        return results
+
+    async def send_get_list(self, body, identifier):
+        if self.singleflight is None:
+            return await self.get_list(body, identifier)
+        key = self.get_singleflight_key(body, identifier)
+        return await self.singleflight.do(
+            key, lambda: self.get_list(body, identifier))
+
+    async def get_list(self, body, identifier):
+        token_id = get_token_identifier(identifier)
+        with self.tracer.span("send_get",
+                              identifier=format_identifiers(identifier)):
+            await self.refresh_if_expiring(token_id)
+            kwargs = self.format_get(body, identifier)
+            self.record_batch("selection", identifier)
+            resp = await self.attempt(self.transport.get, token_id, **kwargs)
+        return resp["thermostatList"]
+
+    async def send_summary(self, identifier):
+        token_id = get_token_identifier(identifier)
+        with self.tracer.span("send_summary",
+                              identifier=format_identifiers(identifier)):
+            await self.refresh_if_expiring(token_id)
+            kwargs = self.format_get({}, identifier)
+            resp = await self.attempt(self.transport.get, token_id,
+                                      url=self.summary_url, **kwargs)
+        return resp["revisionList"]
+
+    async def send_summary_many(self, identifiers):
+        chunks = list(self.get_selection_chunks(identifiers))
+        pending = [self.send_summary(chunk) for chunk in chunks]
+        revisions = {}
+        for revision_list in await asyncio.gather(*pending):
+            for revision in revision_list:
+                revisions[revision.split(":", 1)[0]] = revision
+        return revisions
+
+    async def send_report(self, body, identifier):
+        token_id = get_token_identifier(identifier)
+        with self.tracer.span("send_report",
+                              identifier=format_identifiers(identifier)):
+            await self.refresh_if_expiring(token_id)
+            kwargs = self.format_get(body, identifier)
+            resp = await self.attempt(self.transport.get, token_id,
+                                      url=self.report_url, **kwargs)
+        return resp["reportList"]
+
+    async def send_post(self, body, identifier):
+        token_id = get_token_identifier(identifier)
+        try:
+            with self.tracer.span("send_post",
+                                  identifier=format_identifiers(identifier)):
+                await self.refresh_if_expiring(token_id)
+                kwargs = self.format_post(body, identifier)
+                return await self.attempt(self.transport.post, token_id,
+                                          **kwargs)
+        finally:
+            self.record_write(identifier)
+
+    async def send_post_many(self, body, identifiers, max_concurrency=None):
+        """See ApiConnection.send_post_many."""
+        results = {}
+        jobs = [(body, chunk) for chunk in self.get_selection_chunks(identifiers)]
+        await self.run_jobs(self.post_chunk, jobs, max_concurrency, results)
+        return results
+
+    async def post_chunk(self, body, identifiers, results):
+        start = time.perf_counter()
+        try:
+            resp = await self.send_post(copy.deepcopy(body), identifiers)
+        except Exception as err:
+            if is_rejected(err) and len(identifiers) > 1:
+                middle = len(identifiers) // 2
+                await self.post_chunk(body, identifiers[:middle], results)
+                await self.post_chunk(body, identifiers[middle:], results)
+                return
+            add_results(results, identifiers, start, error=err)
+        else:
+            add_results(results, identifiers, start, result=resp)
+
+    async def attempt(self, func, identifier, **kwargs):
+        self.log_attempt(func, identifier, kwargs)
+        try:
+            resp = await self.send_request(func, identifier=identifier, **kwargs)
+        except ExpiredTokenError:
+            self.metrics.inc("ebapi_retries_total", reason="expired_token")
+            user_id = self.tokens.get_user_id(identifier)
+            await self.refresh_user(user_id, get_bearer_token(kwargs["headers"]))
+            kwargs["headers"] = self.gen_headers(identifier)
+            resp = await self.send_request(func, identifier=identifier, **kwargs)
+        return resp
+
+    async def send_request(self, func, url=None, identifier=None, **kwargs):
+        url = url or self.url
+        if self.retry is None:
+            return await self.send_once(func, url, kwargs)
+        user_id = None
+        if identifier is not None and self.retry.limiter is not None:
+            user_id = self.tokens.get_user_id(identifier)
+        return await self.retry.call_async(
+            lambda: self.send_once(func, url, kwargs), func.__name__, user_id,
+            self.record_retry)
+
+    async def send_once(self, func, url, kwargs):
+        async with self.limit:
+            with self.tracer.span("network", method=func.__name__, url=url):
+                start = time.perf_counter()
+                resp = await func(url, **kwargs)
+                elapsed = time.perf_counter() - start
+        return self.read_response(func, url, kwargs, resp, elapsed)
+
+    async def send_functions(self, functions, identifier, max_concurrency=None):
+        """See ApiConnection.send_functions."""
+        batches = list(get_function_batches(functions, self.max_functions_size))
+        limit = max_concurrency or self.functions_concurrency
+        if limit <= 1:
+            jobs = [(batches, identifier)]
+        else:
+            jobs = [([batch], identifier) for batch in batches]
+        return await self.run_function_jobs(jobs, limit)
+
+    async def send_functions_many(self, functions, identifiers,
+                                  max_concurrency=None):
+        """See ApiConnection.send_functions_many."""
+        batches = list(get_function_batches(functions, self.max_functions_size))
+        jobs = [(batches, chunk) for chunk in self.get_selection_chunks(identifiers)]
+        return await self.run_function_jobs(jobs, max_concurrency)
+
+    async def run_function_jobs(self, jobs, max_concurrency):
+        failures = FunctionFailures()
+        results = await self.run_jobs(self.post_function_batches, jobs,
+                                      max_concurrency, failures)
+        failures.check()
+        return [resp for job_results in results for resp in job_results]
+
+    async def post_function_batches(self, batches, identifier, failures):
+        return [await self.post_functions(batch, identifier, failures)
+                for batch in batches]
+
+    async def run_jobs(self, func, jobs, max_concurrency, *args):
+        """See ApiConnection.run_jobs."""
+        limit = asyncio.Semaphore(max_concurrency or self.writes_concurrency)
+
+        async def run(job):
+            async with limit:
+                return await func(*job, *args)
+
+        return list(await asyncio.gather(*[run(job) for job in jobs]))
+
+    async def post_functions(self, batch, identifier, failures):
+        self.record_batch("functions", batch)
+        try:
+            return await self.send_post(format_functions(batch), identifier)
+        except Exception as err:
+            halves = split_function_job(batch, identifier, err)
+            if halves is None:
+                failures.add(batch, identifier, err)
+            for half_batch, half_identifier in halves or ():
+                await self.post_functions(half_batch, half_identifier, failures)
+        return None
+
+    async def add_user(self):
+        """Get tokens for a new user and add them to the token store.
+
+        See ApiConnection.add_user."""
+        pin, code = await self.get_auth_pin()
+        print("Enter the PIN '{}' into the Add Application window and click Add Application".format(pin))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, input, "waiting press enter to continue...")
+
+        access_token, refresh_token, expires_at = await self.get_tokens(code)
+        user_id = self.tokens.get_next_user_id()
+        self.tokens.insert_user(user_id, access_token, refresh_token, expires_at)
+        tstat_ids = await self.get_tstat_ids(access_token)
+        for tstat_id in tstat_ids:
+            logger.info("Adding Thermostat ID: {}".format(tstat_id))
+            self.tokens.insert_tstat(user_id, tstat_id)
+
+    async def get_tstat_ids(self, acc):
+        kwargs = format_tstat_ids(acc)
+        resp = await self.transport.get(self.url, **kwargs)
+        return [tstat['identifier'] for tstat in resp.json()['thermostatList']]
+
+    async def get_auth_pin(self):
+        url = self.url_base + "authorize"
+        resp = await self.transport.get(url, **format_auth_pin())
+        try:
+            resp_json = resp.json()
+        except ValueError:
+            raise ValueError("Response Could not be translated to json {}".format(resp))
+        return resp_json["ecobeePin"], resp_json["code"]
+
+    async def get_tokens(self, code):
+        url = self.url_base + "token"
+        resp = await self.transport.post(url, **format_get_tokens(code))
+        return parse_tokens(resp.json())
@@ -0,0 +1,190 @@
+"""An asyncio version of ApiInterface."""
+
+from .async_api_connection import AsyncApiConnection
+from .api_interface import (parse_times, parse_lat_lon, parse_program,
+                            parse_vacations, parse_runtime_and_sensors,
+                            parse_temp, map_values, wrap_create_vacation,
+                            wrap_delete_vacation)
+
+
+class AsyncApiInterface:
+    """Mirrors ApiInterface with coroutines so one event loop can drive
+    many thermostats concurrently."""
+
+    def __init__(self, verbose=False, **conn_kwargs):
+        self.conn = AsyncApiConnection(verbose, **conn_kwargs)
+
+    async def close(self):
+        await self.conn.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def query(self, identifier):
+        from .query import AsyncSelectionQuery
+        return AsyncSelectionQuery(self.conn, identifier)
+
+    async def delete_vacations(self, names, identifier):
+        """Delete vacations for thermostat identifer with name in names"""
+        funcs = [wrap_delete_vacation(n) for n in names]
+        await self.conn.send_functions(funcs, identifier)
+
+    async def send_vacations(self, vacations, identifier):
+        """Send the vacation events in vacations to thermostat identifier"""
+        funcs = [wrap_create_vacation(v.to_json()) for v in vacations]
+        return await self.conn.send_functions(funcs, identifier)
+
+    async def get_precool_settings(self, identifier):
+        """Return the 'disablePreCooling setting AKA. Smart Recovery"""
+        settings = await self.get_settings(identifier)
+        return {"disablePreCooling": settings["disablePreCooling"]}
+
+    async def update_disable_precool_setting(self, identifier, cool_flag):
+        """Set the disablePreCooling setting to cool_flag."""
+        body = {"disablePreCooling": cool_flag}
+        return await self.update_settings(body, identifier)
+
+    async def update_program(self, program, identifier):
+        body = {"thermostat": {"program": program.to_json()}}
+        return await self.conn.send_post(body, identifier)
+
+    async def update_settings(self, settings, identifier):
+        body = {"thermostat": {"settings": settings}}
+        return await self.conn.send_post(body, identifier)
+
+    async def update_settings_many(self, settings, identifiers):
+        """Set settings on every thermostat in identifiers, one request per
+        chunk of a user's thermostats. Returns a dict of FleetResults
+        keyed by identifier."""
+        body = {"thermostat": {"settings": settings}}
+        return await self.conn.send_post_many(body, identifiers)
+
+    async def update_disable_precool_setting_many(self, identifiers, cool_flag):
+        """Set the disablePreCooling setting of identifiers to cool_flag."""
+        body = {"disablePreCooling": cool_flag}
+        return await self.update_settings_many(body, identifiers)
+
+    async def update_program_many(self, program, identifiers):
+        """Send program to every thermostat in identifiers."""
+        body = {"thermostat": {"program": program.to_json()}}
+        return await self.conn.send_post_many(body, identifiers)
+
+    async def get_times(self, identifier):
+        resp = await self.conn.send_get({}, identifier)
+        return parse_times(resp)
+
+    async def get_times_many(self, identifiers):
+        resps = await self.conn.send_get_many({}, identifiers)
+        return map_values(parse_times, resps)
+
+    async def get_lat_lon(self, identifier):
+        body = {"selection": {"includeLocation": True}}
+        resp = await self.conn.send_get(body, identifier)
+        return parse_lat_lon(resp)
+
+    async def get_lat_lon_many(self, identifiers):
+        body = {"selection": {"includeLocation": True}}
+        resps = await self.conn.send_get_many(body, identifiers)
+        return map_values(parse_lat_lon, resps)
+
+    async def get_program(self, identifier):
+        p_json = await self.get_program_json(identifier)
+        with self.conn.tracer.span("construct", identifier=identifier):
+            return parse_program(p_json)
+
+    async def get_program_many(self, identifiers):
+        p_jsons = await self.get_program_json_many(identifiers)
+        with self.conn.tracer.span("construct", count=len(p_jsons)):
+            return map_values(parse_program, p_jsons)
+
+    async def get_program_json(self, identifier):
+        body = {"selection": {"includeProgram": True}}
+        return await self.conn.send_get(body, identifier)
+
+    async def get_program_json_many(self, identifiers):
+        body = {"selection": {"includeProgram": True}}
+        return await self.conn.send_get_many(body, identifiers)
+
+    async def get_settings(self, identifier):
+        body = {"selection": {"includeSettings": True}}
+        resp = await self.conn.send_get(body, identifier)
+        return resp["settings"]
+
+    async def get_settings_many(self, identifiers):
+        body = {"selection": {"includeSettings": True}}
+        resps = await self.conn.send_get_many(body, identifiers)
+        return map_values(lambda resp: resp["settings"], resps)
+
+    async def get_sensors(self, identifier):
+        body = {"selection": {"includeSensors": True}}
+        resp = await self.conn.send_get(body, identifier)
+        return resp["remoteSensors"]
+
+    async def get_sensors_many(self, identifiers):
+        body = {"selection": {"includeSensors": True}}
+        resps = await self.conn.send_get_many(body, identifiers)
+        return map_values(lambda resp: resp["remoteSensors"], resps)
+
+    async def get_vacations(self, identifier):
+        events = await self.get_events(identifier)
+        with self.conn.tracer.span("construct", identifier=identifier):
+            return parse_vacations(events)
+
+    async def get_vacations_many(self, identifiers):
+        events = await self.get_events_many(identifiers)
+        with self.conn.tracer.span("construct", count=len(events)):
+            return map_values(parse_vacations, events)
+
+    async def get_events(self, identifier):
+        body = {"selection": {"includeEvents": True}}
+        resp = await self.conn.send_get(body, identifier)
+        return resp["events"]
+
+    async def get_events_many(self, identifiers):
+        body = {"selection": {"includeEvents": True}}
+        resps = await self.conn.send_get_many(body, identifiers)
+        return map_values(lambda resp: resp["events"], resps)
+
+    async def get_extended_runtime(self, identifier):
+        body = {"selection": {"includeExtendedRuntime": True}}
+        resp = await self.conn.send_get(body, identifier)
+        return resp["extendedRuntime"]
+
+    async def get_extended_runtime_many(self, identifiers):
+        body = {"selection": {"includeExtendedRuntime": True}}
+        resps = await self.conn.send_get_many(body, identifiers)
+        return map_values(lambda resp: resp["extendedRuntime"], resps)
+
+    async def get_runtime_and_sensors(self, identifier):
+        body = {"selection": {"includeRuntime": True,
+                              "includeSensors": True}}
+        resp = await self.conn.send_get(body, identifier)
+        return parse_runtime_and_sensors(resp)
+
+    async def get_runtime_and_sensors_many(self, identifiers):
+        body = {"selection": {"includeRuntime": True,
+                              "includeSensors": True}}
+        resps = await self.conn.send_get_many(body, identifiers)
+        return map_values(parse_runtime_and_sensors, resps)
+
+    async def get_temp(self, identifier):
+        rt_and_snsrs = await self.get_runtime_and_sensors(identifier)
+        return parse_temp(rt_and_snsrs)
+
+    async def get_temp_many(self, identifiers):
+        rt_and_snsrs = await self.get_runtime_and_sensors_many(identifiers)
+        return map_values(parse_temp, rt_and_snsrs)
+
+    async def add_user(self):
+        await self.conn.add_user()
+
+    def rm_user(self, tstat_id):
+        self.conn.tokens.delete(tstat_id)
+
+    def show_users(self):
+        print("Thermostat Identifier | User Identifier")
+        for tstat_id, user_id in self.conn.tokens.get_tstats():
+            print("     {:s}     |     {:11}".format(tstat_id, user_id))
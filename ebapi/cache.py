@@ -0,0 +1,125 @@
+"""A TTL response cache for ApiConnection gets."""
+
+import copy
+import json
+import time
+import threading
+from collections import OrderedDict
+
+default_max_entries = 1024
+default_ttls = {"includeSettings": 300,
+                "includeProgram": 300,
+                "includeLocation": 3600}
+# A selection without include flags, as get_times sends, returns the
+# utcTime and thermostatTime pair, which still gives the right offset
+# when cached.
+default_base_ttl = 300
+
+
+class ResponseCache:
+    """Caches thermostat json keyed by identifier and selection.
+
+    A response lives for the smallest ttl of the include flags in its
+    selection; flags missing from ttls fall back to default_ttl and a
+    selection without include flags uses base_ttl. A ttl of 0 disables
+    caching. Past max_entries the least recently used entry is evicted.
+    Writes to a thermostat must call invalidate, ApiConnection does so
+    on every post. A get sent before a write can return after it, so
+    callers take get_generation before sending and pass it to put,
+    which drops the response if identifier was invalidated since."""
+
+    def __init__(self, max_entries=default_max_entries, ttls=None,
+                 default_ttl=0, base_ttl=default_base_ttl,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttls = dict(default_ttls if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.base_ttl = base_ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.keys_by_tstat = {}
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_ttl(self, body):
+        flags = [key for key, val in body.get("selection", {}).items()
+                 if key.startswith("include") and val]
+        if not flags:
+            return self.base_ttl
+        return min(self.ttls.get(flag, self.default_ttl) for flag in flags)
+
+    def get(self, identifier, body):
+        """Return a copy of the cached json or None."""
+        key = make_key(identifier, body)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            resp = entry[1]
+        return copy.deepcopy(resp)
+
+    def get_generation(self, identifier):
+        """Return the count of invalidations of identifier."""
+        with self.lock:
+            return self.generations.get(identifier, 0)
+
+    def put(self, identifier, body, resp, generation=None):
+        """Cache resp, unless identifier was invalidated after generation."""
+        ttl = self.get_ttl(body)
+        if ttl <= 0:
+            return
+        key = make_key(identifier, body)
+        entry = (self.clock() + ttl, copy.deepcopy(resp))
+        with self.lock:
+            if (generation is not None
+                    and self.generations.get(identifier, 0) != generation):
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.keys_by_tstat.setdefault(identifier, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+
+    def invalidate(self, identifier):
+        """Drop every entry of identifier or of a list of identifiers."""
+        if isinstance(identifier, str):
+            identifier = [identifier]
+        with self.lock:
+            for tstat_id in identifier:
+                self.generations[tstat_id] = self.generations.get(tstat_id, 0) + 1
+                for key in self.keys_by_tstat.pop(tstat_id, ()):
+                    self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_tstat.clear()
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+        keys = self.keys_by_tstat.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_tstat[key[0]]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def make_key(identifier, body):
+    """Return identifier with the body normalized, ignoring the
+    selection's identifiers and any false include flags."""
+    body = dict(body)
+    selection = {key: val for key, val in body.get("selection", {}).items()
+                 if key not in ("selectionType", "selectionMatch")
+                 and not (key.startswith("include") and not val)}
+    body["selection"] = selection
+    return identifier, json.dumps(body, sort_keys=True)
@@ -0,0 +1,193 @@
+"""Record API traffic to a cassette file and replay it offline."""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from urllib.parse import urlsplit
+from .transport import Transport, AsyncTransport, Response
+
+cassette_version = 1
+redacted = "<redacted>"
+# Query parameters holding secrets, left out of keys.
+secret_params = ("code", "client_id")
+token_fields = ("access_token", "refresh_token")
+
+
+class CassetteMissError(LookupError):
+    pass
+
+
+class Cassette:
+    """Request and response pairs stored in a gzipped json file.
+
+    Requests are keyed by method, endpoint and normalized json body, and
+    never store headers, so access tokens are not written. Tokens in
+    responses are redacted. Identical response bodies are stored once.
+    Several responses to one key are replayed in order, the last one
+    repeating."""
+
+    def __init__(self, path):
+        self.path = path
+        self.interactions = {}
+        self.bodies = {}
+        self.positions = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as cassette_file:
+            data = json.load(cassette_file)
+        if data.get("version") != cassette_version:
+            raise ValueError("Unsupported cassette version {}".format(data.get("version")))
+        self.interactions = data["interactions"]
+        self.bodies = data["bodies"]
+
+    def save(self):
+        """Write the cassette atomically."""
+        data = {"version": cassette_version,
+                "interactions": self.interactions,
+                "bodies": self.bodies}
+        dir_name = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
+        try:
+            with gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8") as tmp_file:
+                json.dump(data, tmp_file, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def record(self, key, status_code, content, elapsed):
+        content = redact_content(content)
+        digest = hashlib.sha1(content).hexdigest()
+        with self.lock:
+            self.bodies[digest] = content.decode("utf-8")
+            self.interactions.setdefault(key, []).append(
+                {"status": status_code, "body": digest,
+                 "elapsed": round(elapsed, 6)})
+
+    def play(self, key):
+        """Return (status_code, content, elapsed) recorded for key."""
+        with self.lock:
+            recorded = self.interactions.get(key)
+            if not recorded:
+                raise CassetteMissError("No recorded response for {}".format(key))
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            interaction = recorded[min(position, len(recorded) - 1)]
+        content = self.bodies[interaction["body"]].encode("utf-8")
+        return interaction["status"], content, interaction["elapsed"]
+
+    def rewind(self):
+        with self.lock:
+            self.positions = {}
+
+    def __len__(self):
+        return sum(len(recorded) for recorded in self.interactions.values())
+
+
+class CassetteTransport(Transport):
+    """Records the traffic of transport, or replays a cassette without
+    a network when transport is None.
+
+    Replays run at full speed, or sleep latency_scale times the recorded
+    latency. A recording adds to an existing cassette at path. Call
+    close or save to write it."""
+
+    def __init__(self, path, transport=None, latency_scale=0):
+        self.cassette = Cassette(path)
+        self.transport = transport
+        self.latency_scale = latency_scale
+
+    def request(self, method, url, **kwargs):
+        key = make_key(method, url, kwargs)
+        if self.transport is None:
+            status_code, content, elapsed = self.cassette.play(key)
+            if self.latency_scale:
+                time.sleep(elapsed * self.latency_scale)
+            return Response(status_code, content)
+        start = time.perf_counter()
+        resp = self.transport.request(method, url, **kwargs)
+        self.cassette.record(key, resp.status_code, resp.content,
+                             time.perf_counter() - start)
+        return resp
+
+    def save(self):
+        self.cassette.save()
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.save()
+
+
+class AsyncCassetteTransport(AsyncTransport):
+    """The CassetteTransport of an AsyncApiConnection."""
+
+    def __init__(self, path, transport=None, latency_scale=0):
+        self.cassette = Cassette(path)
+        self.transport = transport
+        self.latency_scale = latency_scale
+
+    async def request(self, method, url, **kwargs):
+        import asyncio
+        key = make_key(method, url, kwargs)
+        if self.transport is None:
+            status_code, content, elapsed = self.cassette.play(key)
+            if self.latency_scale:
+                await asyncio.sleep(elapsed * self.latency_scale)
+            return Response(status_code, content)
+        start = time.perf_counter()
+        resp = await self.transport.request(method, url, **kwargs)
+        self.cassette.record(key, resp.status_code, resp.content,
+                             time.perf_counter() - start)
+        return resp
+
+    def save(self):
+        self.cassette.save()
+
+    async def close(self):
+        if self.transport is not None:
+            await self.transport.close()
+            self.save()
+
+
+def make_key(method, url, kwargs):
+    """Return the cassette key of a request.
+
+    The host is ignored, so traffic recorded against one server replays
+    against any url_base. Secret query parameters are left out and the
+    identifiers of a selection are sorted."""
+    params = dict(kwargs.get("params") or {})
+    body = params.pop("body", None) or kwargs.get("data")
+    for param in secret_params:
+        params.pop(param, None)
+    if body:
+        body = normalize_body(json.loads(body))
+    return json.dumps([method, urlsplit(url).path, params, body],
+                      sort_keys=True, separators=(",", ":"))
+
+
+def normalize_body(body):
+    selection = body.get("selection")
+    if selection and selection.get("selectionMatch"):
+        identifiers = sorted(selection["selectionMatch"].split(","))
+        body = dict(body, selection=dict(selection,
+                                         selectionMatch=",".join(identifiers)))
+    return body
+
+
+def redact_content(content):
+    """Return response content with any tokens replaced."""
+    if not any(field.encode() in content for field in token_fields):
+        return content
+    resp = json.loads(content)
+    for field in token_fields:
+        if field in resp:
+            resp[field] = redacted
+    return json.dumps(resp).encode("utf-8")
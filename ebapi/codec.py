@@ -0,0 +1,97 @@
+"""JSON codecs for request bodies and responses."""
+
+import os
+import json
+
+codec_ev = "EBAPI_JSON_CODEC"
+preferred = ["orjson", "ujson", "json"]
+
+
+class Codec:
+    """Encodes request bodies and decodes response bytes.
+
+    dumps returns str for query parameters, encode returns bytes for
+    request data and loads accepts bytes or str."""
+
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def encode(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class StdlibCodec(Codec):
+
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+    def encode(self, obj):
+        return self.dumps(obj).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    """Uses orjson, which encodes straight to bytes."""
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj):
+        return self.orjson.dumps(obj).decode()
+
+    def encode(self, obj):
+        return self.orjson.dumps(obj)
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+
+class UjsonCodec(Codec):
+
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def dumps(self, obj):
+        return self.ujson.dumps(obj, ensure_ascii=False)
+
+    def encode(self, obj):
+        return self.dumps(obj).encode()
+
+    def loads(self, data):
+        return self.ujson.loads(data)
+
+
+codecs = {"orjson": OrjsonCodec, "ujson": UjsonCodec, "json": StdlibCodec}
+
+
+def get_codec(name=None):
+    """Return the codec called name, or named by EBAPI_JSON_CODEC.
+
+    Without either the fastest installed codec is used."""
+    name = name or os.environ.get(codec_ev)
+    if name:
+        try:
+            return codecs[name]()
+        except KeyError:
+            raise ValueError("Unknown json codec {}, expected one of {}".format(
+                name, ", ".join(codecs)))
+    for name in preferred:
+        try:
+            return codecs[name]()
+        except ImportError:
+            pass
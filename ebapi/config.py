@@ -0,0 +1,16 @@
+"""Configuration read from the environment when it is first needed."""
+
+import os
+
+app_key_ev = "ECOBEE_APPLICATION_KEY"
+
+
+def get_app_key():
+    """Return the ecobee application key.
+
+    It is read on use rather than on import so that importing ebapi
+    never fails in an environment without the key."""
+    app_key = os.environ.get(app_key_ev, "")
+    if app_key == "":
+        raise ValueError("Appliection KEY has not been initilized. Please set a ECOBEE_APPLICATION_KEY enviornment variable")
+    return app_key
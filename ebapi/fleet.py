@@ -0,0 +1,211 @@
+"""Run ApiInterface operations across a fleet of thermostats."""
+
+import time
+import logging
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+default_max_workers = 16
+default_per_user_limit = 4
+
+
+class FleetRunner:
+    """Calls an ApiInterface method once per thermostat on a thread pool.
+
+    At most max_workers calls run at once and at most per_user_limit of
+    them share an owning user, so one large account cannot starve the
+    rest of the fleet."""
+
+    def __init__(self, interface, max_workers=default_max_workers,
+                 per_user_limit=default_per_user_limit):
+        self.interface = interface
+        self.max_workers = max_workers
+        self.per_user_limit = per_user_limit
+
+    def run(self, method, identifiers, *args, identifier_arg=None, **kwargs):
+        """Return a FleetRun calling method(*args, identifier, **kwargs)
+        for every identifier.
+
+        method is a bound ApiInterface method or the name of one. The
+        identifier follows args unless identifier_arg gives its position
+        in args, or the name of the keyword to pass it as, e.g.
+        run("update_disable_precool_setting", ids, True, identifier_arg=0).
+        Iterate the FleetRun to receive FleetResults as calls finish."""
+        if isinstance(method, str):
+            method = getattr(self.interface, method)
+        return FleetRun(self, method, identifiers, args, kwargs, identifier_arg)
+
+    def get_user_id(self, identifier):
+        return self.interface.conn.tokens.get_user_id(identifier)
+
+
+class FleetRun:
+    """The calls of one FleetRunner.run, yielded in completion order.
+
+    summary is filled in as results are yielded."""
+
+    def __init__(self, runner, method, identifiers, args, kwargs,
+                 identifier_arg=None):
+        self.runner = runner
+        self.method = method
+        self.identifiers = list(identifiers)
+        self.args = args
+        self.kwargs = kwargs
+        self.identifier_arg = identifier_arg
+        self.summary = FleetSummary()
+
+    def __iter__(self):
+        start = time.perf_counter()
+        queues, unknown = self.queue_by_user()
+        for result in unknown:
+            self.summary.add(result)
+            yield result
+
+        active = {user_id: 0 for user_id in queues}
+        pending = {}
+        pool = ThreadPoolExecutor(max_workers=self.runner.max_workers)
+        try:
+            self.submit_ready(pool, queues, active, pending)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    user_id = pending.pop(future)
+                    active[user_id] -= 1
+                    result = future.result()
+                    self.summary.add(result)
+                    yield result
+                self.submit_ready(pool, queues, active, pending)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.summary.wall_time = time.perf_counter() - start
+
+    def collect(self):
+        """Run to completion and return a dict of FleetResults keyed by
+        identifier."""
+        return {result.identifier: result for result in self}
+
+    def queue_by_user(self):
+        queues = {}
+        unknown = []
+        for identifier in self.identifiers:
+            try:
+                user_id = self.runner.get_user_id(identifier)
+            except KeyError as err:
+                unknown.append(FleetResult(identifier, error=err))
+                continue
+            queues.setdefault(user_id, deque()).append(identifier)
+        return queues, unknown
+
+    def submit_ready(self, pool, queues, active, pending):
+        """Submit calls round robin over users until the pool is full or
+        every user with queued work is at its limit."""
+        submitted = True
+        while submitted and len(pending) < self.runner.max_workers:
+            submitted = False
+            for user_id, queue in queues.items():
+                if len(pending) >= self.runner.max_workers:
+                    break
+                if queue and active[user_id] < self.runner.per_user_limit:
+                    # Calls run in the caller's context, under its spans.
+                    future = pool.submit(contextvars.copy_context().run,
+                                         self.call, queue.popleft())
+                    pending[future] = user_id
+                    active[user_id] += 1
+                    submitted = True
+
+    def call(self, identifier):
+        start = time.perf_counter()
+        try:
+            args, kwargs = self.get_call_args(identifier)
+            result = self.method(*args, **kwargs)
+        except Exception as err:
+            logger.warning("Fleet call failed on Thermostat {}: {}".format(identifier, err))
+            return FleetResult(identifier, error=err,
+                               elapsed=time.perf_counter() - start)
+        return FleetResult(identifier, result=result,
+                           elapsed=time.perf_counter() - start)
+
+    def get_call_args(self, identifier):
+        """Return the args and kwargs of the call of identifier."""
+        args = list(self.args)
+        kwargs = self.kwargs
+        if self.identifier_arg is None:
+            args.append(identifier)
+        elif isinstance(self.identifier_arg, str):
+            kwargs = dict(kwargs, **{self.identifier_arg: identifier})
+        else:
+            args.insert(self.identifier_arg, identifier)
+        return args, kwargs
+
+
+class FleetResult:
+    """The outcome of one call in a fleet run."""
+
+    def __init__(self, identifier, result=None, error=None, elapsed=0.0):
+        self.identifier = identifier
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    def succeeded(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.succeeded():
+            status = "ok"
+        else:
+            status = "failed: {!r}".format(self.error)
+        return "FleetResult({}, {}, {:.3f}s)".format(self.identifier,
+                                                    status, self.elapsed)
+
+
+class FleetSummary:
+    """Counts, timings and failures of a fleet run."""
+
+    def __init__(self):
+        self.timings = {}
+        self.failures = {}
+        self.wall_time = 0.0
+
+    def add(self, result):
+        self.timings[result.identifier] = result.elapsed
+        if not result.succeeded():
+            self.failures[result.identifier] = result.error
+
+    def total(self):
+        return len(self.timings)
+
+    def failed(self):
+        return len(self.failures)
+
+    def succeeded(self):
+        return self.total() - self.failed()
+
+    def slowest(self, n=5):
+        """Return the n slowest (identifier, seconds) pairs."""
+        ranked = sorted(self.timings.items(), key=lambda kv: kv[1],
+                        reverse=True)
+        return ranked[:n]
+
+    def failure_counts(self):
+        """Return the number of failures per exception type."""
+        counts = {}
+        for error in self.failures.values():
+            name = type(error).__name__
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def __str__(self):
+        str_rep = "Fleet Run:\n"
+        str_rep += "\tCalls: {}\n".format(self.total())
+        str_rep += "\tSucceeded: {}\n".format(self.succeeded())
+        str_rep += "\tFailed: {}\n".format(self.failed())
+        for name, count in self.failure_counts().items():
+            str_rep += "\t\t{}: {}\n".format(name, count)
+        str_rep += "\tWall Time: {:.3f}s\n".format(self.wall_time)
+        for identifier, elapsed in self.slowest():
+            str_rep += "\tSlow: {} {:.3f}s\n".format(identifier, elapsed)
+        return str_rep
@@ -0,0 +1,149 @@
+"""Metrics of the requests an ApiConnection sends."""
+
+import threading
+
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+size_buckets = (1, 2, 5, 10, 25, 50, 100)
+default_buckets = {"ebapi_request_seconds": latency_buckets,
+                   "ebapi_batch_size": size_buckets}
+
+# name: (type, help)
+known_metrics = {
+    "ebapi_request_seconds": ("histogram", "Latency of API requests."),
+    "ebapi_responses_total": ("counter", "API responses by status code."),
+    "ebapi_request_bytes_total": ("counter", "Bytes sent in request bodies."),
+    "ebapi_response_bytes_total": ("counter", "Bytes received in responses."),
+    "ebapi_retries_total": ("counter", "Requests sent again."),
+    "ebapi_token_refreshes_total": ("counter", "Token refreshes by outcome."),
+    "ebapi_batch_size": ("histogram", "Thermostats or functions per request."),
+}
+
+
+class MetricsSink:
+    """Receives the metrics of an ApiConnection.
+
+    inc adds value to a counter and observe records a value in a
+    histogram, both under the given labels. Subclass it to forward
+    metrics to statsd, prometheus_client or similar."""
+
+    enabled = True
+
+    def inc(self, name, value=1, **labels):
+        raise NotImplementedError
+
+    def observe(self, name, value, **labels):
+        raise NotImplementedError
+
+
+class NullMetrics(MetricsSink):
+    """Discards everything, the default sink."""
+
+    enabled = False
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+
+class MetricsRegistry(MetricsSink):
+    """Keeps counters and histograms in process and renders them in the
+    Prometheus text format."""
+
+    def __init__(self, buckets=None):
+        self.buckets = dict(default_buckets if buckets is None else buckets)
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, format_labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, format_labels(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = Histogram(self.buckets.get(name, latency_buckets))
+                self.histograms[key] = hist
+            hist.observe(value)
+
+    def get(self, name, **labels):
+        """Return a counter value, or a histogram's count."""
+        key = (name, format_labels(labels))
+        with self.lock:
+            if key in self.histograms:
+                return self.histograms[key].count
+            return self.counters.get(key, 0)
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            for name, samples in group_by_name(self.counters).items():
+                add_header(lines, name, "counter")
+                for labels, value in samples:
+                    lines.append("{}{} {}".format(name, wrap(labels), value))
+            for name, samples in group_by_name(self.histograms).items():
+                add_header(lines, name, "histogram")
+                for labels, hist in samples:
+                    hist.render(lines, name, labels)
+        return "\n".join(lines) + "\n"
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values."""
+
+    def __init__(self, buckets):
+        self.bounds = sorted(buckets)
+        self.counts = [0] * len(self.bounds)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, lines, name, labels):
+        sep = "," if labels else ""
+        for bound, count in zip(self.bounds, self.counts):
+            lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(
+                name, labels, sep, bound, count))
+        lines.append('{}_bucket{{{}{}le="+Inf"}} {}'.format(
+            name, labels, sep, self.count))
+        lines.append("{}_sum{} {}".format(name, wrap(labels), self.sum))
+        lines.append("{}_count{} {}".format(name, wrap(labels), self.count))
+
+
+def format_labels(labels):
+    """Return labels as sorted 'key="value"' pairs joined by commas."""
+    return ",".join('{}="{}"'.format(key, escape(val))
+                    for key, val in sorted(labels.items()))
+
+
+def escape(val):
+    return str(val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def wrap(labels):
+    return "{" + labels + "}" if labels else ""
+
+
+def group_by_name(samples):
+    groups = {}
+    for (name, labels), value in sorted(samples.items()):
+        groups.setdefault(name, []).append((labels, value))
+    return groups
+
+
+def add_header(lines, name, metric_type):
+    help_text = known_metrics.get(name, (metric_type, ""))[1]
+    if help_text:
+        lines.append("# HELP {} {}".format(name, help_text))
+    lines.append("# TYPE {} {}".format(name, metric_type))
@@ -0,0 +1,166 @@
+"""Poll thermostats for changes through thermostatSummary revisions."""
+
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+revision_fields = ["identifier", "name", "connected", "thermostat",
+                   "alerts", "runtime", "interval"]
+default_selections = {"thermostat": {"includeProgram": True,
+                                     "includeSettings": True},
+                      "alerts": {"includeAlerts": True},
+                      "runtime": {"includeRuntime": True,
+                                  "includeSensors": True}}
+default_min_interval = 180
+default_max_interval = 900
+
+
+class RevisionPoller:
+    """Watches thermostats and fetches them only when they change.
+
+    Each poll requests the summary revisions of the thermostats that are
+    due, one request per user and chunk of identifiers, and then gets
+    the selections of the revisions that changed in as few requests as
+    possible. Callbacks are called with (identifier, changed, tstat)
+    where changed lists the revisions that moved.
+
+    A thermostat's poll interval halves, down to min_interval, when it
+    changed and grows by half, up to max_interval, when it did not. The
+    first poll of a thermostat counts every revision as changed."""
+
+    def __init__(self, conn, identifiers, selections=None,
+                 min_interval=default_min_interval,
+                 max_interval=default_max_interval, clock=time.monotonic):
+        self.conn = conn
+        self.selections = dict(default_selections if selections is None
+                               else selections)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.clock = clock
+        self.callbacks = []
+        self.revisions = {}
+        self.intervals = {}
+        self.next_poll = {}
+        for identifier in identifiers:
+            self.add(identifier)
+
+    def add(self, identifier):
+        """Start watching identifier, polling it on the next pass."""
+        self.intervals[identifier] = self.min_interval
+        self.next_poll[identifier] = self.clock()
+
+    def remove(self, identifier):
+        for state in (self.revisions, self.intervals, self.next_poll):
+            state.pop(identifier, None)
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def get_due(self):
+        now = self.clock()
+        return [identifier for identifier, due in self.next_poll.items()
+                if due <= now]
+
+    def poll(self):
+        """Poll the thermostats that are due and return a dict of the
+        changed revisions keyed by identifier."""
+        due = self.get_due()
+        if not due:
+            return {}
+        summary = self.conn.send_summary_many(due)
+        pending = {}
+        changes = {}
+        for identifier in due:
+            if identifier not in summary:
+                logger.warning("No summary revision for Thermostat {}".format(identifier))
+                self.schedule(identifier, False)
+                continue
+            revision = parse_revision(summary[identifier])
+            changed = self.get_changed(identifier, revision)
+            self.schedule(identifier, bool(changed))
+            if changed:
+                pending[identifier] = revision
+                changes[identifier] = changed
+        for changed, identifiers in group_changes(changes).items():
+            self.fetch(changed, identifiers, pending)
+        return changes
+
+    def get_changed(self, identifier, revision):
+        """Return the names of the watched revisions that differ from
+        the last one seen for identifier."""
+        last = self.revisions.get(identifier)
+        return [name for name in self.selections
+                if last is None or last[name] != revision[name]]
+
+    def schedule(self, identifier, changed):
+        interval = self.intervals[identifier]
+        if changed:
+            interval = max(self.min_interval, interval / 2)
+        else:
+            interval = min(self.max_interval, interval * 1.5)
+        self.intervals[identifier] = interval
+        self.next_poll[identifier] = self.clock() + interval
+
+    def fetch(self, changed, identifiers, pending):
+        """Get the selections of changed for identifiers and call the
+        callbacks. A revision is only recorded once its thermostat was
+        fetched, so failed fetches are retried on the next poll."""
+        body = {"selection": self.get_selection(changed)}
+        if self.conn.cache is not None:
+            self.conn.cache.invalidate(identifiers)
+        try:
+            tstats = self.conn.send_get_many(body, identifiers)
+        except Exception:
+            logger.exception("Fetching changed Thermostats {} failed".format(identifiers))
+            return
+        for identifier, tstat in tstats.items():
+            if identifier not in pending:
+                continue
+            self.revisions[identifier] = pending[identifier]
+            self.notify(identifier, list(changed), tstat)
+
+    def get_selection(self, changed):
+        selection = {}
+        for name in changed:
+            selection.update(self.selections[name])
+        return selection
+
+    def notify(self, identifier, changed, tstat):
+        for callback in self.callbacks:
+            try:
+                callback(identifier, changed, tstat)
+            except Exception:
+                logger.exception("Callback failed for Thermostat {}".format(identifier))
+
+    def get_wait(self):
+        """Return the seconds until the next thermostat is due."""
+        if not self.next_poll:
+            return self.max_interval
+        return max(0, min(self.next_poll.values()) - self.clock())
+
+    def run(self, stop=None):
+        """Poll until the threading.Event stop is set."""
+        stop = threading.Event() if stop is None else stop
+        while not stop.is_set():
+            try:
+                self.poll()
+                wait = self.get_wait()
+            except Exception:
+                logger.exception("Summary poll failed")
+                wait = self.min_interval
+            stop.wait(wait)
+
+
+def parse_revision(revision):
+    """Return a thermostatSummary revision string as a dict."""
+    return dict(zip(revision_fields, revision.split(":")))
+
+
+def group_changes(changes):
+    """Return identifiers grouped by the tuple of revisions that changed."""
+    groups = {}
+    for identifier, changed in changes.items():
+        groups.setdefault(tuple(changed), []).append(identifier)
+    return groups
@@ -0,0 +1,115 @@
+"""Combine several thermostat reads into one get request."""
+
+from .api_interface import (parse_times, parse_lat_lon, parse_program,
+                            parse_vacations, parse_runtime_and_sensors,
+                            parse_temp, map_values)
+
+runtime_and_sensors = {"includeRuntime": True, "includeSensors": True}
+
+# name: (selection flags, parser of the thermostat json)
+parts = {
+    "times": ({}, parse_times),
+    "location": ({"includeLocation": True}, parse_lat_lon),
+    "program": ({"includeProgram": True}, parse_program),
+    "settings": ({"includeSettings": True},
+                 lambda resp: resp["settings"]),
+    "precool": ({"includeSettings": True},
+                lambda resp: {"disablePreCooling":
+                              resp["settings"]["disablePreCooling"]}),
+    "sensors": ({"includeSensors": True},
+                lambda resp: resp["remoteSensors"]),
+    "events": ({"includeEvents": True}, lambda resp: resp["events"]),
+    "vacations": ({"includeEvents": True},
+                  lambda resp: parse_vacations(resp["events"])),
+    "extended_runtime": ({"includeExtendedRuntime": True},
+                         lambda resp: resp["extendedRuntime"]),
+    "runtime_and_sensors": (runtime_and_sensors, parse_runtime_and_sensors),
+    "temp": (runtime_and_sensors,
+             lambda resp: parse_temp(parse_runtime_and_sensors(resp))),
+}
+
+
+class SelectionQuery:
+    """Collects the parts to read from a thermostat and gets them with
+    a single request, e.g.
+    api.query(identifier).program().settings().temp().execute()
+    returns a dict with the parsed "program", "settings" and "temp".
+
+    With a list of identifiers execute uses send_get_many and returns
+    the parsed parts keyed by identifier."""
+
+    def __init__(self, conn, identifier):
+        self.conn = conn
+        self.identifier = identifier
+        self.names = []
+
+    def add(self, name):
+        if name not in parts:
+            raise ValueError("Unknown query part {}".format(name))
+        if name not in self.names:
+            self.names.append(name)
+        return self
+
+    def times(self):
+        return self.add("times")
+
+    def location(self):
+        return self.add("location")
+
+    def program(self):
+        return self.add("program")
+
+    def settings(self):
+        return self.add("settings")
+
+    def precool(self):
+        return self.add("precool")
+
+    def sensors(self):
+        return self.add("sensors")
+
+    def events(self):
+        return self.add("events")
+
+    def vacations(self):
+        return self.add("vacations")
+
+    def extended_runtime(self):
+        return self.add("extended_runtime")
+
+    def runtime_and_sensors(self):
+        return self.add("runtime_and_sensors")
+
+    def temp(self):
+        return self.add("temp")
+
+    def get_body(self):
+        """Return the get body with the flags of every part merged."""
+        selection = {}
+        for name in self.names:
+            selection.update(parts[name][0])
+        if not selection:
+            return {}
+        return {"selection": selection}
+
+    def parse(self, resp):
+        with self.conn.tracer.span("construct", identifier=resp["identifier"]):
+            return {name: parts[name][1](resp) for name in self.names}
+
+    def execute(self):
+        body = self.get_body()
+        if isinstance(self.identifier, str):
+            return self.parse(self.conn.send_get(body, self.identifier))
+        resps = self.conn.send_get_many(body, self.identifier)
+        return map_values(self.parse, resps)
+
+
+class AsyncSelectionQuery(SelectionQuery):
+    """A SelectionQuery for an AsyncApiConnection."""
+
+    async def execute(self):
+        body = self.get_body()
+        if isinstance(self.identifier, str):
+            return self.parse(await self.conn.send_get(body, self.identifier))
+        resps = await self.conn.send_get_many(body, self.identifier)
+        return map_values(self.parse, resps)
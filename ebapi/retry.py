@@ -0,0 +1,286 @@
+"""Rate limiting, retries with backoff and adaptive concurrency."""
+
+import time
+import random
+import asyncio
+import threading
+
+default_max_attempts = 4
+default_base_delay = 0.25
+default_max_delay = 10
+# Processing error, reported for failures on the API side.
+default_retry_codes = (3,)
+retry_statuses = (429, 500, 502, 503, 504)
+throttle_statuses = (429, 503)
+
+
+class RetryPolicy:
+    """Decides which failed requests are sent again and when.
+
+    Throttled requests (HTTP 429 or 503) are always retried. Other 5xx
+    responses without an API status, API codes in retry_codes and
+    connection errors are retried for gets, and for posts only with
+    retry_posts, as a post may have been applied before it failed.
+
+    Retries wait for Retry-After when the API sends it, otherwise for a
+    random time up to base_delay * 2 ** attempt capped at max_delay.
+    A request is sent at most max_attempts times and every retry must
+    be allowed by budget.
+
+    limiter is a RateLimiter paced before every attempt and concurrency
+    an AdaptiveConcurrency, or AsyncAdaptiveConcurrency for an
+    AsyncApiConnection, that is narrowed when throttled."""
+
+    def __init__(self, max_attempts=default_max_attempts,
+                 base_delay=default_base_delay, max_delay=default_max_delay,
+                 retry_codes=default_retry_codes, retry_posts=False,
+                 budget=None, limiter=None, concurrency=None,
+                 sleep=time.sleep, random=random.random):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_codes = set(retry_codes)
+        self.retry_posts = retry_posts
+        self.budget = RetryBudget() if budget is None else budget
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.sleep = sleep
+        self.random = random
+
+    def classify(self, err, method):
+        """Return the reason to retry err, or None."""
+        code = getattr(err, "code", None)
+        http_status = getattr(err, "http_status", None)
+        if code is None and http_status in throttle_statuses:
+            return "throttled"
+        if method != "get" and not self.retry_posts:
+            return None
+        if code is not None:
+            return "api_code" if code in self.retry_codes else None
+        if http_status in retry_statuses:
+            return "http_status"
+        if isinstance(err, OSError):
+            return "connection"
+        return None
+
+    def get_delay(self, attempt, err):
+        retry_after = getattr(err, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return self.random() * cap
+
+    def on_failure(self, err, method, attempt, on_retry):
+        """Return the delay before the next attempt, or raise err."""
+        reason = self.classify(err, method)
+        if reason == "throttled" and self.concurrency is not None:
+            self.concurrency.decrease()
+        if (reason is None or attempt + 1 >= self.max_attempts
+                or not self.budget.withdraw()):
+            raise err
+        if on_retry is not None:
+            on_retry(reason)
+        return self.get_delay(attempt, err)
+
+    def on_success(self):
+        if self.concurrency is not None:
+            self.concurrency.increase()
+
+    def call(self, send, method, user_id=None, on_retry=None):
+        """Return send(), retrying failures as the policy allows."""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.sleep(self.limiter.reserve(user_id))
+            try:
+                if self.concurrency is None:
+                    result = send()
+                else:
+                    with self.concurrency:
+                        result = send()
+            except Exception as err:
+                delay = self.on_failure(err, method, attempt, on_retry)
+            else:
+                self.on_success()
+                return result
+            attempt += 1
+            self.sleep(delay)
+
+    async def call_async(self, send, method, user_id=None, on_retry=None):
+        """Like call, for a send returning a coroutine."""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                await asyncio.sleep(self.limiter.reserve(user_id))
+            try:
+                if self.concurrency is None:
+                    result = await send()
+                else:
+                    async with self.concurrency:
+                        result = await send()
+            except Exception as err:
+                delay = self.on_failure(err, method, attempt, on_retry)
+            else:
+                self.on_success()
+                return result
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+class RetryBudget:
+    """Caps retries to a share of requests.
+
+    Every request deposits ratio and every retry withdraws one, so
+    retries stay under ratio of the traffic once the initial
+    min_retries are spent, and a failing API is not flooded."""
+
+    def __init__(self, ratio=0.1, min_retries=10):
+        self.ratio = ratio
+        self.cap = max(min_retries, 1)
+        self.balance = float(min_retries)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class TokenBucket:
+    """Allows rate requests a second with bursts of up to burst."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Paces requests with one bucket for the application and one per user.
+
+    Share one RateLimiter between the connections of an application
+    key. Either rate may be None for no limit."""
+
+    def __init__(self, app_rate=None, app_burst=None, user_rate=None,
+                 user_burst=None, clock=time.monotonic):
+        self.app_bucket = None
+        if app_rate is not None:
+            self.app_bucket = TokenBucket(app_rate, app_burst, clock)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.clock = clock
+        self.user_buckets = {}
+        self.lock = threading.Lock()
+
+    def get_user_bucket(self, user_id):
+        with self.lock:
+            bucket = self.user_buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst, self.clock)
+                self.user_buckets[user_id] = bucket
+            return bucket
+
+    def reserve(self, user_id=None):
+        """Return the seconds to wait before a request for user_id."""
+        delay = 0
+        if self.app_bucket is not None:
+            delay = self.app_bucket.reserve()
+        if self.user_rate is not None and user_id is not None:
+            delay = max(delay, self.get_user_bucket(user_id).reserve())
+        return delay
+
+
+class AimdLimit:
+    """A concurrency limit that grows by one per limit successes and
+    halves when throttled."""
+
+    def __init__(self, initial=8, min_limit=1, max_limit=64):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+
+    def increase(self):
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def decrease(self):
+        self.limit = max(self.min_limit, self.limit / 2)
+
+    def is_full(self):
+        return self.in_flight >= int(self.limit)
+
+
+class AdaptiveConcurrency(AimdLimit):
+    """Bounds the requests in flight across threads to the AIMD limit."""
+
+    def __init__(self, initial=8, min_limit=1, max_limit=64):
+        AimdLimit.__init__(self, initial, min_limit, max_limit)
+        self.cond = threading.Condition()
+
+    def increase(self):
+        with self.cond:
+            AimdLimit.increase(self)
+            self.cond.notify()
+
+    def decrease(self):
+        with self.cond:
+            AimdLimit.decrease(self)
+
+    def __enter__(self):
+        with self.cond:
+            while self.is_full():
+                self.cond.wait()
+            self.in_flight += 1
+
+    def __exit__(self, *exc_info):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify()
+
+
+class AsyncAdaptiveConcurrency(AimdLimit):
+    """Bounds the requests in flight on one event loop to the AIMD limit."""
+
+    def __init__(self, initial=8, min_limit=1, max_limit=64):
+        AimdLimit.__init__(self, initial, min_limit, max_limit)
+        self.cond = None
+
+    def get_cond(self):
+        if self.cond is None:
+            self.cond = asyncio.Condition()
+        return self.cond
+
+    async def __aenter__(self):
+        cond = self.get_cond()
+        async with cond:
+            await cond.wait_for(lambda: not self.is_full())
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        cond = self.get_cond()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify_all()
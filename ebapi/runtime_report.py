@@ -0,0 +1,79 @@
+"""Stream runtimeReport history into pandas frames."""
+
+import datetime as dt
+
+max_report_days = 31
+default_chunk_days = 7
+default_columns = ["zoneAveTemp", "zoneHumidity", "zoneCoolTemp",
+                   "zoneHeatTemp", "zoneHvacMode", "zoneClimate",
+                   "outdoorTemp", "compCool1", "compHeat1", "auxHeat1",
+                   "fan"]
+text_columns = {"hvacMode", "zoneCalendarEvent", "zoneClimate",
+                "zoneHvacMode"}
+
+
+def iter_runtime_report(conn, identifiers, start, end, columns=None,
+                        chunk_days=default_chunk_days):
+    """Yield (identifier, frame) blocks of the 5 minute runtime history
+    of identifiers from the start to the end date, inclusive.
+
+    Thermostats are requested in selections of one user and at most
+    max_selection_size identifiers, and dates in ranges of chunk_days,
+    so only the json of one request is held at a time. Each frame is
+    indexed by timestamp with float64 columns, apart from the text
+    columns which are strings. A thermostat's blocks are yielded in
+    date order."""
+    if isinstance(identifiers, str):
+        identifiers = [identifiers]
+    columns = list(default_columns if columns is None else columns)
+    ranges = list(get_date_ranges(to_date(start), to_date(end), chunk_days))
+    for chunk in conn.get_selection_chunks(identifiers):
+        for first, last in ranges:
+            body = format_report(first, last, columns)
+            reports = conn.send_report(body, chunk)
+            for i, report in enumerate(reports):
+                # Drop each raw report once parsed.
+                reports[i] = None
+                yield (report["thermostatIdentifier"],
+                       parse_report_rows(report["rowList"], columns))
+
+
+def get_date_ranges(start, end, days):
+    """Yield inclusive (first, last) dates covering start to end in
+    ranges of at most days days."""
+    days = max(1, min(days, max_report_days))
+    while start <= end:
+        last = min(end, start + dt.timedelta(days=days - 1))
+        yield start, last
+        start = last + dt.timedelta(days=1)
+
+
+def to_date(date):
+    if isinstance(date, str):
+        return dt.date.fromisoformat(date)
+    if isinstance(date, dt.datetime):
+        return date.date()
+    return date
+
+
+def format_report(first, last, columns):
+    return {"startDate": first.isoformat(),
+            "endDate": last.isoformat(),
+            "columns": ",".join(columns),
+            "selection": {}}
+
+
+def parse_report_rows(rows, columns):
+    """Return a frame of the "date,time,col,..." rows of a report."""
+    import pandas as pd
+    fields = [row.split(",") for row in rows]
+    frame = pd.DataFrame(fields, columns=["date", "time"] + columns)
+    del fields
+    timestamps = pd.to_datetime(frame.pop("date") + " " + frame.pop("time"))
+    frame.index = pd.DatetimeIndex(timestamps, name="timestamp")
+    for col in columns:
+        if col in text_columns:
+            frame[col] = frame[col].astype("string")
+        else:
+            frame[col] = pd.to_numeric(frame[col], errors="coerce").astype("float64")
+    return frame
@@ -1,12 +1,41 @@
 """An Ecobee API Schedule."""
 
 import datetime as dt
+from collections.abc import Sequence
+
+days_of_the_week = ["Monday",
+                    "Tuesday",
+                    "Wednesday",
+                    "Thursday",
+                    "Friday",
+                    "Saturday",
+                    "Sunday"]
+slots_per_day = 48
 
 
 class Schedule:
+    """A week of half hour slots, each naming a climate.
+
+    codes is a days by 48 array of indexes into the climate names
+    table, so an edit of a time range is one assignment across every
+    day it touches. to_json returns the lists of names the API uses.
+    Every day must have 48 slots, as the API's do.
+
+    days are views of codes: setting a slot of days[i].schedule
+    changes the week."""
 
     def __init__(self, week_schedule):
-        self.days = [Day(i, sched) for i, sched in enumerate(week_schedule)]
+        import numpy as np
+        self.names = []
+        self.name_codes = {}
+        codes = [[self.get_code(name) for name in day] for day in week_schedule]
+        if any(len(day) != slots_per_day for day in codes):
+            raise ValueError("Every day of a Schedule needs {} slots".format(slots_per_day))
+        self.codes = np.array(codes, dtype=np.int16).reshape(-1, slots_per_day)
+
+    @property
+    def days(self):
+        return [Day(i, self) for i in range(len(self.codes))]
 
     def __str__(self):
         str_rep = "Week Schedule:\n"
@@ -14,18 +43,37 @@ class Schedule:
             str_rep += str(day)
         return str_rep
 
+    def get_code(self, name):
+        """Return the code of climate name, adding it to the table."""
+        code = self.name_codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.names.append(name)
+            self.name_codes[name] = code
+        return code
+
     def replace_weekdays(self, dt_start, dt_end, climate_id):
         weekdays = self.get_weekday_indicies()
         self.update_schedule(weekdays, dt_start, dt_end, climate_id)
 
     def update_schedule(self, day_nums, dt_start, dt_end, climate_id):
-        for day_num in day_nums:
-            self.days[day_num].modify_schedule(dt_start,
-                                               dt_end,
-                                               climate_id)
+        """Set climate_id from dt_start through the slot of dt_end on
+        every day in day_nums."""
+        start_index, end_index = get_range(dt_start, dt_end)
+        self.codes[list(day_nums), start_index:end_index + 1] = self.get_code(climate_id)
+
+    def get_day(self, day_num):
+        """Return the climate names of day_num."""
+        return [self.names[code] for code in self.codes[day_num].tolist()]
+
+    def collapse(self, day_num):
+        """Return (start index, end index, climate) of each run of one
+        climate on day_num, end inclusive."""
+        return [(start, end, self.names[code])
+                for start, end, code in collapse_codes(self.codes[day_num])]
 
     def to_json(self):
-        return [day.schedule for day in self.days]
+        return [self.get_day(day_num) for day_num in range(len(self.codes))]
 
     def get_weekday_indicies(self):
         for i in range(5):
@@ -33,21 +81,20 @@ class Schedule:
 
 
 class Day:
+    """One day of a Schedule."""
 
-    def __init__(self, day_num, schedule):
-        days_of_the_week = ["Monday",
-                            "Tuesday",
-                            "Wednesday",
-                            "Thursday",
-                            "Friday",
-                            "Saturday",
-                            "Sunday"]
+    def __init__(self, day_num, week):
         self.day_of_week = days_of_the_week[day_num]
-        self.schedule = schedule
+        self.day_num = day_num
+        self.week = week
+
+    @property
+    def schedule(self):
+        return DaySchedule(self.week, self.day_num)
 
     def __str__(self):
         str_rep = self.day_of_week + "\n"
-        vals = collapse(self.schedule)
+        vals = self.week.collapse(self.day_num)
         for start, end, climate in vals:
             start_time = get_time(start)
             end_time = get_time(end)
@@ -56,13 +103,40 @@ class Day:
         return str_rep
 
     def modify_schedule(self, start_time, end_time, climate):
-        if start_time > end_time:
-            raise ValueError("Start Time must be after End Time")
+        self.week.update_schedule([self.day_num], start_time, end_time, climate)
+
+
+class DaySchedule(Sequence):
+    """The climate names of the slots of one day, read from and written
+    to the codes of its Schedule."""
 
-        start_index = get_index(start_time)
-        end_index = get_index(end_time)
-        for i in range(start_index, end_index + 1):
-            self.schedule[i] = climate
+    def __init__(self, week, day_num):
+        self.week = week
+        self.day_num = day_num
+
+    def __getitem__(self, index):
+        codes = self.week.codes[self.day_num, index]
+        if isinstance(index, slice):
+            return [self.week.names[code] for code in codes.tolist()]
+        return self.week.names[codes]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [self.week.get_code(name) for name in value]
+        else:
+            value = self.week.get_code(value)
+        self.week.codes[self.day_num, index] = value
+
+    def __len__(self):
+        return self.week.codes.shape[1]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, DaySchedule)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
 
 
 def get_time(index):
@@ -75,14 +149,26 @@ def get_index(time):
     return int(time.hour * 2 + time.minute / 30)
 
 
+def get_range(start_time, end_time):
+    if start_time > end_time:
+        raise ValueError("Start Time must be after End Time")
+    return get_index(start_time), get_index(end_time)
+
+
+def collapse_codes(codes):
+    """Return (start, end, code) of each run of equal codes, end inclusive."""
+    import numpy as np
+    if len(codes) == 0:
+        return []
+    changes = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    starts = np.concatenate(([0], changes))
+    ends = np.concatenate((changes - 1, [len(codes) - 1]))
+    return list(zip(starts.tolist(), ends.tolist(), codes[starts].tolist()))
+
+
 def collapse(alist):
-    rt_list = []
-    current = alist[0]
-    start_index = 0
-    for i, val in enumerate(alist[1:]):
-        if val != current:
-            rt_list.append((start_index, i, current))
-            current = val
-            start_index = i + 1
-    rt_list.append((start_index, i + 1, val))
-    return rt_list
+    """Return (start, end, value) of each run of equal values in alist,
+    end inclusive."""
+    import numpy as np
+    runs = collapse_codes(np.asarray(alist))
+    return [(start, end, alist[start]) for start, end, _ in runs]
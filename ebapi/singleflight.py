@@ -0,0 +1,85 @@
+"""Share one request between concurrent callers asking for the same get."""
+
+import copy
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Runs one call per key at a time for ApiConnection gets.
+
+    The first thread to ask for a key makes the call. Threads asking for
+    the same key while it is in flight wait for it and receive a copy
+    of a snapshot of its result, or its exception. calls counts the calls made and
+    saved the calls avoided."""
+
+    def __init__(self):
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.saved = 0
+
+    def do(self, key, func):
+        """Return func(), or a copy of the result of the call of key
+        already in flight."""
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.calls += 1
+            else:
+                self.saved += 1
+        if leader:
+            return self.lead(key, func, future)
+        return copy.deepcopy(future.result())
+
+    def lead(self, key, func, future):
+        try:
+            result = func()
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            # Followers copy from a snapshot the caller cannot edit.
+            future.set_result(copy.deepcopy(result))
+            return result
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+
+class AsyncSingleFlight:
+    """The SingleFlight of an AsyncApiConnection, shared between the
+    coroutines of one event loop.
+
+    The call runs in its own task, so cancelling the coroutine that
+    started it does not cancel the callers waiting for the same key."""
+
+    def __init__(self):
+        self.in_flight = {}
+        self.calls = 0
+        self.saved = 0
+
+    async def do(self, key, func):
+        """Return await func(), or a copy of the result of the call of
+        key already in flight."""
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.saved += 1
+            return copy.deepcopy(await asyncio.shield(task))
+        task = asyncio.ensure_future(func())
+        self.in_flight[key] = task
+        self.calls += 1
+        task.add_done_callback(lambda done: self.finish(key, done))
+        # Followers may resume after the caller edited its result.
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def finish(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            # Marks the exception retrieved when every caller was cancelled.
+            task.exception()
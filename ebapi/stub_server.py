@@ -0,0 +1,391 @@
+"""A local stand-in for the ecobee API, for tests and benchmarks.
+
+Serves /1/thermostat, /1/thermostatSummary, /authorize and /token for a
+synthetic fleet of thermostats. Latency, expired tokens (code 14) and
+other error codes can be injected.
+
+$ python -m ebapi.stub_server --thermostats 100 --latency 0.05
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+SUCCESS = 0
+PROCESSING_ERROR = 3
+VALIDATION_ERROR = 7
+INVALID_FUNCTION = 8
+EXPIRED_TOKEN = 14
+max_selection_size = 25
+token_lifetime = 3600
+first_identifier = 500000000000
+
+include_parts = {"includeSettings": "settings",
+                 "includeProgram": "program",
+                 "includeRuntime": "runtime",
+                 "includeExtendedRuntime": "extendedRuntime",
+                 "includeSensors": "remoteSensors",
+                 "includeEvents": "events",
+                 "includeLocation": "location",
+                 "includeAlerts": "alerts"}
+function_types = ("createVacation", "deleteVacation", "resumeProgram")
+
+
+class StubApi:
+    """The state of a synthetic fleet and the responses to requests.
+
+    n_thermostats thermostats are spread round robin over n_users users.
+    latency seconds are slept before every response. A request is
+    answered with an expired token error with probability expired_rate
+    and with error_code with probability error_rate. With probability
+    throttle_rate it is refused with HTTP 429 and no API status, like
+    a rate limiting proxy. These can be changed while the server runs.
+    Posts selecting any identifier in rejected fail validation."""
+
+    def __init__(self, n_thermostats=10, n_users=1, latency=0,
+                 expired_rate=0, error_rate=0, error_code=PROCESSING_ERROR,
+                 throttle_rate=0, seed=None):
+        self.latency = latency
+        self.expired_rate = expired_rate
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.throttle_rate = throttle_rate
+        self.rejected = set()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.users = {}
+        self.access_tokens = {}
+        self.refresh_tokens = {}
+        self.thermostats = {}
+        self.tstat_users = {}
+        self.token_count = 0
+        for i in range(n_users):
+            self.add_user(str(i + 1))
+        user_ids = list(self.users)
+        for i in range(n_thermostats):
+            identifier = str(first_identifier + i)
+            self.thermostats[identifier] = make_thermostat(identifier, i)
+            self.tstat_users[identifier] = user_ids[i % n_users]
+
+    def add_user(self, user_id):
+        self.users[user_id] = None
+        return self.grant_tokens(user_id)
+
+    def grant_tokens(self, user_id):
+        """Replace the tokens of user_id and return the token json."""
+        with self.lock:
+            self.token_count += 1
+            old = self.users.get(user_id)
+            if old is not None:
+                self.access_tokens.pop(old[0], None)
+                self.refresh_tokens.pop(old[1], None)
+            acc = "acc-{}-{}".format(user_id, self.token_count)
+            ref = "ref-{}-{}".format(user_id, self.token_count)
+            self.users[user_id] = (acc, ref)
+            self.access_tokens[acc] = user_id
+            self.refresh_tokens[ref] = user_id
+        return {"access_token": acc, "refresh_token": ref,
+                "token_type": "Bearer", "expires_in": token_lifetime,
+                "scope": "smartWrite"}
+
+    def expire_tokens(self):
+        """Make every current access token answer with code 14."""
+        with self.lock:
+            self.access_tokens.clear()
+
+    def register(self, tokens):
+        """Insert the fleet's users, tokens and thermostats into a token
+        store so an ApiConnection can talk to this server."""
+        expires_at = time.time() + token_lifetime
+        for user_id, (acc, ref) in self.users.items():
+            tokens.insert_user(user_id, acc, ref, expires_at)
+        for identifier, user_id in self.tstat_users.items():
+            tokens.insert_tstat(user_id, identifier)
+
+    def get_identifiers(self):
+        return list(self.thermostats)
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def handle(self, method, path, query, headers, data):
+        """Return (http status, json) for a request."""
+        endpoint = path.rstrip("/").rsplit("/", 1)[-1]
+        self.count(endpoint)
+        if self.latency:
+            time.sleep(self.latency)
+        if endpoint == "authorize":
+            return 200, {"ecobeePin": "ABCD", "code": "stub-auth-code",
+                         "scope": "smartWrite", "expires_in": 9,
+                         "interval": 30}
+        if endpoint == "token":
+            return self.handle_token(query)
+        if self.random.random() < self.throttle_rate:
+            return 429, {"message": "Too many requests"}
+        user_id, error = self.authenticate(headers)
+        if error is not None:
+            return error
+        if endpoint == "thermostat" and method == "GET":
+            return self.handle_get(user_id, json.loads(query["body"]))
+        if endpoint == "thermostat" and method == "POST":
+            return self.handle_post(user_id, json.loads(data))
+        if endpoint == "thermostatSummary":
+            return self.handle_summary(user_id, json.loads(query["body"]))
+        return 404, status(PROCESSING_ERROR, "Unknown endpoint " + path)
+
+    def handle_token(self, query):
+        grant = query.get("grant_type")
+        if grant == "ecobeePin":
+            return 200, self.add_user(str(len(self.users) + 1))
+        if grant == "refresh_token":
+            user_id = self.refresh_tokens.get(query.get("code"))
+            if user_id is None:
+                return 400, {"error": "invalid_grant",
+                             "error_description": "The refresh token is invalid."}
+            return 200, self.grant_tokens(user_id)
+        return 400, {"error": "unsupported_grant_type"}
+
+    def authenticate(self, headers):
+        """Return (user_id, None) or (None, error response)."""
+        auth = headers.get("Authorization", "")
+        user_id = self.access_tokens.get(auth[len("Bearer "):])
+        if user_id is None or self.random.random() < self.expired_rate:
+            return None, (500, status(EXPIRED_TOKEN, "Authentication token has expired."))
+        if self.random.random() < self.error_rate:
+            return None, (500, status(self.error_code, "Injected error."))
+        return user_id, None
+
+    def select(self, user_id, selection):
+        """Return the identifiers of selection or an error response."""
+        if selection.get("selectionType") == "registered":
+            return [i for i, u in self.tstat_users.items() if u == user_id], None
+        identifiers = [i for i in selection.get("selectionMatch", "").split(",") if i]
+        if len(identifiers) > max_selection_size:
+            return None, (500, status(PROCESSING_ERROR, "Selection too large."))
+        for identifier in identifiers:
+            if self.tstat_users.get(identifier) != user_id:
+                return None, (500, status(PROCESSING_ERROR,
+                                          "Thermostat {} not registered.".format(identifier)))
+        return identifiers, None
+
+    def handle_get(self, user_id, body):
+        selection = body.get("selection", {})
+        identifiers, error = self.select(user_id, selection)
+        if error is not None:
+            return error
+        with self.lock:
+            tstats = [format_thermostat(self.thermostats[i], selection)
+                      for i in identifiers]
+        resp = status(SUCCESS)
+        resp["thermostatList"] = tstats
+        resp["page"] = {"page": 1, "totalPages": 1, "pageSize": len(tstats),
+                        "total": len(tstats)}
+        return 200, resp
+
+    def handle_summary(self, user_id, body):
+        identifiers, error = self.select(user_id, body.get("selection", {}))
+        if error is not None:
+            return error
+        with self.lock:
+            revisions = [format_revision(self.thermostats[i]) for i in identifiers]
+        resp = status(SUCCESS)
+        resp["revisionList"] = revisions
+        resp["thermostatCount"] = len(revisions)
+        return 200, resp
+
+    def handle_post(self, user_id, body):
+        identifiers, error = self.select(user_id, body.get("selection", {}))
+        if error is not None:
+            return error
+        if self.rejected.intersection(identifiers):
+            return 500, status(VALIDATION_ERROR, "Update rejected.")
+        functions = body.get("functions", [])
+        for function in functions:
+            if function.get("type") not in function_types:
+                return 500, status(INVALID_FUNCTION, "Invalid function: {}".format(
+                    function.get("type")))
+        with self.lock:
+            for identifier in identifiers:
+                tstat = self.thermostats[identifier]
+                apply_update(tstat, body.get("thermostat", {}))
+                for function in functions:
+                    apply_function(tstat, function)
+                tstat["thermostatRev"] = str(int(tstat["thermostatRev"]) + 1)
+        return 200, status(SUCCESS)
+
+
+class StubServer:
+    """Runs a StubApi on a local port in a background thread.
+
+    url_base is passed to ApiConnection as its url_base."""
+
+    def __init__(self, api=None, host="127.0.0.1", port=0, **api_kwargs):
+        self.api = StubApi(**api_kwargs) if api is None else api
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.api = self.api
+        self.thread = None
+
+    @property
+    def url_base(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/".format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       kwargs={"poll_interval": 0.05},
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        self.respond("POST")
+
+    def respond(self, method):
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        try:
+            code, resp = self.server.api.handle(method, parts.path, query,
+                                                self.headers, data)
+        except (KeyError, ValueError) as err:
+            code, resp = 400, status(PROCESSING_ERROR, "Bad request: {}".format(err))
+        content = json.dumps(resp).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def status(code, message=""):
+    return {"status": {"code": code, "message": message}}
+
+
+def make_thermostat(identifier, i):
+    climates = [{"name": name, "climateRef": name.lower(), "coolTemp": 750,
+                 "heatTemp": 680, "isOccupied": name != "Away",
+                 "sensors": [{"id": "ei:0", "name": "Thermostat"}]}
+                for name in ["Home", "Away", "Sleep"]]
+    day = ["sleep"] * 12 + ["home"] * 4 + ["away"] * 20 + ["home"] * 10 + ["sleep"] * 2
+    temp = 700 + i % 20
+    return {"identifier": identifier,
+            "name": "Thermostat {}".format(i),
+            "thermostatRev": "1",
+            "alertsRev": "1",
+            "runtimeRev": "1",
+            "intervalRev": "1",
+            "utcTime": "2020-01-01 00:00:00",
+            "thermostatTime": "2019-12-31 19:00:00",
+            "settings": {"hvacMode": "auto", "disablePreCooling": False,
+                         "heatStages": 1, "coolStages": 1},
+            "program": {"schedule": [list(day) for _ in range(7)],
+                        "climates": climates,
+                        "currentClimateRef": "home"},
+            "runtime": {"connected": True, "actualTemperature": temp,
+                        "actualHumidity": 40, "desiredHeat": 680,
+                        "desiredCool": 750,
+                        "lastStatusModified": "2020-01-01 00:00:00"},
+            "extendedRuntime": {"actualTemperature": [temp] * 3},
+            "remoteSensors": [{"id": "ei:0", "name": "Thermostat",
+                               "type": "thermostat",
+                               "capability": [{"id": "1", "type": "temperature",
+                                               "value": str(temp)}]}],
+            "events": [],
+            "location": {"mapCoordinates": "43.6, -79.4"},
+            "alerts": []}
+
+
+def format_thermostat(tstat, selection):
+    keys = ["identifier", "name", "thermostatRev", "utcTime", "thermostatTime"]
+    resp = {key: tstat[key] for key in keys}
+    for flag, part in include_parts.items():
+        if selection.get(flag):
+            resp[part] = json.loads(json.dumps(tstat[part]))
+    return resp
+
+
+def format_revision(tstat):
+    return ":".join([tstat["identifier"], tstat["name"], "true",
+                     tstat["thermostatRev"], tstat["alertsRev"],
+                     tstat["runtimeRev"], tstat["intervalRev"]])
+
+
+def apply_update(tstat, update):
+    if "settings" in update:
+        tstat["settings"].update(update["settings"])
+    if "program" in update:
+        tstat["program"] = update["program"]
+
+
+def apply_function(tstat, function):
+    params = function.get("params", {})
+    if function["type"] == "createVacation":
+        event = dict(params, type="vacation")
+        tstat["events"].append(event)
+    elif function["type"] == "deleteVacation":
+        tstat["events"] = [e for e in tstat["events"]
+                           if e.get("name") != params.get("name")]
+    elif function["type"] == "resumeProgram":
+        tstat["events"] = [e for e in tstat["events"] if e["type"] == "vacation"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--thermostats", type=int, default=10)
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--expired-rate", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-code", type=int, default=PROCESSING_ERROR)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    args = parser.parse_args(argv)
+    server = StubServer(host=args.host, port=args.port,
+                        n_thermostats=args.thermostats, n_users=args.users,
+                        latency=args.latency, expired_rate=args.expired_rate,
+                        error_rate=args.error_rate, error_code=args.error_code,
+                        throttle_rate=args.throttle_rate)
+    print("Serving {} thermostats at {}".format(args.thermostats, server.url_base))
+    for user_id, (acc, ref) in server.api.users.items():
+        print("User {} access token {} refresh token {}".format(user_id, acc, ref))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
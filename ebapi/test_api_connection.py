@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import sys
+import threading
+import subprocess
+import unittest
+
+os.environ.setdefault("ECOBEE_APPLICATION_KEY", "test_app_key")
+
+from ebapi.api_connection import ApiConnection, ApiError
+from ebapi.api_interface import ApiInterface
+from ebapi.transport import Transport, RequestsTransport
+from ebapi.cache import ResponseCache
+from ebapi.codec import get_codec, StdlibCodec
+from ebapi.metrics import MetricsRegistry
+
+stub_id = "123456789012"
+stub_user_id = "1"
+stub_acc = "a"
+stub_ref = "b"
+
+
+class TestApiConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        load_evs(self.tmp_dir)
+        self.transport = StubTransport()
+        self.conn = ApiConnection(transport=self.transport,
+                                  url_base="http://localhost:8080/")
+        self.conn.tokens.insert(stub_user_id, stub_id, stub_acc, stub_ref)
+
+    def tearDown(self):
+        clear_env_vars()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_import_is_lazy(self):
+        code = ("import sys, ebapi.api_interface as api; api.ApiInterface(); "
+                "print(sorted(m for m in ['pandas', 'requests'] if m in sys.modules))")
+        env = {k: v for k, v in os.environ.items()
+               if not k.startswith("EBAPI_") and k != "ECOBEE_APPLICATION_KEY"}
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        out = subprocess.run([sys.executable, "-c", code], env=env,
+                             check=True, capture_output=True, text=True)
+        self.assertEqual(out.stdout.strip(), "[]")
+
+    def test_default_transport_is_pooled(self):
+        transport = RequestsTransport(pool_size=3, read_timeout=5)
+        adapter = transport.session.get_adapter("https://api.ecobee.com/")
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(transport.timeout[1], 5)
+
+    def test_lazy_defaults_are_built_once(self):
+        conn = ApiConnection()
+        built = []
+
+        def default_transport():
+            time.sleep(0.01)
+            built.append(1)
+            return StubTransport()
+
+        conn.default_transport = default_transport
+        threads = [threading.Thread(target=lambda: conn.transport)
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(built), 1)
+
+    def test_send_get_uses_transport(self):
+        self.transport.queue(thermostat_resp(stub_id))
+        resp = self.conn.send_get({}, stub_id)
+        self.assertEqual(resp["identifier"], stub_id)
+        method, url, kwargs = self.transport.calls[0]
+        self.assertEqual(method, "GET")
+        self.assertEqual(url, "http://localhost:8080/1/thermostat")
+        self.assertEqual(kwargs["headers"]["Authorization"], "Bearer a")
+
+    def test_send_post_uses_transport(self):
+        self.transport.queue(status_resp(0))
+        self.conn.send_post({"functions": []}, stub_id)
+        method, url, kwargs = self.transport.calls[0]
+        body = json.loads(kwargs["data"])
+        self.assertEqual(method, "POST")
+        self.assertEqual(body["selection"]["selectionMatch"], stub_id)
+
+    def test_send_get_many_groups_by_user(self):
+        other_ids = ["2000000000{:02d}".format(i) for i in range(30)]
+        self.conn.tokens.insert_user("2", "c", "d")
+        for identifier in other_ids:
+            self.conn.tokens.insert_tstat("2", identifier)
+        self.transport.queue(thermostat_resp(stub_id),
+                             thermostat_resp(*other_ids[:25]),
+                             thermostat_resp(*other_ids[25:]))
+
+        resps = self.conn.send_get_many({}, [stub_id] + other_ids)
+
+        self.assertEqual(list(resps), [stub_id] + other_ids)
+        tokens = [kw["headers"]["Authorization"]
+                  for _, _, kw in self.transport.calls]
+        self.assertEqual(tokens, ["Bearer a", "Bearer c", "Bearer c"])
+        body = json.loads(self.transport.calls[2][2]["params"]["body"])
+        self.assertEqual(body["selection"]["selectionMatch"],
+                         ",".join(other_ids[25:]))
+
+    def test_send_summary_many(self):
+        self.transport.queue(dict(status_resp(0),
+                                  revisionList=[stub_id + ":Home:true:1:2:3:4"]))
+        revisions = self.conn.send_summary_many([stub_id])
+        self.assertEqual(revisions, {stub_id: stub_id + ":Home:true:1:2:3:4"})
+        self.assertEqual(self.transport.calls[0][1],
+                         "http://localhost:8080/1/thermostatSummary")
+
+    def test_post_data_is_encoded_bytes(self):
+        self.conn.codec = StdlibCodec()
+        self.transport.queue(status_resp(0))
+        self.conn.send_post({"functions": []}, stub_id)
+        self.assertIsInstance(self.transport.calls[0][2]["data"], bytes)
+
+    def test_codec_choice(self):
+        self.assertEqual(get_codec("json").name, "json")
+        os.environ["EBAPI_JSON_CODEC"] = "json"
+        try:
+            self.assertEqual(get_codec().name, "json")
+        finally:
+            del os.environ["EBAPI_JSON_CODEC"]
+        with self.assertRaisesRegex(ValueError, "Unknown json codec"):
+            get_codec("yaml")
+
+    def test_expiring_token_refreshed_before_request(self):
+        self.conn.tokens.insert("2", "200000000000", "c", "d", time.time() + 5)
+        self.transport.queue({"access_token": "e", "refresh_token": "f",
+                              "expires_in": 3600},
+                             thermostat_resp("200000000000"))
+        self.conn.send_get({}, "200000000000")
+        token_url = self.transport.calls[0][1]
+        headers = self.transport.calls[1][2]["headers"]
+        self.assertEqual(token_url, "http://localhost:8080/token")
+        self.assertEqual(headers["Authorization"], "Bearer e")
+
+    def test_expired_token_refreshes_owning_user_once(self):
+        self.conn.tokens.insert("2", "200000000000", "c", "d")
+        refreshed = []
+
+        def slow_refresh(ref_token):
+            refreshed.append(ref_token)
+            time.sleep(0.05)
+            return "new_a", "new_b", None
+
+        self.conn.refresh_user_tokens = slow_refresh
+        threads = [threading.Thread(target=self.conn.refresh_user,
+                                    args=(stub_user_id, stub_acc))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(refreshed, [stub_ref])
+        self.assertEqual(self.conn.tokens.get_access_token(stub_id), "new_a")
+        self.assertEqual(self.conn.tokens.get_access_token("200000000000"), "c")
+
+    def test_debug_log_redacts_token(self):
+        self.transport.queue(thermostat_resp(stub_id))
+        with self.assertLogs("ebapi.api_connection", "DEBUG") as logs:
+            self.conn.send_get({}, stub_id)
+        record = logs.records[0]
+        self.assertEqual(record.thermostat, stub_id)
+        self.assertEqual(record.request["headers"]["Authorization"],
+                         "Bearer <redacted>")
+        self.assertNotIn("Bearer a", record.getMessage())
+
+    def test_metrics_recorded(self):
+        metrics = self.conn.metrics = MetricsRegistry()
+        self.conn.tokens.insert("2", "200000000000", "c", "d")
+        self.conn.refresh_user_tokens = lambda ref_token: ("e", "f", None)
+        self.transport.queue(status_resp(14), thermostat_resp("200000000000"),
+                             status_resp(0))
+        self.conn.send_get({}, "200000000000")
+        self.conn.send_functions([{"type": "resumeProgram"}] * 3, stub_id)
+        self.assertEqual(metrics.get("ebapi_responses_total",
+                                     endpoint="thermostat", code=14), 1)
+        self.assertEqual(metrics.get("ebapi_retries_total",
+                                     reason="expired_token"), 1)
+        self.assertEqual(metrics.get("ebapi_request_seconds",
+                                     endpoint="thermostat", method="get"), 2)
+        self.assertEqual(metrics.get("ebapi_batch_size", kind="functions"), 1)
+        self.assertIn('ebapi_responses_total{code="0",endpoint="thermostat"} 2',
+                      metrics.render())
+
+    def test_api_error(self):
+        self.transport.queue(status_resp(3, "processing error"))
+        with self.assertRaisesRegex(ApiError, "Code: 3"):
+            self.conn.send_get({}, stub_id)
+
+    def test_cached_get_skips_transport_until_post(self):
+        self.conn.cache = ResponseCache()
+        body = {"selection": {"includeSettings": True}}
+        self.transport.queue(thermostat_resp(stub_id), status_resp(0),
+                             thermostat_resp(stub_id))
+        self.conn.send_get(body, stub_id)
+        self.conn.send_get(body, stub_id)
+        self.assertEqual(len(self.transport.calls), 1)
+        self.conn.send_post({"functions": []}, stub_id)
+        self.conn.send_get(body, stub_id)
+        self.assertEqual(len(self.transport.calls), 3)
+
+    def test_cache_skips_uncached_flags(self):
+        self.conn.cache = ResponseCache()
+        body = {"selection": {"includeRuntime": True}}
+        self.transport.queue(thermostat_resp(stub_id), thermostat_resp(stub_id))
+        self.conn.send_get(body, stub_id)
+        self.conn.send_get(body, stub_id)
+        self.assertEqual(len(self.transport.calls), 2)
+
+    def test_cache_keeps_times(self):
+        self.conn.cache = ResponseCache()
+        self.transport.queue(thermostat_resp(stub_id))
+        self.conn.send_get({}, stub_id)
+        self.conn.send_get({}, stub_id)
+        self.assertEqual(len(self.transport.calls), 1)
+
+    def test_cache_expires(self):
+        now = [0]
+        self.conn.cache = ResponseCache(clock=lambda: now[0])
+        body = {"selection": {"includeLocation": True}}
+        self.transport.queue(thermostat_resp(stub_id), thermostat_resp(stub_id))
+        self.conn.send_get(body, stub_id)
+        now[0] = 3601
+        self.conn.send_get(body, stub_id)
+        self.assertEqual(len(self.transport.calls), 2)
+
+    def test_get_racing_a_post_is_not_cached(self):
+        self.conn.cache = ResponseCache()
+        body = {"selection": {"includeSettings": True}}
+        self.transport.queue(thermostat_resp(stub_id), thermostat_resp(stub_id))
+        send_get_list = self.conn.send_get_list
+
+        def post_during_get(body, identifier):
+            resp = send_get_list(body, identifier)
+            self.conn.cache.invalidate(identifier)
+            return resp
+        self.conn.send_get_list = post_during_get
+        self.conn.send_get(body, stub_id)
+        self.conn.send_get_many(body, [stub_id])
+        self.assertEqual(len(self.conn.cache), 0)
+
+
+class StubTransport(Transport):
+    """Replays queued json bodies and records every request."""
+
+    def __init__(self):
+        self.responses = []
+        self.calls = []
+
+    def queue(self, *bodies):
+        self.responses.extend(bodies)
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return StubResponse(self.responses.pop(0))
+
+
+class StubResponse:
+
+    def __init__(self, body):
+        self.body = body
+        self.status_code = 200
+        self.content = json.dumps(body).encode()
+
+    def json(self):
+        return self.body
+
+
+def status_resp(code, message=""):
+    return {"status": {"code": code, "message": message}}
+
+
+def thermostat_resp(*identifiers):
+    resp = status_resp(0)
+    resp["thermostatList"] = [{"identifier": i} for i in identifiers]
+    return resp
+
+
+def load_evs(tmp_dir):
+    os.environ["EBAPI_USER_TOKENS_FILE"] = os.path.join(tmp_dir, "user.csv")
+    os.environ["EBAPI_USER_TSTAT_FILE"] = os.path.join(tmp_dir, "tstat.csv")
+
+
+def clear_env_vars():
+    for ev in ["EBAPI_USER_TOKENS_FILE", "EBAPI_USER_TSTAT_FILE"]:
+        os.environ.pop(ev, None)
+
+
+class InterfaceTestCase(unittest.TestCase):
+    """Sets up an ApiInterface on a StubTransport with the stub
+    thermostat's tokens in a temporary directory.
+
+    Override get_interface_kwargs to pass more ApiInterface arguments."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        load_evs(self.tmp_dir)
+        self.transport = StubTransport()
+        self.interface = ApiInterface(transport=self.transport,
+                                      **self.get_interface_kwargs())
+        self.interface.conn.tokens.insert(stub_user_id, stub_id,
+                                          stub_acc, stub_ref)
+
+    def tearDown(self):
+        clear_env_vars()
+        shutil.rmtree(self.tmp_dir)
+
+    def get_interface_kwargs(self):
+        return {}
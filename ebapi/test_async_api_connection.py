@@ -0,0 +1,127 @@
+import json
+import asyncio
+import shutil
+import tempfile
+import unittest
+
+from ebapi.api_connection import ApiError, FunctionBatchError
+from ebapi.async_api_interface import AsyncApiInterface
+from ebapi.tracing import RecordingTracer
+from ebapi.transport import AsyncTransport, Response
+from ebapi.test_api_connection import (load_evs, clear_env_vars, status_resp,
+                                       thermostat_resp, stub_id, stub_user_id,
+                                       stub_acc, stub_ref)
+from ebapi.test_query import full_resp
+
+
+class TestAsyncApiInterface(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        load_evs(self.tmp_dir)
+        self.transport = AsyncStubTransport()
+        self.interface = AsyncApiInterface(transport=self.transport,
+                                           max_concurrency=2)
+        self.interface.conn.tokens.insert(stub_user_id, stub_id,
+                                          stub_acc, stub_ref)
+        self.refreshes = 0
+        self.interface.conn.refresh_user_tokens = self.count_refresh
+
+    def tearDown(self):
+        clear_env_vars()
+        shutil.rmtree(self.tmp_dir)
+
+    async def count_refresh(self, ref_token):
+        self.refreshes += 1
+        await asyncio.sleep(0.01)
+        return "new_a", "new_b", None
+
+    async def test_get_settings(self):
+        resp = thermostat_resp(stub_id)
+        resp["thermostatList"][0]["settings"] = {"disablePreCooling": True}
+        self.transport.queue(resp)
+        settings = await self.interface.get_precool_settings(stub_id)
+        self.assertEqual(settings, {"disablePreCooling": True})
+
+    async def test_concurrency_limit(self):
+        self.transport.queue(*[thermostat_resp(stub_id) for _ in range(6)])
+        await asyncio.gather(*[self.interface.conn.send_get({}, stub_id)
+                               for _ in range(6)])
+        self.assertEqual(self.transport.max_in_flight, 2)
+
+    async def test_expired_token_refreshes_once(self):
+        self.transport.queue(*[status_resp(14) for _ in range(3)])
+        self.transport.queue(*[thermostat_resp(stub_id) for _ in range(3)])
+        await asyncio.gather(*[self.interface.conn.send_get({}, stub_id)
+                               for _ in range(3)])
+        self.assertEqual(self.refreshes, 1)
+        self.assertEqual(self.interface.conn.tokens.get_access_token(stub_id),
+                         "new_a")
+
+    async def test_send_functions_concurrently(self):
+        self.transport.queue(*[status_resp(0) for _ in range(3)])
+        results = await self.interface.conn.send_functions(
+            [{"type": "resumeProgram"}] * 25, stub_id, max_concurrency=3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(self.transport.max_in_flight, 2)
+
+    async def test_send_functions_in_order_by_default(self):
+        self.transport.queue(*[status_resp(0) for _ in range(3)])
+        await self.interface.conn.send_functions(
+            [{"type": "resumeProgram"}] * 25, stub_id)
+        self.assertEqual(self.transport.max_in_flight, 1)
+
+    async def test_send_functions_finds_failed_function(self):
+        self.transport.queue(status_resp(8), status_resp(0), status_resp(8))
+        with self.assertRaises(FunctionBatchError) as ctx:
+            await self.interface.conn.send_functions(
+                [{"type": "resumeProgram"}, {"type": "unknown"}], stub_id)
+        self.assertEqual(list(ctx.exception.errors[stub_id]), [1])
+
+    async def test_post_changes_singleflight_key(self):
+        self.transport.queue(status_resp(0))
+        key = self.interface.conn.get_singleflight_key({}, stub_id)
+        await self.interface.conn.send_post({"functions": []}, stub_id)
+        self.assertNotEqual(self.interface.conn.get_singleflight_key({}, stub_id),
+                            key)
+
+    async def test_sync_with_is_rejected(self):
+        with self.assertRaisesRegex(TypeError, "async with"):
+            with self.interface.conn:
+                pass
+
+    async def test_tracer(self):
+        tracer = RecordingTracer()
+        interface = AsyncApiInterface(transport=self.transport, tracer=tracer)
+        interface.conn.tokens = self.interface.conn.tokens
+        self.transport.queue(full_resp(stub_id))
+        await interface.get_program(stub_id)
+        request = tracer.get_spans("send_get")[0]
+        self.assertEqual(tracer.get_spans("network")[0].parent_id,
+                         request.span_id)
+        self.assertEqual(len(tracer.get_spans("construct")), 1)
+
+    async def test_api_error(self):
+        self.transport.queue(status_resp(3, "processing error"))
+        with self.assertRaisesRegex(ApiError, "Code: 3"):
+            await self.interface.get_settings(stub_id)
+
+
+class AsyncStubTransport(AsyncTransport):
+    """Replays queued json bodies and tracks concurrent requests."""
+
+    def __init__(self):
+        self.responses = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def queue(self, *bodies):
+        self.responses.extend(bodies)
+
+    async def request(self, method, url, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        body = self.responses.pop(0)
+        return Response(200, json.dumps(body).encode())
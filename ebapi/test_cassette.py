@@ -0,0 +1,64 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from ebapi.api_interface import ApiInterface
+from ebapi.cassette import CassetteTransport, CassetteMissError, make_key
+from ebapi.program import Program
+from ebapi.stub_server import StubServer
+from ebapi.transport import RequestsTransport
+from ebapi.test_api_connection import load_evs, clear_env_vars
+
+
+class TestCassetteTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        load_evs(self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "traffic.json.gz")
+        self.server = StubServer(n_thermostats=3, seed=1).start()
+        self.identifiers = self.server.api.get_identifiers()
+        transport = CassetteTransport(self.path, RequestsTransport())
+        recorder = ApiInterface(transport=transport,
+                                url_base=self.server.url_base)
+        self.server.api.register(recorder.conn.tokens)
+        self.server.api.expire_tokens()
+        recorder.get_program(self.identifiers[0])
+        recorder.get_settings_many(self.identifiers)
+        recorder.conn.close()
+        self.server.stop()
+
+    def tearDown(self):
+        clear_env_vars()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_replay_without_server(self):
+        interface = ApiInterface(transport=CassetteTransport(self.path),
+                                 url_base="http://offline/")
+        self.assertIsInstance(interface.get_program(self.identifiers[0]),
+                              Program)
+        settings = interface.get_settings_many(list(reversed(self.identifiers)))
+        self.assertEqual(len(settings), 3)
+
+    def test_tokens_are_redacted(self):
+        with gzip.open(self.path, "rt") as cassette_file:
+            content = cassette_file.read()
+        self.assertIn("<redacted>", content)
+        for acc, ref in self.server.api.users.values():
+            self.assertNotIn(acc, content)
+            self.assertNotIn(ref, content)
+
+    def test_missing_request(self):
+        transport = CassetteTransport(self.path)
+        with self.assertRaises(CassetteMissError):
+            transport.get("http://offline/1/thermostatSummary",
+                          params={"format": "json", "body": "{}"})
+
+    def test_key_ignores_host_and_secrets(self):
+        key = make_key("POST", "http://a/token",
+                       {"params": {"grant_type": "refresh_token", "code": "x"}})
+        other = make_key("POST", "http://b/token",
+                         {"params": {"grant_type": "refresh_token", "code": "y"}})
+        self.assertEqual(key, other)
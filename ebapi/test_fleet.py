@@ -0,0 +1,102 @@
+import time
+import threading
+import unittest
+
+from ebapi.api_connection import ApiError
+from ebapi.fleet import FleetRunner
+from ebapi.tracing import RecordingTracer
+
+
+class TestFleetRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.interface = StubInterface({"a1": "a", "a2": "a", "a3": "a",
+                                        "b1": "b", "slow": "b"})
+
+    def test_results_stream_as_completed(self):
+        runner = FleetRunner(self.interface, max_workers=4)
+        run = runner.run("get_temp", ["slow", "a1", "b1"])
+        order = [result.identifier for result in run]
+        self.assertEqual(order[-1], "slow")
+        self.assertEqual(run.summary.total(), 3)
+
+    def test_per_user_limit(self):
+        runner = FleetRunner(self.interface, max_workers=4, per_user_limit=1)
+        run = runner.run(self.interface.get_temp, ["a1", "a2", "a3"])
+        results = run.collect()
+        self.assertEqual(self.interface.max_active["a"], 1)
+        self.assertTrue(all(r.succeeded() for r in results.values()))
+
+    def test_failures_are_summarised(self):
+        runner = FleetRunner(self.interface)
+        run = runner.run(self.interface.get_temp, ["a1", "broken", "unknown"])
+        results = run.collect()
+        self.assertEqual(results["a1"].result, {"temp": 700})
+        self.assertIsInstance(results["broken"].error, ApiError)
+        self.assertIsInstance(results["unknown"].error, KeyError)
+        self.assertEqual(run.summary.failure_counts(),
+                         {"ApiError": 1, "KeyError": 1})
+
+    def test_args_precede_identifier(self):
+        runner = FleetRunner(self.interface)
+        results = runner.run("update_settings", ["a1"], {"hvacMode": "off"}).collect()
+        self.assertEqual(results["a1"].result, ({"hvacMode": "off"}, "a1"))
+
+    def test_identifier_arg(self):
+        runner = FleetRunner(self.interface)
+        results = runner.run("update_disable_precool_setting", ["a1"], True,
+                             identifier_arg=0).collect()
+        self.assertEqual(results["a1"].result, ("a1", True))
+        results = runner.run("update_disable_precool_setting", ["a1"],
+                             cool_flag=False, identifier_arg="identifier").collect()
+        self.assertEqual(results["a1"].result, ("a1", False))
+
+    def test_calls_nest_under_caller_span(self):
+        tracer = self.interface.tracer = RecordingTracer()
+        runner = FleetRunner(self.interface, max_workers=4)
+        with tracer.span("fleet"):
+            runner.run("get_traced", ["a1", "a2", "b1"]).collect()
+        root = tracer.get_spans("fleet")[0]
+        spans = tracer.get_spans("send_get")
+        self.assertEqual(len(spans), 3)
+        for span in spans:
+            self.assertEqual(span.parent_id, root.span_id)
+            self.assertEqual(span.trace_id, root.trace_id)
+
+
+class StubInterface:
+    """Looks enough like an ApiInterface for a FleetRunner."""
+
+    def __init__(self, users):
+        self.conn = self
+        self.tokens = self
+        self.users = dict(users, broken="b")
+        self.lock = threading.Lock()
+        self.active = {}
+        self.max_active = {}
+
+    def get_user_id(self, identifier):
+        return self.users[identifier]
+
+    def get_temp(self, identifier):
+        user_id = self.users[identifier]
+        with self.lock:
+            self.active[user_id] = self.active.get(user_id, 0) + 1
+            self.max_active[user_id] = max(self.max_active.get(user_id, 0),
+                                           self.active[user_id])
+        time.sleep(0.2 if identifier == "slow" else 0.01)
+        with self.lock:
+            self.active[user_id] -= 1
+        if identifier == "broken":
+            raise ApiError("No thermostat temperature found")
+        return {"temp": 700}
+
+    def get_traced(self, identifier):
+        with self.tracer.span("send_get", identifier=identifier):
+            return identifier
+
+    def update_settings(self, settings, identifier):
+        return settings, identifier
+
+    def update_disable_precool_setting(self, identifier, cool_flag):
+        return identifier, cool_flag
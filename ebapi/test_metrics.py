@@ -0,0 +1,36 @@
+import unittest
+
+from ebapi.metrics import MetricsRegistry, NullMetrics
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_render_counter(self):
+        metrics = MetricsRegistry()
+        metrics.inc("ebapi_retries_total", reason="expired_token")
+        metrics.inc("ebapi_retries_total", 2, reason="expired_token")
+        text = metrics.render()
+        self.assertIn("# TYPE ebapi_retries_total counter", text)
+        self.assertIn('ebapi_retries_total{reason="expired_token"} 3', text)
+
+    def test_render_histogram(self):
+        metrics = MetricsRegistry(buckets={"latency": (0.1, 1)})
+        for value in (0.05, 0.5, 5):
+            metrics.observe("latency", value, endpoint="thermostat")
+        lines = metrics.render().splitlines()
+        self.assertIn('latency_bucket{endpoint="thermostat",le="0.1"} 1', lines)
+        self.assertIn('latency_bucket{endpoint="thermostat",le="1"} 2', lines)
+        self.assertIn('latency_bucket{endpoint="thermostat",le="+Inf"} 3', lines)
+        self.assertIn('latency_sum{endpoint="thermostat"} 5.55', lines)
+        self.assertIn('latency_count{endpoint="thermostat"} 3', lines)
+
+    def test_label_values_are_escaped(self):
+        metrics = MetricsRegistry()
+        metrics.inc("errors", message='bad "value"')
+        self.assertIn('errors{message="bad \\"value\\""} 1', metrics.render())
+
+    def test_null_metrics(self):
+        metrics = NullMetrics()
+        metrics.inc("ebapi_retries_total")
+        metrics.observe("ebapi_request_seconds", 1)
+        self.assertFalse(metrics.enabled)
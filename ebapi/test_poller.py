@@ -0,0 +1,83 @@
+import unittest
+
+from ebapi.poller import RevisionPoller, parse_revision
+
+
+class TestRevisionPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.conn = StubConnection({"t1": revision("t1", "1", "1", "1"),
+                                    "t2": revision("t2", "1", "1", "1")})
+        self.poller = RevisionPoller(self.conn, ["t1", "t2"],
+                                     min_interval=10, max_interval=40,
+                                     clock=lambda: self.now)
+        self.seen = []
+        self.poller.add_callback(lambda *args: self.seen.append(args))
+
+    def test_first_poll_fetches_everything(self):
+        changes = self.poller.poll()
+        self.assertEqual(changes["t1"], ["thermostat", "alerts", "runtime"])
+        self.assertEqual(len(self.conn.gets), 1)
+        self.assertEqual(self.conn.gets[0][1], ["t1", "t2"])
+        self.assertEqual(len(self.seen), 2)
+
+    def test_only_changed_revisions_are_fetched(self):
+        self.poller.poll()
+        self.conn.summary["t2"] = revision("t2", "1", "1", "2")
+        self.now = 100
+        changes = self.poller.poll()
+        self.assertEqual(changes, {"t2": ["runtime"]})
+        body, identifiers = self.conn.gets[-1]
+        self.assertEqual(identifiers, ["t2"])
+        self.assertEqual(body["selection"], {"includeRuntime": True,
+                                             "includeSensors": True})
+        self.assertEqual(self.seen[-1][:2], ("t2", ["runtime"]))
+
+    def test_interval_adapts(self):
+        self.poller.poll()
+        self.now = 15
+        self.poller.poll()
+        self.assertEqual(self.poller.intervals["t1"], 15)
+        self.conn.summary["t1"] = revision("t1", "2", "1", "1")
+        self.now = 30
+        self.poller.poll()
+        self.assertEqual(self.poller.intervals["t1"], 10)
+        self.assertEqual(self.poller.get_due(), [])
+
+    def test_failed_fetch_is_retried(self):
+        self.conn.fail = True
+        self.poller.poll()
+        self.assertEqual(self.seen, [])
+        self.conn.fail = False
+        self.now = 100
+        self.assertIn("t1", self.poller.poll())
+
+    def test_parse_revision(self):
+        parsed = parse_revision("t1:Home:true:a:b:c:d")
+        self.assertEqual(parsed["connected"], "true")
+        self.assertEqual(parsed["runtime"], "c")
+
+
+class StubConnection:
+    """Answers summary and get requests from a dict of revisions."""
+
+    def __init__(self, summary):
+        self.summary = summary
+        self.cache = None
+        self.gets = []
+        self.fail = False
+
+    def send_summary_many(self, identifiers):
+        return {i: self.summary[i] for i in identifiers}
+
+    def send_get_many(self, body, identifiers):
+        self.gets.append((body, identifiers))
+        if self.fail:
+            raise ValueError("fetch failed")
+        return {i: {"identifier": i} for i in identifiers}
+
+
+def revision(identifier, thermostat, alerts, runtime):
+    return ":".join([identifier, "Home", "true", thermostat, alerts,
+                     runtime, runtime])
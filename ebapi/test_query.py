@@ -0,0 +1,54 @@
+import json
+
+from ebapi.program import Program
+from ebapi.test_api_connection import (InterfaceTestCase, status_resp,
+                                       stub_id)
+
+
+class TestSelectionQuery(InterfaceTestCase):
+
+    def test_parts_share_one_request(self):
+        self.transport.queue(full_resp(stub_id))
+        parts = (self.interface.query(stub_id).program().settings()
+                 .vacations().temp().execute())
+        self.assertEqual(len(self.transport.calls), 1)
+        body = json.loads(self.transport.calls[0][2]["params"]["body"])
+        self.assertEqual(body["selection"],
+                         {"selectionType": "thermostats",
+                          "selectionMatch": stub_id,
+                          "includeProgram": True,
+                          "includeSettings": True,
+                          "includeEvents": True,
+                          "includeRuntime": True,
+                          "includeSensors": True})
+        self.assertIsInstance(parts["program"], Program)
+        self.assertEqual(parts["settings"], {"disablePreCooling": False})
+        self.assertEqual(parts["vacations"], [])
+        self.assertEqual(parts["temp"], {"time": "2020-01-01 00:00:00",
+                                         "temp": 700})
+
+    def test_query_many(self):
+        self.transport.queue(full_resp(stub_id))
+        parts = self.interface.query([stub_id]).precool().execute()
+        self.assertEqual(parts, {stub_id: {"precool": {"disablePreCooling": False}}})
+
+    def test_unknown_part(self):
+        with self.assertRaises(ValueError):
+            self.interface.query(stub_id).add("weather")
+
+
+def full_resp(identifier):
+    resp = status_resp(0)
+    resp["thermostatList"] = [{
+        "identifier": identifier,
+        "program": {"schedule": [["home"] * 48] * 7,
+                    "climates": [{"name": "Home", "climateRef": "home",
+                                  "coolTemp": 750, "heatTemp": 680,
+                                  "sensors": []}]},
+        "settings": {"disablePreCooling": False},
+        "events": [],
+        "runtime": {"lastStatusModified": "2020-01-01 00:00:00"},
+        "remoteSensors": [{"type": "thermostat",
+                           "capability": [{"type": "temperature",
+                                           "value": 700}]}]}]
+    return resp
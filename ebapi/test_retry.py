@@ -0,0 +1,139 @@
+import asyncio
+import unittest
+
+from ebapi.api_connection import ApiError, ExpiredTokenError
+from ebapi.retry import (RetryPolicy, RetryBudget, TokenBucket, RateLimiter,
+                         AdaptiveConcurrency, AsyncAdaptiveConcurrency)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Failing:
+    """Raises errors in turn, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def throttled():
+    return ApiError("throttled", http_status=429)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.reasons = []
+
+    def make_policy(self, **kwargs):
+        kwargs.setdefault("random", lambda: 1)
+        return RetryPolicy(sleep=self.sleeps.append, **kwargs)
+
+    def test_retries_with_exponential_backoff(self):
+        policy = self.make_policy(base_delay=1, max_delay=3)
+        send = Failing(throttled(), throttled(), throttled())
+        self.assertEqual(policy.call(send, "get", on_retry=self.reasons.append), "ok")
+        self.assertEqual(send.calls, 4)
+        self.assertEqual(self.sleeps, [1, 2, 3])
+        self.assertEqual(self.reasons, ["throttled"] * 3)
+
+    def test_honors_retry_after(self):
+        policy = self.make_policy()
+        policy.call(Failing(ApiError("busy", http_status=503, retry_after=2)), "get")
+        self.assertEqual(self.sleeps, [2])
+
+    def test_gives_up_after_max_attempts(self):
+        policy = self.make_policy(max_attempts=2)
+        send = Failing(throttled(), throttled(), throttled())
+        with self.assertRaises(ApiError):
+            policy.call(send, "get")
+        self.assertEqual(send.calls, 2)
+
+    def test_classify(self):
+        policy = self.make_policy()
+        self.assertEqual(policy.classify(throttled(), "post"), "throttled")
+        self.assertEqual(policy.classify(ApiError("", code=3), "get"), "api_code")
+        self.assertIsNone(policy.classify(ApiError("", code=3), "post"))
+        self.assertIsNone(policy.classify(ApiError("", code=8), "get"))
+        self.assertIsNone(policy.classify(ExpiredTokenError("", code=14), "get"))
+        self.assertEqual(policy.classify(ApiError("", http_status=502), "get"),
+                         "http_status")
+        self.assertEqual(policy.classify(ConnectionError(), "get"), "connection")
+        self.assertIsNone(policy.classify(ConnectionError(), "post"))
+        self.assertIsNone(policy.classify(ValueError(), "get"))
+        retry_posts = self.make_policy(retry_posts=True)
+        self.assertEqual(retry_posts.classify(ConnectionError(), "post"),
+                         "connection")
+
+    def test_budget_limits_retries(self):
+        policy = self.make_policy(budget=RetryBudget(ratio=0, min_retries=1))
+        policy.call(Failing(throttled()), "get")
+        with self.assertRaises(ApiError):
+            policy.call(Failing(throttled()), "get")
+
+    def test_throttling_lowers_concurrency(self):
+        concurrency = AdaptiveConcurrency(initial=8)
+        policy = self.make_policy(concurrency=concurrency)
+        policy.call(Failing(throttled()), "get")
+        self.assertLess(concurrency.limit, 5)
+        self.assertEqual(concurrency.in_flight, 0)
+
+    def test_limiter_paces_attempts(self):
+        limiter = RateLimiter(app_rate=1, app_burst=1, clock=FakeClock())
+        policy = self.make_policy(limiter=limiter)
+        policy.call(Failing(), "get")
+        policy.call(Failing(), "get")
+        self.assertEqual(self.sleeps, [0, 1])
+
+    def test_call_async(self):
+        async def send():
+            return sync_send()
+        sync_send = Failing(throttled())
+        policy = self.make_policy(base_delay=0,
+                                  concurrency=AsyncAdaptiveConcurrency())
+        self.assertEqual(asyncio.run(policy.call_async(send, "get")), "ok")
+        self.assertEqual(sync_send.calls, 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=2, clock=clock)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0.5])
+        clock.now = 1.5
+        self.assertEqual(bucket.reserve(), 0)
+
+    def test_users_have_separate_buckets(self):
+        limiter = RateLimiter(user_rate=1, user_burst=1, clock=FakeClock())
+        self.assertEqual(limiter.reserve("1"), 0)
+        self.assertEqual(limiter.reserve("2"), 0)
+        self.assertEqual(limiter.reserve("1"), 1)
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+
+    def test_aimd(self):
+        concurrency = AdaptiveConcurrency(initial=4, min_limit=1, max_limit=5)
+        concurrency.decrease()
+        self.assertEqual(concurrency.limit, 2)
+        for _ in range(20):
+            concurrency.increase()
+        self.assertEqual(concurrency.limit, 5)
+        for _ in range(5):
+            concurrency.decrease()
+        self.assertEqual(concurrency.limit, 1)
@@ -0,0 +1,46 @@
+import json
+import datetime as dt
+
+from ebapi.runtime_report import get_date_ranges
+from ebapi.test_api_connection import (InterfaceTestCase, status_resp,
+                                       stub_id)
+
+
+class TestRuntimeReport(InterfaceTestCase):
+
+    def test_date_ranges(self):
+        ranges = list(get_date_ranges(dt.date(2020, 1, 1),
+                                      dt.date(2020, 3, 5), 40))
+        self.assertEqual(ranges[0], (dt.date(2020, 1, 1), dt.date(2020, 1, 31)))
+        self.assertEqual(ranges[-1], (dt.date(2020, 3, 3), dt.date(2020, 3, 5)))
+        self.assertEqual(len(ranges), 3)
+
+    def test_report_is_chunked_and_typed(self):
+        self.transport.queue(report_resp(stub_id, "2020-01-01"),
+                             report_resp(stub_id, "2020-01-08"))
+        blocks = list(self.interface.get_runtime_report(
+            stub_id, "2020-01-01", "2020-01-10",
+            columns=["zoneAveTemp", "zoneClimate"]))
+
+        self.assertEqual(len(self.transport.calls), 2)
+        body = json.loads(self.transport.calls[1][2]["params"]["body"])
+        self.assertEqual(body["startDate"], "2020-01-08")
+        self.assertEqual(body["endDate"], "2020-01-10")
+        self.assertEqual(body["columns"], "zoneAveTemp,zoneClimate")
+        self.assertTrue(self.transport.calls[1][1].endswith("/1/runtimeReport"))
+
+        identifier, frame = blocks[0]
+        self.assertEqual(identifier, stub_id)
+        self.assertEqual(str(frame["zoneAveTemp"].dtype), "float64")
+        self.assertEqual(str(frame["zoneClimate"].dtype), "string")
+        self.assertEqual(frame.index[1], dt.datetime(2020, 1, 1, 0, 5))
+        self.assertTrue(frame["zoneAveTemp"].isna().iloc[1])
+
+
+def report_resp(identifier, date):
+    resp = status_resp(0)
+    resp["reportList"] = [{"thermostatIdentifier": identifier,
+                           "rowCount": 2,
+                           "rowList": [date + ",00:00:00,70.5,Home",
+                                       date + ",00:05:00,,Home"]}]
+    return resp
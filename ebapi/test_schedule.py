@@ -0,0 +1,62 @@
+import unittest
+import datetime as dt
+
+from ebapi.schedule import Schedule, collapse
+
+week = [["sleep"] * 12 + ["home"] * 4 + ["away"] * 20 + ["home"] * 10 + ["sleep"] * 2
+        for _ in range(5)] + [["sleep"] * 16 + ["home"] * 32 for _ in range(2)]
+
+
+class TestSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = Schedule([list(day) for day in week])
+
+    def test_round_trip(self):
+        self.assertEqual(self.schedule.to_json(), week)
+        self.assertEqual(self.schedule.codes.shape, (7, 48))
+        self.assertEqual(self.schedule.names, ["sleep", "home", "away"])
+
+    def test_replace_weekdays(self):
+        self.schedule.replace_weekdays(dt.time(9), dt.time(10, 30), "smart1")
+        json = self.schedule.to_json()
+        for day in json[:5]:
+            self.assertEqual(day[17:23], ["away", "smart1", "smart1",
+                                          "smart1", "smart1", "away"])
+        self.assertEqual(json[5:], week[5:])
+
+    def test_update_schedule_rejects_reversed_range(self):
+        with self.assertRaises(ValueError):
+            self.schedule.update_schedule([0], dt.time(10), dt.time(9), "home")
+
+    def test_day_modify_schedule(self):
+        day = self.schedule.days[6]
+        day.modify_schedule(dt.time(0), dt.time(23, 30), "away")
+        self.assertEqual(day.schedule, ["away"] * 48)
+        self.assertEqual(self.schedule.collapse(6), [(0, 47, "away")])
+
+    def test_day_schedule_writes_back(self):
+        self.schedule.days[0].schedule[0] = "away"
+        self.schedule.days[1].schedule[46:] = ["home", "home"]
+        json = self.schedule.to_json()
+        self.assertEqual(json[0][:2], ["away", "sleep"])
+        self.assertEqual(json[1][44:], ["home"] * 4)
+        self.assertEqual(self.schedule.days[1].schedule[-1], "home")
+
+    def test_days_need_48_slots(self):
+        with self.assertRaises(ValueError):
+            Schedule([["home"] * 47])
+
+    def test_collapse(self):
+        self.assertEqual(self.schedule.collapse(0),
+                         [(0, 11, "sleep"), (12, 15, "home"), (16, 35, "away"),
+                          (36, 45, "home"), (46, 47, "sleep")])
+        self.assertEqual(collapse(week[5]), [(0, 15, "sleep"), (16, 47, "home")])
+
+    def test_collapse_short_lists(self):
+        self.assertEqual(collapse(["home"]), [(0, 0, "home")])
+        self.assertEqual(collapse([]), [])
+
+    def test_str(self):
+        self.assertIn("Saturday\n\tsleep from 00:00:00 to 07:30:00\n",
+                      str(self.schedule))
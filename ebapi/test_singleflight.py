@@ -0,0 +1,191 @@
+import shutil
+import asyncio
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from ebapi.api_interface import ApiInterface
+from ebapi.singleflight import SingleFlight, AsyncSingleFlight
+from ebapi.stub_server import StubServer
+from ebapi.api_connection import ApiConnection
+from ebapi.test_api_connection import (StubTransport, load_evs, clear_env_vars,
+                                       thermostat_resp, stub_id, stub_user_id,
+                                       stub_acc, stub_ref)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait(5)
+            return {"temp": 700}
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(flight.do, "key", func) for _ in range(4)]
+            while flight.saved < 3:
+                threading.Event().wait(0.001)
+            release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(results, [{"temp": 700}] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((flight.calls, flight.saved), (1, 3))
+        self.assertEqual(flight.in_flight, {})
+
+    def test_exceptions_are_shared(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do("key", self.fail_call)
+        self.assertEqual(flight.in_flight, {})
+
+    def test_followers_copy_a_snapshot(self):
+        flight = SingleFlight()
+        edited = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=1)
+
+        def func():
+            follower.append(pool.submit(flight.do, "key", func))
+            while flight.saved < 1:
+                threading.Event().wait(0.001)
+            return Reading(700, edited)
+
+        follower = []
+        mine = flight.do("key", func)
+        mine.temp = 0
+        edited.set()
+        self.assertEqual(follower[0].result(5).temp, 700)
+        pool.shutdown()
+
+    def fail_call(self):
+        raise ValueError("failed")
+
+    def test_async(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"temp": 700}
+
+        async def run():
+            return await asyncio.gather(*[flight.do("key", func) for _ in range(5)])
+
+        self.assertEqual(asyncio.run(run()), [{"temp": 700}] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.saved, 4)
+
+    def test_async_leader_cancelled(self):
+        flight = AsyncSingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.05)
+            return {"temp": 700}
+
+        async def run():
+            leader = asyncio.ensure_future(flight.do("key", func))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do("key", func))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await follower
+
+        self.assertEqual(asyncio.run(run()), {"temp": 700})
+        self.assertEqual((flight.calls, flight.saved), (1, 1))
+        self.assertEqual(flight.in_flight, {})
+
+
+class TestSingleFlightWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        load_evs(self.tmp_dir)
+        self.transport = GatedTransport()
+        self.flight = SingleFlight()
+        self.conn = ApiConnection(transport=self.transport,
+                                  singleflight=self.flight)
+        self.conn.tokens.insert(stub_user_id, stub_id, stub_acc, stub_ref)
+
+    def tearDown(self):
+        clear_env_vars()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_after_post_does_not_join_earlier_get(self):
+        self.transport.queue(*[thermostat_resp(stub_id) for _ in range(3)])
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            before = pool.submit(self.conn.send_get, {}, stub_id)
+            self.assertTrue(self.transport.started.wait(5))
+            self.conn.send_post({"functions": []}, stub_id)
+            after = pool.submit(self.conn.send_get, {}, stub_id)
+            while self.flight.calls + self.flight.saved < 2:
+                threading.Event().wait(0.001)
+            self.transport.release.set()
+            before.result(5)
+            after.result(5)
+        self.assertEqual((self.flight.calls, self.flight.saved), (2, 0))
+
+
+class TestSingleFlightConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        load_evs(self.tmp_dir)
+        self.server = StubServer(n_thermostats=3, latency=0.1).start()
+        self.flight = SingleFlight()
+        self.interface = ApiInterface(url_base=self.server.url_base,
+                                      singleflight=self.flight)
+        self.server.api.register(self.interface.conn.tokens)
+        self.identifier = self.server.api.get_identifiers()[0]
+
+    def tearDown(self):
+        self.interface.conn.close()
+        self.server.stop()
+        clear_env_vars()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_identical_gets_share_a_request(self):
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            futures = [pool.submit(self.interface.get_settings, self.identifier)
+                       for _ in range(6)]
+            settings = [future.result() for future in futures]
+        self.assertEqual(len({str(s) for s in settings}), 1)
+        self.assertEqual(self.server.api.requests["thermostat"],
+                         self.flight.calls)
+        self.assertEqual(self.flight.calls + self.flight.saved, 6)
+        self.assertGreater(self.flight.saved, 0)
+
+
+class GatedTransport(StubTransport):
+    """Holds every get until release is set."""
+
+    def __init__(self):
+        StubTransport.__init__(self)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def request(self, method, url, **kwargs):
+        if method == "GET":
+            self.started.set()
+            self.release.wait(5)
+        return StubTransport.request(self, method, url, **kwargs)
+
+
+class Reading:
+    """A result whose copies made off the main thread wait for edited,
+    so a follower copying the leader's own result sees its edit."""
+
+    def __init__(self, temp, edited):
+        self.temp = temp
+        self.edited = edited
+
+    def __deepcopy__(self, memo):
+        if threading.current_thread() is not threading.main_thread():
+            self.edited.wait(5)
+        return Reading(self.temp, self.edited)
@@ -0,0 +1,102 @@
+import shutil
+import tempfile
+import unittest
+
+from ebapi.api_connection import ApiError
+from ebapi.api_interface import ApiInterface
+from ebapi.stub_server import StubServer
+from ebapi.test_api_connection import load_evs, clear_env_vars
+
+
+class TestStubServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        load_evs(self.tmp_dir)
+        self.server = StubServer(n_thermostats=30, n_users=2, seed=1).start()
+        self.interface = ApiInterface(url_base=self.server.url_base)
+        self.server.api.register(self.interface.conn.tokens)
+        self.identifiers = self.server.api.get_identifiers()
+
+    def tearDown(self):
+        self.interface.conn.close()
+        self.server.stop()
+        clear_env_vars()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_and_write(self):
+        identifier = self.identifiers[0]
+        self.interface.update_disable_precool_setting(identifier, True)
+        self.assertEqual(self.interface.get_precool_settings(identifier),
+                         {"disablePreCooling": True})
+        self.assertEqual(self.interface.get_temp(identifier)["temp"], "700")
+
+    def test_many_reads_are_batched_by_user(self):
+        temps = self.interface.get_temp_many(self.identifiers)
+        self.assertEqual(sorted(temps), self.identifiers)
+        self.assertEqual(self.server.api.requests["thermostat"], 2)
+
+    def test_expired_tokens_are_refreshed(self):
+        self.server.api.expire_tokens()
+        self.interface.get_settings(self.identifiers[0])
+        self.assertEqual(self.server.api.requests["token"], 1)
+
+    def test_injected_errors(self):
+        self.server.api.error_rate = 1
+        with self.assertRaisesRegex(ApiError, "Code: 3"):
+            self.interface.get_settings(self.identifiers[0])
+
+    def test_throttled_reads_are_retried(self):
+        from ebapi.retry import RetryPolicy
+        self.interface.conn.retry = RetryPolicy(base_delay=0.01)
+        self.server.api.throttle_rate = 0.5
+        temps = self.interface.get_temp_many(self.identifiers)
+        self.assertEqual(sorted(temps), self.identifiers)
+
+    def test_throttled_without_retry(self):
+        self.server.api.throttle_rate = 1
+        with self.assertRaisesRegex(ApiError, "HTTP Status: 429"):
+            self.interface.get_settings(self.identifiers[0])
+
+    def test_send_functions_reports_failed_functions(self):
+        from ebapi.api_connection import FunctionBatchError
+        identifier = self.identifiers[0]
+        functions = [{"type": "createVacation", "params": {"name": str(i)}}
+                     for i in range(25)]
+        functions[13] = {"type": "unknownFunction"}
+        with self.assertRaises(FunctionBatchError) as ctx:
+            self.interface.conn.send_functions(functions, identifier)
+        self.assertEqual(list(ctx.exception.errors), [identifier])
+        self.assertEqual(list(ctx.exception.errors[identifier]), [13])
+        self.assertEqual(ctx.exception.errors[identifier][13].code, 8)
+        events = self.server.api.thermostats[identifier]["events"]
+        self.assertEqual(len(events), 24)
+
+    def test_processing_errors_are_not_resent(self):
+        from ebapi.api_connection import FunctionBatchError
+        self.server.api.error_rate = 1
+        functions = [{"type": "createVacation", "params": {"name": str(i)}}
+                     for i in range(25)]
+        with self.assertRaises(FunctionBatchError) as ctx:
+            self.interface.conn.send_functions(functions, self.identifiers[0])
+        self.assertEqual(len(ctx.exception.errors[self.identifiers[0]]), 25)
+        self.assertEqual(self.server.api.requests["thermostat"], 3)
+
+    def test_send_functions_many(self):
+        functions = [{"type": "createVacation", "params": {"name": "away"}}]
+        self.interface.conn.send_functions_many(functions, self.identifiers)
+        self.assertEqual(self.server.api.requests["thermostat"], 2)
+        for tstat in self.server.api.thermostats.values():
+            self.assertEqual(tstat["events"][-1]["name"], "away")
+
+    def test_update_settings_many(self):
+        self.server.api.rejected.add(self.identifiers[4])
+        results = self.interface.update_disable_precool_setting_many(
+            self.identifiers, True)
+        self.assertEqual(sorted(results), self.identifiers)
+        failed = [i for i, result in results.items() if not result.succeeded()]
+        self.assertEqual(failed, [self.identifiers[4]])
+        self.assertEqual(results[self.identifiers[4]].error.code, 7)
+        for identifier in self.identifiers[:4]:
+            self.assertTrue(self.server.api.thermostats[identifier]
+                            ["settings"]["disablePreCooling"])
@@ -1,8 +1,9 @@
-from tokens import FileTokens
+from tokens import FileTokens, SqliteTokens, get_backend, refresh_token
 import pandas as pd
 import unittest
 from mock import MagicMock, patch
 import os
+import threading
 
 stub_id = "123456789012"
 stub_acc = "a"
@@ -11,6 +12,7 @@ stub_user_id = "abcdefg"
 
 user_test_csv = "ebapi_user.csv"
 tstat_test_csv = "ebapi_tstat.cvs"
+sqlite_test_db = "ebapi_tokens.db"
 
 
 class TestFileTokens(unittest.TestCase):
@@ -104,7 +106,38 @@ class TestFileTokens(unittest.TestCase):
                   
     def test_refresh(self):
         ft = populated_setup()
-        ft.refresh()
+        failures = ft.refresh(stub_refresh_token)
+        self.assertEqual(failures, {})
+        self.assertEqual(ft.user.loc[stub_user_id, "access_token"], "new_a")
+        self.assertEqual(ft.user.loc[stub_user_id, "refresh_token"], "new_b")
+
+    def test_refresh_saves_once(self):
+        ft = populated_setup()
+        ft.insert_user("other", stub_acc, "bad")
+        with patch.object(ft, "save_user_file") as save:
+            failures = ft.refresh(stub_refresh_token)
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(list(failures), ["other"])
+        self.assertEqual(ft.user.loc["other", "refresh_token"], "bad")
+
+    def test_refresh_saved(self):
+        ft = populated_setup()
+        ft.refresh(stub_refresh_token)
+        ft_reopened = FileTokens()
+        self.assertEqual(ft_reopened.get_access_token(stub_id), "new_a")
+
+    @patch("requests.post")
+    def test_refresh_token_request(self, post):
+        os.environ["ECOBEE_APPLICATION_KEY"] = "app_key"
+        try:
+            post.return_value.json.return_value = {"access_token": "new_a",
+                                                   "refresh_token": "new_b"}
+            self.assertEqual(refresh_token(stub_ref), ("new_a", "new_b", None))
+        finally:
+            del os.environ["ECOBEE_APPLICATION_KEY"]
+        kwargs = post.call_args[1]
+        self.assertEqual(kwargs["params"]["client_id"], "app_key")
+        self.assertEqual(kwargs["timeout"], (3.05, 30))
 
     def has_test_row(self, ft):
         self.assertEqual(ft.user.loc[stub_user_id, "access_token"], stub_acc)
@@ -117,6 +150,28 @@ class TestFileTokens(unittest.TestCase):
         acc = ft.get_access_token(stub_id)
         self.assertEqual(acc, stub_acc)
 
+    def test_load_file_without_expiry(self):
+        load_evs()
+        gen_populated_user().drop(columns="expires_at").to_csv(user_test_csv)
+        gen_populated_tstat().to_csv(tstat_test_csv)
+        ft = FileTokens()
+        self.assertEqual(ft.get_token_info(stub_id), (stub_user_id, stub_acc, None))
+
+    def test_refresh_user_records_expiry(self):
+        ft = populated_setup()
+        ft.refresh_user(stub_user_id, lambda ref: ("new_a", "new_b", 100.0))
+        ft_reopened = FileTokens()
+        self.assertEqual(ft_reopened.get_token_info(stub_id),
+                         (stub_user_id, "new_a", 100.0))
+
+    def test_access_token_index_follows_updates(self):
+        ft = populated_setup()
+        ft.update_tokens({stub_user_id: ("new_a", "new_b")})
+        self.assertEqual(ft.get_access_token(stub_id), "new_a")
+        ft.delete(stub_id)
+        with self.assertRaises(KeyError):
+            ft.get_access_token(stub_id)
+
     def test_get_access_token_dne(self):
         load_evs()
         ft = FileTokens()
@@ -124,6 +179,23 @@ class TestFileTokens(unittest.TestCase):
         with self.assertRaisesRegex(KeyError, err_msg):
             ft.get_access_token(stub_id)
 
+    def test_concurrent_changes_are_kept(self):
+        ft = populated_setup()
+        user_ids = [str(i) for i in range(20)]
+        threads = [threading.Thread(target=ft.insert_user,
+                                    args=(user_id, stub_acc, stub_ref))
+                   for user_id in user_ids]
+        threads += [threading.Thread(target=ft.refresh_user,
+                                     args=(stub_user_id, stub_refresh_token))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ft_reopened = FileTokens()
+        self.assertEqual(set(user_ids) | {stub_user_id},
+                         set(ft_reopened.user.index))
+        self.assertEqual(ft_reopened.get_access_token(stub_id), "new_a")
+
     def dfs_empty(self, ft):
         empty_user = gen_empty_user_df()
         empty_tstat = gen_empty_tstat_df()
@@ -131,6 +203,67 @@ class TestFileTokens(unittest.TestCase):
         self.assertTrue(ft.tstat.equals(empty_tstat))
     
         
+class TestSqliteTokens(unittest.TestCase):
+
+    def setUp(self):
+        self.tokens = SqliteTokens(sqlite_test_db)
+        self.tokens.insert(stub_user_id, stub_id, stub_acc, stub_ref)
+
+    def tearDown(self):
+        self.tokens.close()
+        clear_env_vars()
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(sqlite_test_db + suffix):
+                os.remove(sqlite_test_db + suffix)
+
+    def test_no_env_var_init(self):
+        err_msg = SqliteTokens.missing_env_var.format(SqliteTokens.db_ev)
+        with self.assertRaisesRegex(EnvironmentError, err_msg):
+            SqliteTokens()
+
+    def test_get_access_token(self):
+        self.assertEqual(self.tokens.get_access_token(stub_id), stub_acc)
+        self.assertEqual(self.tokens.get_user_id(stub_id), stub_user_id)
+
+    def test_get_access_token_dne(self):
+        err_msg = self.tokens.unknown_tstat.format("100000000000")
+        with self.assertRaisesRegex(KeyError, err_msg):
+            self.tokens.get_access_token("100000000000")
+
+    def test_insert_overrite_user(self):
+        with self.assertRaisesRegex(RuntimeError, "Attempt to overwrite user.*"):
+            self.tokens.insert_user(stub_user_id, stub_acc, stub_ref)
+
+    def test_insert_duplicate_tstat(self):
+        with self.assertRaises(ResourceWarning):
+            self.tokens.insert_tstat(stub_user_id, stub_id)
+
+    def test_delete_last_tstat_drops_user(self):
+        self.tokens.delete(stub_id)
+        self.assertFalse(self.tokens.has_tstat(stub_id))
+        self.assertFalse(self.tokens.has_user(stub_user_id))
+
+    def test_refresh_saved(self):
+        failures = self.tokens.refresh(stub_refresh_token)
+        reopened = SqliteTokens(sqlite_test_db)
+        self.assertEqual(failures, {})
+        self.assertEqual(reopened.get_access_token(stub_id), "new_a")
+        reopened.close()
+
+    def test_get_backend(self):
+        os.environ["EBAPI_TOKENS_BACKEND"] = "sqlite"
+        self.assertIs(get_backend(), SqliteTokens)
+        self.assertIs(get_backend("file"), FileTokens)
+        with self.assertRaisesRegex(ValueError, "Unknown token backend"):
+            get_backend("mysql")
+
+
+def stub_refresh_token(ref):
+    if ref == "bad":
+        raise RuntimeError("Error parsing Json")
+    return "new_a", "new_" + ref
+
+
 def delete_test_csvs():
     for fname in [user_test_csv, tstat_test_csv]:
         if os.path.exists(fname):
@@ -150,7 +283,7 @@ def save_populated_test_files():
 
 def gen_populated_user():
     df_user = gen_empty_user_df()
-    df_user.loc[stub_user_id] = [stub_acc, stub_ref]
+    df_user.loc[stub_user_id] = [stub_acc, stub_ref, None]
     return df_user
 
 
@@ -178,7 +311,8 @@ def csvs_exist():
 
 
 def clear_env_vars():
-    for ev in [FileTokens.user_ev, FileTokens.tstat_ev]:
+    for ev in [FileTokens.user_ev, FileTokens.tstat_ev,
+               SqliteTokens.db_ev, "EBAPI_TOKENS_BACKEND"]:
         try:
             del os.environ[ev]
         except KeyError:
@@ -0,0 +1,45 @@
+from ebapi.tracing import RecordingTracer, NullTracer
+from ebapi.test_api_connection import (InterfaceTestCase, status_resp,
+                                       stub_id)
+from ebapi.test_query import full_resp
+
+
+class TestRecordingTracer(InterfaceTestCase):
+
+    def get_interface_kwargs(self):
+        self.tracer = RecordingTracer()
+        return {"tracer": self.tracer}
+
+    def test_phases_nest_under_call(self):
+        self.transport.queue(full_resp(stub_id))
+        with self.tracer.span("get_program"):
+            self.interface.get_program(stub_id)
+        root = self.tracer.get_spans("get_program")[0]
+        request = self.tracer.get_spans("send_get")[0]
+        self.assertEqual(request.parent_id, root.span_id)
+        self.assertEqual(request.attributes["identifier"], stub_id)
+        for name in ["headers", "selection", "encode", "network", "decode"]:
+            span = self.tracer.get_spans(name)[0]
+            self.assertEqual(span.parent_id, request.span_id)
+            self.assertEqual(span.trace_id, root.trace_id)
+        construct = self.tracer.get_spans("construct")[0]
+        self.assertEqual(construct.parent_id, root.span_id)
+        self.assertEqual(set(self.tracer.breakdown()),
+                         {"get_program", "send_get", "headers", "selection",
+                          "encode", "network", "decode", "construct"})
+
+    def test_error_status_exported(self):
+        self.transport.queue(status_resp(3, "processing error"))
+        with self.assertRaises(Exception):
+            self.interface.get_settings(stub_id)
+        exported = {span["name"]: span for span in self.tracer.to_json()}
+        self.assertEqual(exported["send_get"]["status"]["code"],
+                         "STATUS_CODE_ERROR")
+        self.assertEqual(exported["network"]["kind"], "SPAN_KIND_CLIENT")
+        self.assertEqual(exported["send_get"]["attributes"],
+                         [{"key": "identifier",
+                           "value": {"stringValue": stub_id}}])
+
+    def test_null_tracer(self):
+        with NullTracer().span("send_get", identifier=stub_id) as span:
+            span.set_attribute("key", "value")
@@ -0,0 +1,122 @@
+import time
+import threading
+import unittest
+
+from ebapi.api_connection import ApiError
+from ebapi.program import Program
+from ebapi.write_buffer import WriteBuffer
+
+
+class TestWriteBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = StubConnection()
+        self.buffer = WriteBuffer(self.conn, window=60)
+
+    def tearDown(self):
+        self.buffer.close()
+
+    def test_merges_updates(self):
+        first = self.buffer.update_settings({"hvacMode": "heat", "fanMinOnTime": 5}, "1")
+        second = self.buffer.update_disable_precool_setting("1", True)
+        third = self.buffer.update_settings({"hvacMode": "cool"}, "1")
+        self.buffer.update_settings({"hvacMode": "off"}, "2")
+        self.buffer.flush()
+        self.assertEqual(len(self.conn.posts), 2)
+        self.assertEqual(self.conn.posts[0],
+                         ("1", {"thermostat": {"settings": {
+                             "hvacMode": "cool", "fanMinOnTime": 5,
+                             "disablePreCooling": True}}}))
+        for future in (first, second, third):
+            self.assertEqual(future.result(0), {"status": {"code": 0}})
+
+    def test_settings_and_program_share_a_post(self):
+        self.buffer.update_program(Program(StubSchedule(), []), "1")
+        self.buffer.update_settings({"hvacMode": "heat"}, "1")
+        self.buffer.flush()
+        body = self.conn.posts[0][1]["thermostat"]
+        self.assertEqual(sorted(body), ["program", "settings"])
+
+    def test_failed_write_fails_every_future(self):
+        self.conn.failing.add("1")
+        futures = [self.buffer.update_settings({"hvacMode": "heat"}, "1"),
+                   self.buffer.update_settings({"fanMinOnTime": 5}, "1")]
+        self.buffer.flush()
+        for future in futures:
+            self.assertIsInstance(future.exception(0), ApiError)
+
+    def test_window_flushes_in_background(self):
+        buffer = WriteBuffer(self.conn, window=0.01)
+        future = buffer.update_settings({"hvacMode": "heat"}, "1")
+        self.assertEqual(future.result(5), {"status": {"code": 0}})
+        buffer.close()
+        self.assertEqual(len(self.conn.posts), 1)
+
+    def test_cancelled_write_does_not_stop_later_writes(self):
+        buffer = WriteBuffer(self.conn, window=0.01)
+        cancelled = buffer.update_settings({"hvacMode": "heat"}, "1")
+        self.assertTrue(cancelled.cancel())
+        future = buffer.update_settings({"hvacMode": "cool"}, "2")
+        self.assertEqual(future.result(5), {"status": {"code": 0}})
+        later = buffer.update_settings({"hvacMode": "off"}, "1")
+        self.assertEqual(later.result(5), {"status": {"code": 0}})
+        buffer.close()
+        self.assertEqual(sorted(identifier for identifier, _ in self.conn.posts),
+                         ["1", "2"])
+
+    def test_cancelled_update_is_not_posted(self):
+        cancelled = self.buffer.update_settings({"hvacMode": "heat"}, "1")
+        self.assertTrue(cancelled.cancel())
+        self.buffer.update_settings({"fanMinOnTime": 5}, "1")
+        self.buffer.flush()
+        self.assertEqual(self.conn.posts,
+                         [("1", {"thermostat": {"settings": {"fanMinOnTime": 5}}})])
+
+    def test_writes_to_a_tstat_are_posted_in_order(self):
+        self.conn.delays.append(0.2)
+        buffer = WriteBuffer(self.conn, window=0.01)
+        first = buffer.update_settings({"hvacMode": "heat"}, "1")
+        self.assertTrue(self.conn.started.wait(5))
+        second = buffer.update_settings({"hvacMode": "cool"}, "1")
+        buffer.flush()
+        self.assertTrue(first.done())
+        self.assertTrue(second.done())
+        self.assertEqual([body["thermostat"]["settings"]["hvacMode"]
+                          for _, body in self.conn.posts], ["heat", "cool"])
+        buffer.close()
+
+    def test_close_sends_pending_writes(self):
+        future = self.buffer.update_settings({"hvacMode": "heat"}, "1")
+        self.buffer.close()
+        self.assertTrue(future.done())
+        with self.assertRaises(RuntimeError):
+            self.buffer.update_settings({"hvacMode": "heat"}, "1")
+
+
+class StubSchedule:
+
+    def to_json(self):
+        return [["home"] * 48] * 7
+
+
+class StubConnection:
+    """Records posts once applied and fails those to identifiers in
+    failing. Posts take the seconds queued in delays, in order."""
+
+    def __init__(self):
+        self.posts = []
+        self.failing = set()
+        self.delays = []
+        self.started = threading.Event()
+
+    def send_post(self, body, identifier):
+        self.started.set()
+        if self.delays:
+            time.sleep(self.delays.pop(0))
+        self.posts.append((identifier, body))
+        if identifier in self.failing:
+            raise ApiError("Api Request Failed With Code: 3", code=3)
+        return {"status": {"code": 0}}
+
+    def run_jobs(self, func, jobs, max_concurrency):
+        return [func(*job) for job in jobs]
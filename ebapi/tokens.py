@@ -1,10 +1,17 @@
-#from ecobee_ds.core.sql_lib import get_df
-import pandas as pd
 import os
+import math
+import time
+import sqlite3
+import tempfile
+import threading
 import logging
+from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
+token_url = 'https://api.ecobee.com/token'
+default_refresh_workers = 8
+backend_ev = "EBAPI_TOKENS_BACKEND"
 
 
 class TokensMeta(type):
@@ -27,10 +34,14 @@ class FileTokens(metaclass=TokensMeta):
     missing_env_vars = "Enviornment Variables EBAPI_USER_TOKENS_FILE and EBAPI_USER_TSTAT_FILE not Found"
     missing_env_var = "Enviornment Variable {} Not Found"
     unknown_tstat = "Unknown Thermostat ID: {}"
-    user_cols = ["user_id", "access_token", "refresh_token"]
+    user_cols = ["user_id", "access_token", "refresh_token", "expires_at"]
     tstat_cols = ["tstat_id", "user_id"]
 
     def __init__(self, verbose=False):      
+        # Held by every change to self.user and self.tstat and their saves.
+        self.lock = threading.RLock()
+        self.user_version = 0
+        self.saved_user_version = 0
         self.load_env_vars_if_valid()
         self.load_csvs()
 
@@ -75,15 +86,36 @@ class FileTokens(metaclass=TokensMeta):
     
     def load_user_file(self):
         index_name = 'user_id'
-        dtype = {'user_id': str, 'access_token': str, 'refresh_token': str}
+        dtype = {'user_id': str, 'access_token': str, 'refresh_token': str,
+                 'expires_at': float}
+        import pandas as pd
         self.user = pd.read_csv(self.user_file, dtype=dtype)
+        if "expires_at" not in self.user:
+            self.user["expires_at"] = float("nan")
         self.user.set_index(index_name, inplace=True)
+        self.index_users()
 
     def load_tstat_file(self):
         index_name = 'tstat_id'
         dtype = {'tstat_id': str, 'user_id': str}
+        import pandas as pd
         self.tstat = pd.read_csv(self.tstat_file, dtype=dtype)
         self.tstat.set_index(index_name, inplace=True)
+        self.index_tstats()
+
+    def index_users(self):
+        """Build the user_id to access_token and expires_at dicts used on
+        the request path.
+
+        Users with more than one row are recorded as corrupted instead."""
+        self.access_tokens = self.user["access_token"].to_dict()
+        self.expiries = self.user["expires_at"].dropna().to_dict()
+        duplicated = self.user.index[self.user.index.duplicated()]
+        self.corrupted_users = set(duplicated)
+
+    def index_tstats(self):
+        """Build the tstat_id to user_id dict used on the request path."""
+        self.tstat_users = self.tstat["user_id"].to_dict()
     
     def get_missing_files(self):
         missing_files = []
@@ -97,10 +129,13 @@ class FileTokens(metaclass=TokensMeta):
         raise EnvironmentError(err_msg)
                    
     def init_new_files(self):
+        import pandas as pd
         self.user = pd.DataFrame(columns=self.user_cols)
         self.user.set_index("user_id", inplace=True)
         self.tstat = pd.DataFrame(columns=self.tstat_cols)
         self.tstat.set_index("tstat_id", inplace=True)
+        self.index_users()
+        self.index_tstats()
         self.save_files()
 
     def save_files(self):
@@ -108,21 +143,72 @@ class FileTokens(metaclass=TokensMeta):
         self.save_tstat_file()
 
     def save_user_file(self):
-        self.user.to_csv(self.user_file)
+        with self.lock:
+            write_csv_atomic(self.user, self.user_file)
+            self.saved_user_version = self.user_version
     
     def save_tstat_file(self):
-        self.tstat.to_csv(self.tstat_file)
-
-    def refresh(self):
-        for idx, row in self.user.iterrows():
-            ref = row["refresh_token"]
-            try:
-                self.user.loc[idx] = refresh_token(ref)
-            except Exception:
-                pass
-            finally:
+        with self.lock:
+            write_csv_atomic(self.tstat, self.tstat_file)
+
+    def refresh(self, refresh_func=None, max_workers=default_refresh_workers):
+        """Refresh every user's tokens concurrently and save them once.
+
+        refresh_func takes a refresh token and returns new tokens as an
+        (access_token, refresh_token, expires_at) tuple, it defaults to
+        refresh_token. Users whose refresh fails keep their old tokens,
+        they are returned as a dict of user_id to the exception raised."""
+        if refresh_func is None:
+            refresh_func = refresh_token
+        ref_tokens = self.get_refresh_tokens()
+        new_tokens, failures = refresh_all(ref_tokens, refresh_func, max_workers)
+        self.update_tokens(new_tokens)
+        log_failures(failures)
+        return failures
+
+    def get_refresh_tokens(self):
+        return self.user["refresh_token"].to_dict()
+
+    def refresh_user(self, user_id, refresh_func=None):
+        """Refresh and save the tokens of a single user."""
+        if refresh_func is None:
+            refresh_func = refresh_token
+        new_tokens = refresh_func(self.lookup_refresh_token(user_id))
+        self.update_tokens({user_id: new_tokens})
+        return new_tokens
+
+    def lookup_refresh_token(self, user_id):
+        try:
+            return self.user.loc[user_id, "refresh_token"]
+        except KeyError:
+            raise KeyError("No tokens found for user {}".format(user_id))
+
+    def update_tokens(self, new_tokens):
+        """Store new (access_token, refresh_token[, expires_at]) tuples
+        keyed by user_id and save them before returning.
+
+        Only the rows of new_tokens are changed. Updates made while the
+        user file is being written are saved together by the next write,
+        so concurrent single user refreshes share one write."""
+        if not new_tokens:
+            return
+        rows = {user_id: unpack_tokens(t) for user_id, t in new_tokens.items()}
+        with self.lock:
+            for user_id, (acc, ref, expires_at) in rows.items():
+                self.user.loc[user_id] = [acc, ref, nan_if_none(expires_at)]
+                self.access_tokens[user_id] = acc
+                self.set_expiry(user_id, expires_at)
+            self.user_version += 1
+            version = self.user_version
+        with self.lock:
+            if self.saved_user_version < version:
                 self.save_user_file()
-                
+
+    def set_expiry(self, user_id, expires_at):
+        if expires_at is None:
+            self.expiries.pop(user_id, None)
+        else:
+            self.expiries[user_id] = expires_at
 
     def get_next_user_id(self):
         user_id = len(self.user) + 1
@@ -130,15 +216,16 @@ class FileTokens(metaclass=TokensMeta):
         return user_id
 
     def delete(self, tstat_id):
-        if not self.has_tstat(tstat_id):
-            raise KeyError(self.unknown_tstat.format(tstat_id))
-            
-        user_id = self.tstat.loc[tstat_id, "user_id"]
-        self.drop_tstat(tstat_id)
+        with self.lock:
+            if not self.has_tstat(tstat_id):
+                raise KeyError(self.unknown_tstat.format(tstat_id))
 
-        if not user_id in self.tstat.user_id.unique():
-            self.drop_user(user_id)
-        self.save_files()
+            user_id = self.tstat.loc[tstat_id, "user_id"]
+            self.drop_tstat(tstat_id)
+
+            if not user_id in self.tstat.user_id.unique():
+                self.drop_user(user_id)
+            self.save_files()
 
     def has_tstat(self, tstat_id):
         return tstat_id in self.tstat.index
@@ -148,53 +235,76 @@ class FileTokens(metaclass=TokensMeta):
 
     def drop_tstat(self, tstat_id):
         logger.info("Droping Tstat {}".format(tstat_id))
-        self.tstat.drop(tstat_id, inplace=True)
-        self.save_tstat_file()
+        with self.lock:
+            self.tstat.drop(tstat_id, inplace=True)
+            self.tstat_users.pop(tstat_id, None)
+            self.save_tstat_file()
 
     def drop_user(self, user_id):
         logger.info("Droping User {}".format(user_id))
-        self.user.drop(user_id, inplace=True)
-        self.save_user_file()
-
-    def insert(self, user_id, tstat_id, acc, ref):
-        self.insert_user(user_id, acc, ref)
+        with self.lock:
+            self.user.drop(user_id, inplace=True)
+            self.access_tokens.pop(user_id, None)
+            self.expiries.pop(user_id, None)
+            self.corrupted_users.discard(user_id)
+            self.user_version += 1
+            self.save_user_file()
+
+    def insert(self, user_id, tstat_id, acc, ref, expires_at=None):
+        self.insert_user(user_id, acc, ref, expires_at)
         self.insert_tstat(user_id, tstat_id)
 
-    def insert_user(self, user_id, acc, ref):      
-        if user_id in self.user.index:
-            raise RuntimeError("Attempt to overwrite user {}".format(user_id))
-        self.user.loc[user_id] = [acc, ref]
-        self.save_user_file()
+    def insert_user(self, user_id, acc, ref, expires_at=None):
+        with self.lock:
+            if user_id in self.user.index:
+                raise RuntimeError("Attempt to overwrite user {}".format(user_id))
+            self.user = append_row(self.user, user_id,
+                                   [acc, ref, nan_if_none(expires_at)])
+            self.access_tokens[user_id] = acc
+            self.set_expiry(user_id, expires_at)
+            self.user_version += 1
+            self.save_user_file()
 
     def insert_tstat(self, user_id, tstat_id):
-        if tstat_id in self.tstat.index:
-            msg = "ID: {} Already entered for User: {}".format(tstat_id, user_id)
-            raise ResourceWarning(msg)
-
-        self.tstat.loc[tstat_id] = user_id
-        self.save_tstat_file()
+        with self.lock:
+            if tstat_id in self.tstat.index:
+                msg = "ID: {} Already entered for User: {}".format(tstat_id, user_id)
+                raise ResourceWarning(msg)
+
+            self.tstat.loc[tstat_id] = user_id
+            self.tstat_users[tstat_id] = user_id
+            self.save_tstat_file()
         
     def get_access_token(self, tstat_id):
+        user_id = self.get_user_id(tstat_id)
+        return self.lookup_access_token(user_id)
+
+    def get_token_info(self, tstat_id):
+        """Return the (user_id, access_token, expires_at) of tstat_id.
+
+        expires_at is None when the expiry is unknown."""
+        user_id = self.get_user_id(tstat_id)
+        acc = self.lookup_access_token(user_id)
+        return user_id, acc, self.expiries.get(user_id)
+
+    def get_user_id(self, tstat_id):
         try:
-            user_id = self.tstat.loc[tstat_id, "user_id"]
-            return self.lookup_access_token(user_id)       
+            return self.tstat_users[tstat_id]
         except KeyError:
             raise KeyError(self.unknown_tstat.format(tstat_id))
 
     def lookup_access_token(self, user_id):
+        if user_id in self.corrupted_users:
+            raise ValueError("Corrupted State Multiple rows found for User {}".format(user_id))
         try:
-            row_counts = self.user.index.value_counts()
-            row_num = row_counts[user_id]
-            if row_num > 1:
-                raise ValueError("Corrupted State Multiple rows found for User {}".format(user_id))
-            return self.user.loc[user_id, "access_token"]
+            return self.access_tokens[user_id]
         except KeyError:
             msg = "No tokens found for user {}".format(user_id)
             raise KeyError(msg)
 
-
-
-
+    def get_tstats(self):
+        """Return (tstat_id, user_id) pairs for every thermostat."""
+        return list(self.tstat["user_id"].items())
 
     def display_tokens(self):
         print("Users")
@@ -204,41 +314,327 @@ class FileTokens(metaclass=TokensMeta):
         print(self.tstat)
         print()
 
-    def refresh_token(self, ref_token):
-        """Refreshe the tokens for a single thermostat."""
-        logger.info("Original refresh_tokens")
-        return
-        headers = {"Content-Type": "application/json;charset=UTF-8"}
-        url = 'https://api.ecobee.com/token'
-        params = {"grant_type": "refresh_token",
-                  "code": ref_token,
-                  "client_id": api_key}
-        r = requests.post(url, params=params, headers=headers)
-        jsn = r.json()
+
+def refresh_token(ref_token):
+    """Exchange a refresh token for new
+    (access_token, refresh_token, expires_at) tokens."""
+    import requests
+    # Absolute imports, as this module is also imported as tokens.
+    from ebapi.config import get_app_key
+    from ebapi.transport import default_connect_timeout, default_read_timeout
+    headers = {"Content-Type": "application/json;charset=UTF-8"}
+    params = {"grant_type": "refresh_token",
+              "code": ref_token,
+              "client_id": get_app_key()}
+    r = requests.post(token_url, params=params, headers=headers,
+                      timeout=(default_connect_timeout, default_read_timeout))
+    return parse_tokens(r.json())
+
+
+def parse_tokens(jsn):
+    """Return the (access_token, refresh_token, expires_at) of a token
+    endpoint response, expires_at is in seconds since the epoch."""
+    try:
+        tokens = (jsn["access_token"], jsn["refresh_token"])
+    except KeyError:
+        raise RuntimeError("Error parsing Json:\n {}".format(jsn))
+    expires_in = jsn.get("expires_in")
+    if expires_in is None:
+        return tokens + (None,)
+    return tokens + (time.time() + float(expires_in),)
+
+
+def unpack_tokens(tokens):
+    """Return an (access_token, refresh_token, expires_at) tuple from
+    either a token pair or a token triple."""
+    if len(tokens) == 2:
+        return tokens[0], tokens[1], None
+    acc, ref, expires_at = tokens
+    if expires_at is not None and math.isnan(expires_at):
+        expires_at = None
+    return acc, ref, expires_at
+
+
+def append_row(frame, index, values):
+    """Return frame with a row of values added at index.
+
+    Enlarging a frame with loc leaves it read only on pandas 3 when it
+    was empty, which breaks the in place updates of update_tokens."""
+    import pandas as pd
+    row = pd.DataFrame([values], columns=frame.columns,
+                       index=pd.Index([index], name=frame.index.name))
+    return pd.concat([frame, row])
+
+
+def nan_if_none(value):
+    return float("nan") if value is None else value
+
+
+def refresh_all(ref_tokens, refresh_func, max_workers=default_refresh_workers):
+    """Call refresh_func on every refresh token concurrently.
+
+    ref_tokens maps user_id to refresh token. Returns a dict of new
+    token pairs and a dict of exceptions, both keyed by user_id."""
+    from concurrent.futures import ThreadPoolExecutor
+    new_tokens = {}
+    failures = {}
+    if not ref_tokens:
+        return new_tokens, failures
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {user_id: pool.submit(refresh_func, ref)
+                   for user_id, ref in ref_tokens.items()}
+        for user_id, future in futures.items():
+            try:
+                new_tokens[user_id] = future.result()
+            except Exception as err:
+                failures[user_id] = err
+    return new_tokens, failures
+
+
+def log_failures(failures):
+    for user_id, err in failures.items():
+        logger.warning("Token refresh failed for User {}: {}".format(user_id, err))
+
+
+def write_csv_atomic(df, path):
+    """Write df to path through a temporary file in the same directory
+    so readers never see a partially written file."""
+    dir_name = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", newline="") as out_file:
+            df.to_csv(out_file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class SqliteTokens(metaclass=TokensMeta):
+    """Tokens stored in an indexed SQLite database.
+
+    Every write is a single row transaction, so several processes can
+    share the database file. Each thread gets its own connection."""
+    db_ev = "EBAPI_TOKENS_DB"
+    missing_env_var = "Enviornment Variable {} Not Found"
+    unknown_tstat = "Unknown Thermostat ID: {}"
+    busy_timeout = 30
+    schema = [
+        """CREATE TABLE IF NOT EXISTS users (
+               user_id TEXT PRIMARY KEY,
+               access_token TEXT,
+               refresh_token TEXT,
+               expires_at REAL)""",
+        """CREATE TABLE IF NOT EXISTS tstats (
+               tstat_id TEXT PRIMARY KEY,
+               user_id TEXT NOT NULL REFERENCES users (user_id))""",
+        "CREATE INDEX IF NOT EXISTS tstats_user_id ON tstats (user_id)"]
+
+    def __init__(self, db_file=None, verbose=False):
+        if db_file is None:
+            db_file = self.load_db_ev()
+        self.db_file = db_file
+        self.local = threading.local()
+        self.init_schema()
+
+    def load_db_ev(self):
         try:
-            tokens = (jsn["access_token"], jsn["refresh_token"])
-            return tokens
-        except:
-            raise RuntimeError("Error parsing Json:\n {}".format(jsn))
+            return os.environ[self.db_ev]
+        except KeyError:
+            raise EnvironmentError(self.missing_env_var.format(self.db_ev))
+
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=self.busy_timeout,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run the block in an immediate write transaction."""
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def init_schema(self):
+        with self.transaction() as conn:
+            for statement in self.schema:
+                conn.execute(statement)
+            cols = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+            if "expires_at" not in cols:
+                conn.execute("ALTER TABLE users ADD COLUMN expires_at REAL")
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def refresh(self, refresh_func=None, max_workers=default_refresh_workers):
+        """Refresh every user's tokens concurrently and save them in one
+        transaction. See FileTokens.refresh."""
+        if refresh_func is None:
+            refresh_func = refresh_token
+        ref_tokens = self.get_refresh_tokens()
+        new_tokens, failures = refresh_all(ref_tokens, refresh_func, max_workers)
+        self.update_tokens(new_tokens)
+        log_failures(failures)
+        return failures
+
+    def get_refresh_tokens(self):
+        rows = self.connect().execute("SELECT user_id, refresh_token FROM users")
+        return dict(rows.fetchall())
+
+    def refresh_user(self, user_id, refresh_func=None):
+        """Refresh and save the tokens of a single user."""
+        if refresh_func is None:
+            refresh_func = refresh_token
+        new_tokens = refresh_func(self.lookup_refresh_token(user_id))
+        self.update_tokens({user_id: new_tokens})
+        return new_tokens
+
+    def lookup_refresh_token(self, user_id):
+        row = self.connect().execute("SELECT refresh_token FROM users WHERE user_id = ?",
+                                     (str(user_id),)).fetchone()
+        if row is None:
+            raise KeyError("No tokens found for user {}".format(user_id))
+        return row[0]
+
+    def update_tokens(self, new_tokens):
+        """Store new (access_token, refresh_token[, expires_at]) tuples
+        keyed by user_id."""
+        if not new_tokens:
+            return
+        rows = [unpack_tokens(t) + (str(user_id),)
+                for user_id, t in new_tokens.items()]
+        with self.transaction() as conn:
+            conn.executemany("UPDATE users SET access_token = ?, refresh_token = ?, "
+                             "expires_at = ? WHERE user_id = ?", rows)
 
+    def get_next_user_id(self):
+        row = self.connect().execute(
+            "SELECT COALESCE(MAX(CAST(user_id AS INTEGER)), 0) + 1 FROM users")
+        user_id = row.fetchone()[0]
+        logger.info("Generating New User ID: {}".format(user_id))
+        return user_id
 
-#TODO Add metaclass required methods
-"""
-class Tokens(metaclass=TokensMeta):
+    def delete(self, tstat_id):
+        with self.transaction() as conn:
+            user_id = self.select_user_id(conn, tstat_id)
+            logger.info("Droping Tstat {}".format(tstat_id))
+            conn.execute("DELETE FROM tstats WHERE tstat_id = ?", (tstat_id,))
+            remaining = conn.execute("SELECT 1 FROM tstats WHERE user_id = ? LIMIT 1",
+                                     (user_id,)).fetchone()
+            if remaining is None:
+                logger.info("Droping User {}".format(user_id))
+                conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
 
-    def __init__(self):
-        self.table_name = os.environ["TOKENS_TABLE"]
-        self.refresh()
+    def has_tstat(self, tstat_id):
+        row = self.connect().execute("SELECT 1 FROM tstats WHERE tstat_id = ?",
+                                     (tstat_id,)).fetchone()
+        return row is not None
 
-    def refresh(self):
-        sql = "SELECT Identifier, access_token FROM {}".format(self.table_name)
-        df = get_df(sql, "rds", index_col=["Identifier"])
-        self.tokens = df
+    def has_user(self, user_id):
+        row = self.connect().execute("SELECT 1 FROM users WHERE user_id = ?",
+                                     (str(user_id),)).fetchone()
+        return row is not None
 
-    def insert(self, tstat_id, access_token, refresh_token):
-                
+    def insert(self, user_id, tstat_id, acc, ref, expires_at=None):
+        self.insert_user(user_id, acc, ref, expires_at)
+        self.insert_tstat(user_id, tstat_id)
+
+    def insert_user(self, user_id, acc, ref, expires_at=None):
+        try:
+            with self.transaction() as conn:
+                conn.execute("INSERT INTO users (user_id, access_token, refresh_token, "
+                             "expires_at) VALUES (?, ?, ?, ?)",
+                             (str(user_id), acc, ref, expires_at))
+        except sqlite3.IntegrityError:
+            raise RuntimeError("Attempt to overwrite user {}".format(user_id))
+
+    def insert_tstat(self, user_id, tstat_id):
+        try:
+            with self.transaction() as conn:
+                conn.execute("INSERT INTO tstats (tstat_id, user_id) VALUES (?, ?)",
+                             (tstat_id, str(user_id)))
+        except sqlite3.IntegrityError:
+            msg = "ID: {} Already entered for User: {}".format(tstat_id, user_id)
+            raise ResourceWarning(msg)
 
     def get_access_token(self, tstat_id):
-        return self.tokens.loc[tstat_id, "access_token"]
+        return self.get_token_info(tstat_id)[1]
+
+    def get_token_info(self, tstat_id):
+        """Return the (user_id, access_token, expires_at) of tstat_id.
+
+        expires_at is None when the expiry is unknown."""
+        row = self.connect().execute(
+            "SELECT tstats.user_id, users.access_token, users.expires_at "
+            "FROM tstats LEFT JOIN users ON users.user_id = tstats.user_id "
+            "WHERE tstats.tstat_id = ?", (tstat_id,)).fetchone()
+        if row is None:
+            raise KeyError(self.unknown_tstat.format(tstat_id))
+        if row[1] is None:
+            raise KeyError("No tokens found for user {}".format(row[0]))
+        return row
+
+    def lookup_access_token(self, user_id):
+        row = self.connect().execute("SELECT access_token FROM users WHERE user_id = ?",
+                                     (str(user_id),)).fetchone()
+        if row is None:
+            raise KeyError("No tokens found for user {}".format(user_id))
+        return row[0]
+
+    def get_user_id(self, tstat_id):
+        return self.select_user_id(self.connect(), tstat_id)
+
+    def select_user_id(self, conn, tstat_id):
+        row = conn.execute("SELECT user_id FROM tstats WHERE tstat_id = ?",
+                           (tstat_id,)).fetchone()
+        if row is None:
+            raise KeyError(self.unknown_tstat.format(tstat_id))
+        return row[0]
+
+    def get_tstats(self):
+        """Return (tstat_id, user_id) pairs for every thermostat."""
+        rows = self.connect().execute("SELECT tstat_id, user_id FROM tstats "
+                                      "ORDER BY tstat_id")
+        return rows.fetchall()
+
+    def display_tokens(self):
+        print("Users")
+        for row in self.connect().execute("SELECT * FROM users"):
+            print(row)
+        print()
+        print("Thermostats")
+        for row in self.get_tstats():
+            print(row)
+        print()
+
+
+backends = {"file": FileTokens,
+            "sqlite": SqliteTokens}
+
+
+def get_backend(name=None):
+    """Return the token store class called name.
 
-"""
+    name defaults to the EBAPI_TOKENS_BACKEND environment variable and
+    then to the csv file backend."""
+    if name is None:
+        name = os.environ.get(backend_ev, "file")
+    try:
+        return backends[name]
+    except KeyError:
+        msg = "Unknown token backend {}, expected one of {}"
+        raise ValueError(msg.format(name, ", ".join(backends)))
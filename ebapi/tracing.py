@@ -0,0 +1,141 @@
+"""Spans timing the phases of ApiConnection requests."""
+
+import os
+import time
+import threading
+import contextvars
+
+current_span = contextvars.ContextVar("ebapi_current_span", default=None)
+
+
+class NullTracer:
+    """Records nothing, the default tracer."""
+
+    def span(self, name, **attributes):
+        return null_span
+
+
+class NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+null_span = NullSpan()
+
+
+class RecordingTracer:
+    """Keeps every finished span in memory.
+
+    Spans opened inside another span, in the same thread or task, are
+    its children and share its trace id. to_json exports them in the
+    shape of OpenTelemetry's json span format and breakdown totals the
+    time spent in each phase."""
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        return Span(self, name, attributes)
+
+    def record(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+    def get_spans(self, name=None):
+        with self.lock:
+            spans = list(self.spans)
+        return [span for span in spans if name is None or span.name == name]
+
+    def to_json(self):
+        return [span.to_json() for span in self.get_spans()]
+
+    def breakdown(self, spans=None):
+        """Return {name: {"count": n, "seconds": total}} of spans,
+        slowest phase first."""
+        spans = self.get_spans() if spans is None else spans
+        phases = {}
+        for span in spans:
+            phase = phases.setdefault(span.name, {"count": 0, "seconds": 0})
+            phase["count"] += 1
+            phase["seconds"] += span.duration()
+        return dict(sorted(phases.items(), key=lambda item: -item[1]["seconds"]))
+
+
+class Span:
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = None
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = None
+        self.start_time = None
+        self.end_time = None
+        self.error = None
+        self.token = None
+
+    def __enter__(self):
+        parent = current_span.get()
+        if parent is None:
+            self.trace_id = os.urandom(16).hex()
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        self.token = current_span.set(self)
+        self.start_time = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_time = time.time_ns()
+        current_span.reset(self.token)
+        if exc is not None:
+            self.error = "{}: {}".format(exc_type.__name__, exc)
+        self.tracer.record(self)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def duration(self):
+        return (self.end_time - self.start_time) / 1e9
+
+    def to_json(self):
+        status = {"code": "STATUS_CODE_UNSET"}
+        if self.error is not None:
+            status = {"code": "STATUS_CODE_ERROR", "message": self.error}
+        return {"traceId": self.trace_id,
+                "spanId": self.span_id,
+                "parentSpanId": self.parent_id or "",
+                "name": self.name,
+                "kind": "SPAN_KIND_CLIENT" if self.name == "network"
+                        else "SPAN_KIND_INTERNAL",
+                "startTimeUnixNano": str(self.start_time),
+                "endTimeUnixNano": str(self.end_time),
+                "attributes": [format_attribute(key, val)
+                               for key, val in self.attributes.items()],
+                "status": status}
+
+
+def format_attribute(key, val):
+    if isinstance(val, bool):
+        value = {"boolValue": val}
+    elif isinstance(val, int):
+        value = {"intValue": str(val)}
+    elif isinstance(val, float):
+        value = {"doubleValue": val}
+    else:
+        value = {"stringValue": str(val)}
+    return {"key": key, "value": value}
@@ -0,0 +1,136 @@
+"""HTTP transports used by ApiConnection to reach the ecobee API."""
+
+import json
+
+default_pool_size = 10
+default_pool_hosts = 4
+default_connect_timeout = 3.05
+default_read_timeout = 30
+
+
+class Transport:
+    """Sends the HTTP requests of an ApiConnection.
+
+    Subclasses implement request and return an object with status_code,
+    content and json, like a requests.Response. Pass an instance to ApiConnection
+    to point the SDK at a stub server or a benchmark harness."""
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        raise NotImplementedError("Transports must implement request")
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(Transport):
+    """A pooled keep-alive transport backed by a requests.Session.
+
+    Connections are reused across calls so only the first request to a
+    host pays for the TCP and TLS handshakes. pool_size bounds the
+    number of connections kept open per host, pool_hosts the number of
+    hosts with a pool and block makes callers wait for a free
+    connection instead of opening throwaway ones."""
+
+    def __init__(self, pool_size=default_pool_size,
+                 pool_hosts=default_pool_hosts,
+                 connect_timeout=default_connect_timeout,
+                 read_timeout=default_read_timeout,
+                 block=False, session=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = session if session is not None else requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts,
+                              pool_maxsize=pool_size,
+                              pool_block=block)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class Response:
+    """A fully read HTTP response.
+
+    Transports that do not hand back a requests.Response return one of
+    these so ApiConnection can treat every transport the same way."""
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers if headers is not None else {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncTransport:
+    """Sends the HTTP requests of an AsyncApiConnection.
+
+    Subclasses implement the request coroutine and return a Response."""
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def request(self, method, url, **kwargs):
+        raise NotImplementedError("Transports must implement request")
+
+    async def close(self):
+        pass
+
+
+class AiohttpTransport(AsyncTransport):
+    """A pooled keep-alive transport backed by an aiohttp.ClientSession.
+
+    aiohttp is an optional dependency, install it with ebapi[async].
+    The session is created on first use so that it binds to the running
+    event loop."""
+
+    def __init__(self, pool_size=default_pool_size,
+                 connect_timeout=default_connect_timeout,
+                 read_timeout=default_read_timeout):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError("AiohttpTransport requires aiohttp, install ebapi[async]")
+        self.aiohttp = aiohttp
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                             sock_read=read_timeout)
+        self.session = None
+
+    def get_session(self):
+        if self.session is None:
+            connector = self.aiohttp.TCPConnector(limit_per_host=self.pool_size)
+            self.session = self.aiohttp.ClientSession(connector=connector,
+                                                      timeout=self.timeout)
+        return self.session
+
+    async def request(self, method, url, **kwargs):
+        session = self.get_session()
+        try:
+            async with session.request(method, url, **kwargs) as resp:
+                content = await resp.read()
+                return Response(resp.status, content, dict(resp.headers))
+        except self.aiohttp.ClientConnectionError as err:
+            # Raised as the builtin so RetryPolicy can tell it apart.
+            raise ConnectionError(str(err)) from err
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,179 @@
+"""Merge settings and program updates to a thermostat into one post."""
+
+import time
+import threading
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+default_window = 2.0
+
+
+class WriteBuffer:
+    """Holds settings and program updates and sends them together.
+
+    The updates of a thermostat made within window seconds of its first
+    pending update are merged into a single send_post, a later value of
+    a key replacing an earlier one. Each update returns a Future of the
+    response of the post that carried it.
+
+    Pending writes are sent by a background thread when their window
+    ends, by flush, or by close, which also stops the thread. Only one
+    post per thermostat is in flight at a time: updates made during a
+    post wait for it to finish, so an older value never lands last. An
+    update whose Future is cancelled before the post is left out of it,
+    and a write whose updates were all cancelled is dropped."""
+
+    def __init__(self, conn, window=default_window, clock=time.monotonic):
+        self.conn = conn
+        self.window = window
+        self.clock = clock
+        self.pending = {}
+        self.in_flight = set()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = None
+
+    def update_settings(self, settings, identifier):
+        return self.add(identifier, "settings", settings)
+
+    def update_disable_precool_setting(self, identifier, cool_flag):
+        return self.update_settings({"disablePreCooling": cool_flag}, identifier)
+
+    def update_program(self, program, identifier):
+        return self.add(identifier, "program", program.to_json())
+
+    def add(self, identifier, part, values):
+        """Add values for part to the pending write of identifier and
+        return the Future of its post."""
+        future = Future()
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("WriteBuffer is closed")
+            write = self.pending.get(identifier)
+            if write is None:
+                write = PendingWrite(self.clock() + self.window)
+                self.pending[identifier] = write
+            write.add(part, dict(values), future)
+            self.start()
+            self.cond.notify_all()
+        return future
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name="ebapi-write-buffer")
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.cond:
+                due = self.pop_due_now()
+                while not due and not self.closed:
+                    self.cond.wait(self.get_wait())
+                    due = self.pop_due_now()
+                if not due and self.closed:
+                    return
+            try:
+                self.send(due)
+            except Exception:
+                # One failed write must not stop the writes after it.
+                logger.exception("Buffered writes failed")
+
+    def get_wait(self):
+        deadlines = [write.deadline for identifier, write in self.pending.items()
+                     if identifier not in self.in_flight]
+        if not deadlines:
+            return None
+        return max(min(deadlines) - self.clock(), 0)
+
+    def pop_due(self, now=None):
+        """Take the writes due by now, every write when now is None,
+        except those of thermostats with a post in flight."""
+        if now is None:
+            now = float("inf")
+        due = {identifier: write for identifier, write in self.pending.items()
+               if write.deadline <= now and identifier not in self.in_flight}
+        for identifier in due:
+            del self.pending[identifier]
+        self.in_flight.update(due)
+        return due
+
+    def pop_due_now(self):
+        return self.pop_due(self.clock())
+
+    def flush(self):
+        """Send every pending write now and wait for the responses,
+        including those of posts the background thread already took."""
+        while True:
+            with self.cond:
+                due = self.pop_due()
+                while not due and self.in_flight:
+                    self.cond.wait()
+                    due = self.pop_due()
+                if not due:
+                    return
+            self.send(due)
+
+    def close(self):
+        """Send the pending writes and stop the background thread."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.flush()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, writes):
+        jobs = list(writes.items())
+        try:
+            if jobs:
+                self.conn.run_jobs(self.send_write, jobs, None)
+        finally:
+            with self.cond:
+                self.in_flight.difference_update(writes)
+                self.cond.notify_all()
+
+    def send_write(self, identifier, write):
+        """Post the updates of write whose Futures were not cancelled."""
+        updates = [update for update in write.updates
+                   if update[2].set_running_or_notify_cancel()]
+        if not updates:
+            return
+        futures = [future for _, _, future in updates]
+        try:
+            resp = self.conn.send_post(get_body(updates), identifier)
+        except Exception as err:
+            logger.warning("Buffered write failed on Thermostat {}: {}".format(identifier, err))
+            for future in futures:
+                future.set_exception(err)
+        else:
+            for future in futures:
+                future.set_result(resp)
+
+
+class PendingWrite:
+    """The (part, values, Future) updates of one thermostat waiting to
+    be sent."""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.updates = []
+
+    def add(self, part, values, future):
+        self.updates.append((part, values, future))
+
+
+def get_body(updates):
+    """Merge updates into one post body, later values replacing earlier."""
+    parts = {}
+    for part, values, _ in updates:
+        parts.setdefault(part, {}).update(values)
+    return {"thermostat": parts}
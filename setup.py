@@ -6,6 +6,10 @@ REQUIREMENTS = [
           'sqlalchemy',
           'pymysql']
 
+EXTRAS = {
+          'async': ['aiohttp'],
+          'fast': ['orjson']}
+
 setup(
     name="ebapi",
     version="0.1.0",
@@ -18,4 +22,5 @@ setup(
     ],  
     packages=find_packages(),
     install_requires=REQUIREMENTS,
+    extras_require=EXTRAS,
 )